@@ -1,166 +1,540 @@
 import argparse
 import numpy as np
-from pyevio import EvioFile
 import matplotlib.pyplot as plt
 import os
+import re
+import sys
 import json
+import shutil
+import time
+
+from sro_columns import SROColumnWriter, write_manifest, append_sro_columns
+from sro_histograms import SROHistograms
+from sro_merge import MERGERS
+
+# shared EVIO helpers live in evio_common/ at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from evio_common.parallel import iter_range_events, run_parallel
+from evio_common.batch import group_by_run, plan_batch, BatchProgress
+from evio_common.payload import bank_words, open_evio, release_views
+from evio_common.index import load_index, STREAMING_TAG
+from evio_common.cache import DecodeCache
+from evio_common.follow import RecordFollower
+from evio_common.jit import jit, HAVE_NUMBA, ENGINES, DEFAULT_ENGINE
+from evio_common.profiling import StageProfiler, profile_stage, path_bytes
+from evio_common.diagnostics import Diagnostics, report, save_diagnostics
+
+# Version of the decoded output; a new version invalidates the decode cache
+DECODER_VERSION = 2
+
+# Typed columns of the decoded streaming hits.
+# Hit word: bit 31=0, bit 30:17=4ns timestamp, 16:13=channel, 12:0=charge
+HIT_DTYPES = {
+    'payload_id': np.uint16,
+    'payload_ch': np.uint8,
+    'payload_timestamp': np.uint16,
+    'payload_charge': np.uint16,
+}
+# ROC id of every hit (the tag of its ROC time slice bank), added per frame by merge_hit_columns
+PAYLOAD_ROC_DTYPE = np.uint16
+
+def decode_hit_words(words, payload_id):
+    """
+    Decode the hit words of one payload bank into typed NumPy columns.
+
+    The bit fields are extracted over the whole word array at once. Words
+    with bit 31 set are not hit words; they are dropped (process_event
+    reports them).
+
+    Args:
+        words: Array of 32-bit hit words from one payload bank
+        payload_id: Tag of the payload bank
+
+    Returns:
+        dict: Arrays 'payload_id', 'payload_ch', 'payload_timestamp' and 'payload_charge'
+    """
+    words = np.asarray(words, dtype=np.uint32)
+
+    bad = (words & 0x80000000) != 0
+    if bad.any():
+        words = words[~bad]
 
-def process_event(event, event_index, verbose=False):
+    return {
+        'payload_id': np.full(len(words), payload_id, dtype=HIT_DTYPES['payload_id']),
+        'payload_ch': ((words >> 13) & 0xF).astype(HIT_DTYPES['payload_ch']),
+        'payload_timestamp': ((words >> 17) & 0x3FFF).astype(HIT_DTYPES['payload_timestamp']),
+        'payload_charge': (words & 0x1FFF).astype(HIT_DTYPES['payload_charge']),
+    }
+
+def decode_hit_words_loop(words, payload_id):
+    """
+    Reference decoder: the same result as decode_hit_words, one word at a time.
+
+    Args:
+        words: Array of 32-bit hit words from one payload bank
+        payload_id: Tag of the payload bank
+
+    Returns:
+        dict: Arrays 'payload_id', 'payload_ch', 'payload_timestamp' and 'payload_charge'
+    """
+    hits = {key: [] for key in HIT_DTYPES}
+    for word in words:
+        if (word & 0x80000000) != 0:
+            continue
+        # bit 31=0, bit 30:17=4ns timestamp, 16:13=channel, 12:0=charge
+        tmp_timestamp = int((word & 0x7FFE0000)>>17)
+        tmp_chan = int((word & 0x1E000)>>13)
+        tmp_charge = int((word & 0x1FFF))
+
+        hits['payload_id'].append(payload_id)
+        hits['payload_ch'].append(tmp_chan)
+        hits['payload_timestamp'].append(tmp_timestamp)
+        hits['payload_charge'].append(tmp_charge)
+
+    return {key: np.array(values, dtype=HIT_DTYPES[key]) for key, values in hits.items()}
+
+@jit
+def _unpack_hit_words(words, channel, timestamp, charge):
+    """Compiled kernel of decode_hit_words_numba: unpack the hit words, skipping words with bit 31 set."""
+    n_hits = 0
+    for i in range(len(words)):
+        word = words[i]
+        if word & 0x80000000:
+            continue
+        timestamp[n_hits] = (word >> 17) & 0x3FFF
+        channel[n_hits] = (word >> 13) & 0xF
+        charge[n_hits] = word & 0x1FFF
+        n_hits += 1
+    return n_hits
+
+def decode_hit_words_numba(words, payload_id):
+    """
+    The same result as decode_hit_words, unpacked by a numba kernel in one pass.
+
+    Args:
+        words: Array of 32-bit hit words from one payload bank
+        payload_id: Tag of the payload bank
+
+    Returns:
+        dict: Arrays 'payload_id', 'payload_ch', 'payload_timestamp' and 'payload_charge'
+    """
+    # the kernel takes native byte order words
+    words = np.asarray(words, dtype=np.uint32)
+    channel = np.empty(len(words), dtype=HIT_DTYPES['payload_ch'])
+    timestamp = np.empty(len(words), dtype=HIT_DTYPES['payload_timestamp'])
+    charge = np.empty(len(words), dtype=HIT_DTYPES['payload_charge'])
+    n_hits = _unpack_hit_words(words, channel, timestamp, charge)
+
+    return {
+        'payload_id': np.full(n_hits, payload_id, dtype=HIT_DTYPES['payload_id']),
+        'payload_ch': channel[:n_hits],
+        'payload_timestamp': timestamp[:n_hits],
+        'payload_charge': charge[:n_hits],
+    }
+
+# Hit word decoder of each --engine (see evio_common/jit.py)
+HIT_DECODERS = {
+    'python': decode_hit_words_loop,
+    'numpy': decode_hit_words,
+    'numba': decode_hit_words_numba,
+}
+
+def concat_hit_columns(hit_columns):
+    """
+    Concatenate the decoded columns of several payload banks.
+
+    Args:
+        hit_columns: List of dicts returned by decode_hit_words
+
+    Returns:
+        dict: One array per hit column (empty arrays for an empty list)
+    """
+    if len(hit_columns) == 0:
+        return {key: np.zeros(0, dtype=dtype) for key, dtype in HIT_DTYPES.items()}
+    return {key: np.concatenate([hits[key] for hits in hit_columns]) for key in HIT_DTYPES}
+
+def merge_hit_columns(hit_columns, stream_rocs, merge_order):
+    """
+    Join the decoded columns of the payload banks of a frame into one hit stream in time order.
+
+    Args:
+        hit_columns: List of dicts returned by decode_hit_words, one per payload bank
+        stream_rocs: ROC id of each payload bank
+        merge_order: Merge of the time-ordered streams, a MERGERS value (see sro_merge.py)
+
+    Returns:
+        dict: One array per hit column and 'payload_roc', hits sorted by payload_timestamp
+    """
+    hits = concat_hit_columns(hit_columns)
+    counts = [len(columns['payload_id']) for columns in hit_columns]
+    hits['payload_roc'] = np.repeat(np.asarray(stream_rocs, dtype=PAYLOAD_ROC_DTYPE), counts)
+    bounds = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+    order = merge_order(hits['payload_timestamp'], bounds)
+    return {key: column[order] for key, column in hits.items()}
+
+def dump_event(root_bank, event_index):
+    """
+    Print the banks of a streaming event (verbose mode), all ROC time slice banks.
+
+    Args:
+        root_bank: Root bank of the event
+        event_index: Index of this event
+    """
+    print(f"Event {event_index}: root bank tag 0x{root_bank.tag:04X}")
+    if root_bank.tag != STREAMING_TAG:
+        return
+    children = list(root_bank.get_children())
+    print("children: ", children)
+    if len(children) < 2:
+        return
+
+    words = bank_words(children[0])
+    print("data words in the children[0]:")
+    print(children[0].get_hex_dump())
+    if len(words) >= 4:
+        print("-----------------------")
+        print("   Stream Infor Bank   ")
+        print("frame number:  ", words[1])
+        print("time stamp  :  ", int(words[2]) + (int(words[3]) << 32))
+        print("-----------------------")
+
+    for rts_bank in children[1:]:
+        rts_children = rts_bank.get_children()
+        print(f"roc {rts_bank.tag} time slice bank's children: ", rts_children)
+        if len(rts_children) == 0:
+            continue
+        print("data words in the roc time slice bank stream info bank:")
+        print(rts_children[0].get_hex_dump())
+        for bank in rts_children[1:]:
+            print("payload id:  ", bank.tag)
+            print("payload data length: ", bank.data_length)
+            print("     Payload Data      ")
+            print(bank.get_hex_dump())
+
+def process_event(event, event_index, verbose=False, engine=DEFAULT_ENGINE, profiler=None, diagnostics=None,
+                  keep_mismatched=False):
     """
     Process a single event to extract FADC data.
 
     Args:
         event: Event object to process
         event_index: Index of this event
-        verbose: Enable verbose output
+        verbose: Print the banks of the event (dump_event)
+        engine: Hit word decoder, a key of HIT_DECODERS
+        profiler: Optional StageProfiler that takes the time of the bank
+            traversal, the payload decoding and the frame dict building
+        diagnostics: Optional Diagnostics that counts the bad events and keeps
+            hex dumps of the first ones; without one the errors are printed
+        keep_mismatched: Keep the frames whose FF30 frame number or timestamp
+            differs from the FF31 one (reported all the same), for validate_sro_frames.py
 
     Returns:
         dict: Dictionary containing processed event data or None if no valid data
     """
+    if profiler is not None:
+        event_start = time.perf_counter()
+        decode_seconds = build_seconds = 0.0
+        n_bytes = 0
     try:
         # Get the root bank for this event
         root_bank = event.get_bank()
+        if verbose:
+            dump_event(root_bank, event_index)
 
-        # Check for physics events (0xFF50 or 0xFF60)
-        if root_bank.tag not in [0xFF60]:   #streaming bank
-            if verbose:
-                print(f"Skipping non-physics event {event_index} with tag 0x{root_bank.tag:04X}")
+        # Check for physics events (0xFF60 streaming bank)
+        if root_bank.tag != STREAMING_TAG:
+            if diagnostics is not None:
+                diagnostics.report("non-physics event", event_index, f"root bank tag 0x{root_bank.tag:04X}")
             return None
 
-        # Get child banks
+        # Get child banks: FF31 bank (stream info bank) and the ROC time slice banks
         children = list(root_bank.get_children())
-        if verbose:
-            print("children: ",children)
         if len(children) < 2:
+            report(diagnostics, "short event", event_index, f"{len(children)} banks in the time frame",
+                   bank_words(root_bank))
             return None
-
-        # Find FF31 bank (streaming info bank)
-        if children[0].tag == 0xFF31:
-            if verbose:
-                print(f"Found FF31 bank in event {event_index}")
-        else:
+        if children[0].tag != 0xFF31:
+            report(diagnostics, "missing FF31", event_index, f"first bank tag 0x{children[0].tag:04X}",
+                   bank_words(root_bank))
             return None
 
+        hit_columns = []   # decoded columns of each payload bank, ROC bank by ROC bank
+        stream_rocs = []   # ROC id of each of them
+        rocs = {'roc_id': [], 'roc_frame_number': [], 'roc_timestamp': [], 'roc_hit_count': []}
+        decode_hits = HIT_DECODERS[engine]
+
+        words = bank_words(children[0])
+        frame_number = int(words[1])
+        sib_timestamp = int(words[2]) + (int(words[3]) << 32)
+
+        # one roc time slice bank per ROC (crate), each with its FF30 bank (streaming info bank) first
+        for rts_bank in children[1:]:
+            roc_id = rts_bank.tag
+            rts_children = rts_bank.get_children()
+            if len(rts_children) == 0 or rts_children[0].tag != 0xFF30:
+                report(diagnostics, "missing FF30", event_index, f"ROC {roc_id} time slice bank without FF30 bank",
+                       bank_words(rts_bank))
+                return None
+
+            words = bank_words(rts_children[0])
+            rts_frame_number = int(words[1])
+            rts_sib_timestamp = int(words[2]) + (int(words[3]) << 32)
+
+            if rts_frame_number != frame_number:
+                report(diagnostics, "frame number mismatch", event_index,
+                       f"ROC {roc_id} time slice bank frame number {rts_frame_number} != "
+                       f"Stream Info Bank frame number {frame_number}", bank_words(root_bank))
+                if not keep_mismatched:
+                    return None
+
+            elif rts_sib_timestamp != sib_timestamp:
+                report(diagnostics, "timestamp mismatch", event_index,
+                       f"ROC {roc_id} time slice bank time stamp {rts_sib_timestamp} != "
+                       f"Stream Info Bank time stamp {sib_timestamp}", bank_words(root_bank))
+                if not keep_mismatched:
+                    return None
+
+            n_roc_hits = 0
+            for bank in rts_children[1:]:
+                payload_id = bank.tag
+                # view of the payload words in the file mapping (no copy)
+                words = bank_words(bank)
+                if len(words) == 0:
+                    continue
+
+                if profiler is not None:
+                    start = time.perf_counter()
+                hits = decode_hits(words, payload_id)
+                if profiler is not None:
+                    decode_seconds += time.perf_counter() - start
+                    n_bytes += words.nbytes
+                hit_columns.append(hits)
+                stream_rocs.append(roc_id)
+                n_roc_hits += len(hits['payload_id'])
+
+                # the decoders drop the words with bit 31 set
+                if len(hits['payload_id']) < len(words):
+                    bad = words[(words & 0x80000000) != 0]
+                    report(diagnostics, "bit 31 set", event_index,
+                           f"{len(bad)} hit words of ROC {roc_id} payload {payload_id} with bit 31 set", bad,
+                           count=len(bad))
+
+            rocs['roc_id'].append(roc_id)
+            rocs['roc_frame_number'].append(rts_frame_number)
+            rocs['roc_timestamp'].append(rts_sib_timestamp)
+            rocs['roc_hit_count'].append(n_roc_hits)
+
+        if profiler is not None:
+            start = time.perf_counter()
         event_data = {
-                'sib_frame_number':0,
-                'sib_timestamp':0,
-                'rts_frame_number':0,
-                'rts_sib_timestamp':0,
-                'payload_id':[],
-                'payload_ch':[],
-                'payload_timestamp':[],
-                'payload_charge':[]
+                'sib_frame_number': frame_number,
+                'sib_timestamp': sib_timestamp,
+                # FF30 bank of the first ROC (all of them in the roc_* lists)
+                'rts_frame_number': rocs['roc_frame_number'][0],
+                'rts_sib_timestamp': rocs['roc_timestamp'][0],
                 }
+        event_data.update(merge_hit_columns(hit_columns, stream_rocs, MERGERS[engine]))
+        event_data.update(rocs)
+        if profiler is not None:
+            build_seconds += time.perf_counter() - start
 
-        sib_bank = children[0]
-        sib_info = sib_bank.get_data()
-        words = np.frombuffer(sib_info, dtype=np.dtype(f'{sib_bank.endian}u4'))
-        if verbose:
-            sib_hex = sib_bank.get_hex_dump()
-            print("data words in the children[0]:")
-            print(sib_hex)
-
-        frame_number = words[1]   
-        sib_timestamp1 = words[2]
-        sib_timestamp2 = words[3]
-        sib_timestamp = sib_timestamp1 + (sib_timestamp2<<32)
-
-        event_data['sib_frame_number']=int(frame_number)
-        event_data['sib_timestamp']=int(sib_timestamp)
+        return event_data
 
-        if verbose:
-            print("-----------------------")
-            print("   Stream Infor Bank   ")
-            print("frame number:  ", frame_number)
-            print("time stamp  :  ", sib_timestamp)
-            print("-----------------------")
-
-        # roc time slice bank
-        rts_bank = children[1]
-        rts_children = rts_bank.get_children()
+    except Exception as e:
+        report(diagnostics, "exception", event_index, f"{type(e).__name__}: {e}")
+        return None
 
-        # Get child banks
-        if verbose:
-            print("roc time slice bank's children: ",rts_children)
-        if len(children) < 2:
-            return None
+    finally:
+        if profiler is not None:
+            profiler.add("decode payload", decode_seconds, n_bytes)
+            profiler.add("build frames", build_seconds)
+            profiler.add("bank traversal", time.perf_counter() - event_start - decode_seconds - build_seconds)
 
-        rts_sib_bank = rts_children[0]
-        # Find FF30 bank (streaming info bank)
-        if rts_sib_bank.tag == 0xFF30:
-            if verbose:
-                print(f"Found FF30 bank in event {event_index}")
-        else:
-            return None
-        
-        rts_sib_info = rts_sib_bank.get_data()
-        words = np.frombuffer(rts_sib_info, dtype=np.dtype(f'{rts_sib_bank.endian}u4'))
-        if verbose:
-            rts_sib_hex = rts_sib_bank.get_hex_dump()
-            print("data words in the roc time slice bank stream info bank:")
-            print(rts_sib_hex)
+def diagnostics_path(output_dir, run_number):
+    """json file with the decode errors of a run (evio_common/diagnostics.py)."""
+    return os.path.join(output_dir, f"fadc_sro_diagnostics_run{run_number}.json")
 
-        rts_frame_number = words[1]   
-        rts_sib_timestamp1 = words[2]
-        rts_sib_timestamp2 = words[3]
-        rts_sib_timestamp = rts_sib_timestamp1 + (rts_sib_timestamp2<<32)
+def decode_record_range(filename, record_start, record_stop, first_event, max_event, part_path,
+                        output_format="json", chunk_size=None, verbose=False, engine=DEFAULT_ENGINE,
+                        max_dumps=3, keep_mismatched=False):
+    """
+    Worker of the parallel decode: decode a range of records into one partial output.
 
-        event_data['rts_frame_number']=int(rts_frame_number)
-        event_data['rts_sib_timestamp']=int(rts_sib_timestamp)
+    Args:
+        filename: Input EVIO file
+        record_start: First record (inclusive)
+        record_stop: Last record (exclusive)
+        first_event: Global index of the first event of record_start
+        max_event: Stop before this global event index
+        part_path: Partial output: a columnar directory, or a .json file
+        output_format: "json" or "columnar"
+        chunk_size: Chunk size of the columnar partial output (None for one write)
+        verbose: Enable verbose output
+        engine: Hit word decoder, see process_event
+        max_dumps: Hex dumps kept per decode error category
+        keep_mismatched: Keep the frames with FF31/FF30 disagreements, see process_event
 
-        if verbose:
-            print("-------------------------------------------")
-            print("   ROC time slice bank Stream Infor Bank   ")
-            print("frame number:  ", frame_number)
-            print("time stamp  :  ", sib_timestamp)
-            print("-------------------------------------------")
-
-        if rts_frame_number != frame_number:
-            print("ERROR: ROC time slice bank frame number f{rts_frame_number} != Stream Info Bank frame number f{frame_number}")
-            return None
+    Returns:
+        tuple: (manifest entries of the partial output, one per chunk; Diagnostics.to_dict() of the range)
+    """
+    writer = SROColumnWriter(part_path, chunk_size=chunk_size) if output_format == "columnar" else None
+    processed_events = []
+    diagnostics = Diagnostics(max_dumps)
 
-        if rts_sib_timestamp != sib_timestamp:
-            print("ERROR: ROC time slice bank time stamp f{rts_sib_timestamp} != Stream Info Bank time stamp f{sib_timestamp}")
-            return None
+    with open_evio(filename) as evio_file:
+        for global_evt_index, event in iter_range_events(evio_file, record_start, record_stop, first_event):
+            if global_evt_index >= max_event:
+                break
 
-        for bank in rts_children[1:]:
-            payload_id = bank.tag
-            payload_data = bank.get_data()
-            if len(payload_data)==0:
+            event_data = process_event(event, global_evt_index, verbose, engine, diagnostics=diagnostics,
+                                       keep_mismatched=keep_mismatched)
+            if event_data is None:
                 continue
+            if writer is not None:
+                writer.add_frame(event_data, global_evt_index)
             else:
-                if verbose:
-                   print("payload data length: ",len(payload_data))
-
-            words = np.frombuffer(payload_data, dtype=np.dtype(f'{bank.endian}u4'))
+                processed_events.append(event_data)
+
+    if writer is None:
+        with open(part_path, 'w') as file:
+            json.dump(processed_events, file, default=lambda column: column.tolist())
+        return ([{'name': '', 'frames': len(processed_events), 'hits': sum(len(e['payload_id']) for e in processed_events)}],
+                diagnostics.to_dict())
+
+    writer.close()
+    if chunk_size is None:
+        return [{'name': '', 'frames': writer.n_frames, 'hits': writer.n_hits}], diagnostics.to_dict()
+    return writer.chunks, diagnostics.to_dict()
+
+def process_fadc_batch(runs, max_event=None, output_dir="output", verbose=False, output_format="json",
+                       chunk_size=None, jobs=2, summary_file=None, engine=DEFAULT_ENGINE, max_dumps=3,
+                       keep_mismatched=False):
+    """
+    Decode EVIO files on one pool of worker processes and write one output per run.
 
-            if verbose:
-               print("payload id:  ",payload_id)
-               print("     Payload Data      ")
-               payload_hex = bank.get_hex_dump()
-               print(payload_hex)
+    Every file is split into contiguous record ranges, and the ranges of all
+    files go to the same pool. Each worker decodes its range into a partial
+    output. The columnar parts stay as part_NNNNN/ in the output directory
+    of the run and its manifest lists them in file order; the json parts are
+    joined into one file per run. The output is the same for any number of jobs.
 
-            for word in words:
-                if (word & 0x80000000)==1:
-                    print("ERROR: hit word data f{hex(word)} bit 31 is non-zero")
-                    continue
-                # bit 31=0, bit 30:17=4ns timestamp, 16:13=channel, 12:0=charge
-                tmp_timestamp = int((word & 0x7FFE0000)>>17)
-                tmp_chan = int((word & 0x1E000)>>13)
-                tmp_charge = int((word & 0x1FFF))
+    Args:
+        runs: run number -> list of files in order (evio_common.batch.group_by_run)
+        max_event: Maximum number of events to process per file (None for all)
+        output_dir: Directory for output files
+        verbose: Enable verbose output
+        output_format: "json" or "columnar"
+        chunk_size: Chunk size of each columnar part (None for one write per part)
+        jobs: Number of worker processes
+        summary_file: Optional json file for the per-file throughput summary
+        engine: Hit word decoder, see process_event
+        max_dumps: Hex dumps kept per decode error category (see diagnostics_path)
+        keep_mismatched: Keep the frames with FF31/FF30 disagreements, see process_event
+    """
+    plan = plan_batch(runs, jobs, max_event)
+    print(f"Decoding {len(plan)} record ranges of {sum(len(files) for files in runs.values())} files with {jobs} jobs")
+
+    out_paths = {}
+    part_paths = []
+    for run in runs:
+        if output_format == "columnar":
+            out_paths[run] = os.path.join(output_dir, f"fadc_sro_data_run{run}")
+            if os.path.isdir(out_paths[run]):
+                shutil.rmtree(out_paths[run])
+        else:
+            out_paths[run] = os.path.join(output_dir, f"fadc_sro_data_run{run}.json")
+            os.makedirs(os.path.join(output_dir, f".parts_run{run}"), exist_ok=True)
+    for i, task in enumerate(plan):
+        if output_format == "columnar":
+            part_paths.append(os.path.join(out_paths[task['run']], f"part_{i:05d}"))
+        else:
+            part_paths.append(os.path.join(output_dir, f".parts_run{task['run']}", f"part_{i:05d}.json"))
+
+    tasks = [(task['file'], task['record_start'], task['record_stop'], task['first_event'], task['max_event'],
+              part_path, output_format, chunk_size, verbose, engine, max_dumps, keep_mismatched)
+             for task, part_path in zip(plan, part_paths)]
+    progress = BatchProgress(plan)
+    results = run_parallel(decode_record_range, tasks, jobs,
+                           progress=lambda i, result, seconds: progress.done(
+                               i, sum(chunk['frames'] for chunk in result[0]), seconds))
+    part_chunks = [chunks for chunks, _ in results]
+
+    for run, files in runs.items():
+        parts = [i for i, task in enumerate(plan) if task['run'] == run]
+        n_frames = sum(chunk['frames'] for i in parts for chunk in part_chunks[i])
+        n_hits = sum(chunk['hits'] for i in parts for chunk in part_chunks[i])
+        print(f"Run {run}: processed {n_frames} events with FADC data from {len(files)} files")
+
+        diagnostics = Diagnostics(max_dumps)
+        for i in parts:
+            diagnostics.merge(results[i][1])
+        save_diagnostics(diagnostics, diagnostics_path(output_dir, run))
+
+        if output_format == "columnar":
+            # Merge: the manifest lists the chunks of every part in file order
+            chunks = []
+            for i in parts:
+                part_name = os.path.basename(part_paths[i])
+                chunks += [dict(chunk, name=os.path.join(part_name, chunk['name']) if chunk['name'] else part_name)
+                           for chunk in part_chunks[i]]
+            sources = [os.path.abspath(filename) for filename in files]
+            write_manifest(out_paths[run], {
+                'source': sources[0] if len(sources) == 1 else sources,
+                'chunk_size': chunk_size,
+                'next_event': plan[parts[-1]]['max_event'] if len(files) == 1 and parts else None,
+                'complete': True,
+                'chunks': chunks,
+            })
+            print(f"Saved {n_frames} frames and {n_hits} hits to {out_paths[run]}")
 
-                event_data['payload_id'].append(payload_id)
-                event_data['payload_ch'].append(tmp_chan)
-                event_data['payload_timestamp'].append(tmp_timestamp)
-                event_data['payload_charge'].append(tmp_charge)
+        else:
+            # Merge: join the json parts in file order
+            processed_events = []
+            for i in parts:
+                with open(part_paths[i], 'r') as file:
+                    processed_events += json.load(file)
+            shutil.rmtree(os.path.join(output_dir, f".parts_run{run}"))
+
+            if len(processed_events) > 0:
+                with open(out_paths[run], 'w') as file:
+                    json.dump(processed_events, file)
+            else:
+                print(f"No valid FADC data found in run {run}.")
 
-        return event_data
+    progress.summary()
+    if summary_file is not None:
+        progress.save(summary_file)
+        print(f"Saved the batch summary to {summary_file}")
 
-    except Exception as e:
-        print(f"Error processing event {event_index}: {e}")
-        return None
+def process_fadc_data(filename, max_event=None, output_dir="output", verbose=False, output_format="json",
+                      chunk_size=None, resume=False, jobs=1, start=0, stop=None, frame_start=None, frame_stop=None,
+                      use_cache=True, engine=DEFAULT_ENGINE, profiler=None, max_dumps=3, keep_mismatched=False):
+    """
+    Process EVIO file and save the decoded streaming FADC250 hits.
 
-def process_fadc_data(filename, max_event=None, output_dir="output", verbose=False):
+    Args:
+        filename: Input EVIO file
+        max_event: Maximum number of events to process (None for all)
+        output_dir: Directory for output files
+        verbose: Enable verbose output
+        output_format: "json" for a list of frame dictionaries, "columnar" for
+            one .npy file per frame/hit column (see sro_columns.py)
+        chunk_size: Write the columnar output every chunk_size frames instead of
+            holding the whole file in memory (None for one write at the end)
+        resume: Continue a chunked output after its last written chunk
+        jobs: Number of worker processes; more than 1 decodes record ranges in parallel
+        start: First event to decode (one job only)
+        stop: Decode the events before this one (None for all; one job only)
+        frame_start: Only decode the frames with a SIB frame number >= frame_start
+        frame_stop: Only decode the frames with a SIB frame number < frame_stop
+        use_cache: Reuse the output of an earlier decode of the unchanged file,
+            and only decode the new records of a file that grew (one job only)
+        engine: Hit word decoder, see process_event (all give the same output)
+        profiler: Optional StageProfiler (see process_event); also times the index,
+            the record reading, the storing of the frames and the writing (one job only)
+        max_dumps: Hex dumps kept per decode error category (see diagnostics_path)
+        keep_mismatched: Keep the frames with FF31/FF30 disagreements, see process_event
+    """
     print(f"Processing file: {filename}")
 
     # Create output directory if it doesn't exist
@@ -168,53 +542,201 @@ def process_fadc_data(filename, max_event=None, output_dir="output", verbose=Fal
 
     # get the run number
     match = re.search(r'_(\d+)\.evio\.', filename)
-    if match:
-       run_number = match.group(1)
-
+    run_number = match.group(1) if match else "unknown"
+
+    if jobs > 1:
+        return process_fadc_batch({run_number: [filename]}, max_event=max_event, output_dir=output_dir,
+                                  verbose=verbose, output_format=output_format,
+                                  chunk_size=chunk_size, jobs=jobs, engine=engine, max_dumps=max_dumps,
+                                  keep_mismatched=keep_mismatched)
+
+    if output_format == "columnar":
+        out_path = os.path.join(output_dir, f"fadc_sro_data_run{run_number}")
+    else:
+        out_path = output_dir+f"/fadc_sro_data_run{run_number}.json"
+
+    # Decode cache: the options that change the output are part of its key
+    cache = None
+    append = False
+    if use_cache and not resume:
+        cache = DecodeCache(output_dir)
+        options = {'format': output_format, 'chunk_size': chunk_size, 'max_event': max_event, 'start': start,
+                   'stop': stop, 'frame_start': frame_start, 'frame_stop': frame_stop,
+                   'keep_mismatched': keep_mismatched}
+        status, entry = cache.lookup(filename, "fadc250_streaming", DECODER_VERSION, options)
+        whole_file = (max_event is None and start == 0 and stop is None
+                      and frame_start is None and frame_stop is None)
+
+        if status == "hit":
+            print(f"Output is up to date (decode cache): {out_path}")
+            return
+        if status == "grown" and whole_file and entry['outputs']:
+            # only the records written since the last decode are new
+            print(f"File grew since the last decode: decoding the events from {entry['events']}")
+            append = True
+            start = entry['events']
 
     # Open the EVIO file
-    with EvioFile(filename) as evio_file:
-        total_event_count = evio_file.get_total_event_count()
+    with open_evio(filename) as evio_file:
+        # the sidecar index gives the event count and the root tags without parsing the events
+        with profile_stage(profiler, "load index"):
+            index = load_index(evio_file)
+        total_event_count = len(index)
         print(f"File contains {evio_file.record_count} records")
         print(f"File total_event_count = {total_event_count}")
 
+        stop = total_event_count if stop is None else min(stop, total_event_count)
         if max_event is None:
-            max_event = total_event_count
+            max_event = stop
         else:
-            max_event = min(max_event, total_event_count)
+            max_event = min(start + max_event, stop)
 
         print(f"max_event is set to: {max_event}")
 
-        # List to store processed event data
+        # List to store processed event data, or the column writer that takes each frame
         processed_events = []
+        n_processed = 0
+        writer = None
+        diagnostics = Diagnostics(max_dumps)
+        if output_format == "columnar":
+            # a chunked output grows by new chunks, like a resumed decode
+            writer = SROColumnWriter(out_path, chunk_size=chunk_size, source=os.path.abspath(filename),
+                                     resume=resume or (append and chunk_size is not None))
+            if writer.next_event > 0:
+                print(f"Resuming after {len(writer.chunks)} chunks at event {writer.next_event}")
+                start = max(start, writer.next_event)
+
+        # Only the streaming events in the range (and frames) are read
+        selected = index.select(start, max_event, tags=[STREAMING_TAG], frame_start=frame_start, frame_stop=frame_stop)
+        n_in_range = max(max_event - start, 0)
+        if len(selected) < n_in_range:
+            print(f"Skipping {n_in_range - len(selected)} non-physics or out-of-frame-range events")
 
         # Iterate through events
-        for global_evt_index, (record, event) in enumerate(evio_file.iter_events()):
-            if global_evt_index >= max_event:
-                break
-
+        events = index.iter_events(evio_file, selected)
+        if profiler is not None:
+            events = profiler.iterate("read records", events)
+        for global_evt_index, event in events:
             # Process this event
-            event_data = process_event(event, global_evt_index, verbose)
+            event_data = process_event(event, global_evt_index, verbose, engine, profiler, diagnostics,
+                                       keep_mismatched)
 
             # Store valid event data
             if event_data is not None:
-               processed_events.append(event_data)
+               if profiler is not None:
+                  store_start = time.perf_counter()
+               if writer is not None:
+                  writer.add_frame(event_data, global_evt_index)
+               else:
+                  processed_events.append(event_data)
+               if profiler is not None:
+                  profiler.add("store frames", time.perf_counter() - store_start)
+               n_processed += 1
+
+               if verbose and n_processed % 100 == 0:
+                  print(f"Processed {n_processed} valid events so far...")
+
+        print(f"Processed {n_processed} events with FADC data")
+        save_diagnostics(diagnostics, diagnostics_path(output_dir, run_number), append)
+
+        serialize_start = time.perf_counter()
+        if append and writer is not None and chunk_size is None:
+           append_sro_columns(out_path, *writer.columns())
+           print(f"Appended {writer.n_frames} frames and {writer.n_hits} hits to {out_path}")
+
+        elif writer is not None and writer.n_frames > 0:
+           writer.close()
+           print(f"Saved {writer.n_frames} frames and {writer.n_hits} hits to {writer.path}")
+
+        elif n_processed > 0 or append:
+
+           if append:
+              with open(out_path, 'r') as file:
+                   processed_events = json.load(file) + processed_events
+           with open(out_path, 'w') as file:
+                # the hit columns are numpy arrays
+                json.dump(processed_events, file, default=lambda column: column.tolist())
 
-               if verbose and len(processed_events) % 100 == 0:
-                  print(f"Processed {len(processed_events)} valid events so far...")
+        else:
+            print("No valid FADC data found in this file.")
+        if profiler is not None:
+            profiler.add("serialize", time.perf_counter() - serialize_start, path_bytes(out_path))
 
-        print(f"Processed {len(processed_events)} events with FADC data")
+        if cache is not None:
+            cache.store(filename, "fadc250_streaming", DECODER_VERSION, options, index,
+                        [out_path] if os.path.exists(out_path) else [])
 
-        if len(processed_events) > 0:
+        return
 
-           outfile = output_dir+f"/fadc_sro_data_run{run_number}.json"
-           with open(outfile, 'w') as file:
-                json.dump(processed_events, file)
+def follow_fadc_data(filename, output_dir="output", verbose=False, poll_interval=0.5, max_records=50,
+                     idle_timeout=None, engine=DEFAULT_ENGINE, max_dumps=3):
+    """
+    Follow an EVIO file that the DAQ is still writing and keep live histograms of its hits.
 
-        else:
-            print("No valid FADC data found in this file.")
+    Every update decodes the records completed since the last one (at most
+    max_records, so one update takes a bounded time and a backlog is worked
+    off over several updates), adds their hits to the per-slot/channel
+    histograms and rewrites the snapshot "fadc_sro_live_run<run>.npz" (see
+    sro_histograms.py). It ends at the trailer record of the closed file,
+    after idle_timeout seconds without a new record, or on Ctrl-C.
 
-        return
+    Args:
+        filename: Input EVIO file, possibly still growing
+        output_dir: Directory for the histogram snapshot
+        verbose: Enable verbose output
+        poll_interval: Seconds between looks at the file size
+        max_records: Records decoded per update at most
+        idle_timeout: Stop after this many seconds without a new record (None waits forever)
+        engine: Hit word decoder, see process_event
+        max_dumps: Hex dumps kept per decode error category (saved at the end, see diagnostics_path)
+    """
+    print(f"Following file: {filename}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    match = re.search(r'_(\d+)\.evio\.', filename)
+    run_number = match.group(1) if match else "unknown"
+    snapshot = os.path.join(output_dir, f"fadc_sro_live_run{run_number}.npz")
+
+    follower = RecordFollower(filename)
+    histograms = SROHistograms()
+    diagnostics = Diagnostics(max_dumps)
+    event_index = 0
+    try:
+        while True:
+            records = follower.wait(poll_interval, max_records, idle_timeout)
+            if not records:
+                print("File closed by its writer." if follower.finished else f"No new record in {idle_timeout} s.")
+                break
+
+            update_start = time.perf_counter()
+            frames = []
+            for record in records:
+                for event in record.get_events():
+                    event_data = process_event(event, event_index, verbose, engine, diagnostics=diagnostics)
+                    if event_data is not None:
+                        frames.append(event_data)
+                    event_index += 1
+                # the record buffer is dropped after this update
+                release_views(record.buffer)
+
+            histograms.add_frames(frames)
+            histograms.save(snapshot)
+            update_seconds = time.perf_counter() - update_start
+
+            rates = histograms.rates().sum(axis=1)
+            slot_rates = ", ".join(f"{roc}/{payload_id}: {rate:.3g} Hz"
+                                   for roc, payload_id, rate in zip(histograms.rocs, histograms.payload_ids, rates))
+            print(f"{follower.n_records} records, {histograms.n_frames} frames, {histograms.hits.sum()} hits "
+                  f"| update {len(records)} records in {update_seconds * 1e3:.0f} ms | rates {slot_rates} "
+                  f"| {len(diagnostics)} errors")
+
+    except KeyboardInterrupt:
+        print("Stopped.")
+    finally:
+        follower.close()
+        histograms.save(snapshot)
+        print(f"Saved the histograms of {histograms.n_frames} frames to {snapshot}")
+        save_diagnostics(diagnostics, diagnostics_path(output_dir, run_number))
 
 def main():
     parser = argparse.ArgumentParser(description="Process EVIO files and extract FADC250 data")
@@ -225,17 +747,117 @@ def main():
                         help="Directory where output files will be saved.")
     parser.add_argument("-v", "--verbose", action="store_true",
                         help="Enable verbose output.")
+    parser.add_argument("-f", "--format", choices=["json", "columnar"], default="json",
+                        help="Output format: a json list of frames, or a directory of .npy columns.")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Write the columnar output in chunks of this many frames (bounded memory).")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue a chunked columnar output after its last complete chunk.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of worker processes decoding record ranges in parallel.")
+    parser.add_argument("--start", type=int, default=0,
+                        help="First event to decode (-e counts from here).")
+    parser.add_argument("--stop", type=int, default=None,
+                        help="Decode the events before this one.")
+    parser.add_argument("--start-frame", type=int, default=None,
+                        help="Only decode the time frames with a frame number >= this one.")
+    parser.add_argument("--stop-frame", type=int, default=None,
+                        help="Only decode the time frames with a frame number < this one.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Decode again even when the decode cache has an up-to-date output.")
+    parser.add_argument("--follow", action="store_true",
+                        help="Follow a file that is still written and keep live per-channel histograms.")
+    parser.add_argument("--poll-interval", type=float, default=0.5,
+                        help="Follow mode: seconds between looks at the file size.")
+    parser.add_argument("--max-records", type=int, default=50,
+                        help="Follow mode: records decoded per update at most.")
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="Follow mode: stop after this many seconds without a new record.")
+    parser.add_argument("-b", "--batch", action="store_true",
+                        help="Decode all input files on one worker pool and write one output per run.")
+    parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                        help="Hit word decoder: word-by-word python, vectorized numpy, or numba kernels "
+                             "(the default when numba is installed).")
+    parser.add_argument("--keep-mismatched", action="store_true",
+                        help="Keep the frames whose FF30 frame number or timestamp differs from the FF31 one "
+                             "(see validate_sro_frames.py).")
+    parser.add_argument("--max-dumps", type=int, default=3,
+                        help="Hex dumps kept for the first bad events of each decode error category.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time the decode stages (record reading, bank traversal, payload decoding, "
+                             "frame building, storing, writing) and print a summary table.")
+    parser.add_argument("--profile-json", default=None,
+                        help="Also save the --profile table to this json file (implies --profile).")
     args = parser.parse_args()
 
+    if args.engine == "numba" and not HAVE_NUMBA:
+        parser.error("--engine numba needs the numba package")
+
+    if (args.chunk_size is not None or args.resume) and args.format != "columnar":
+        parser.error("--chunk-size and --resume need -f columnar")
+    if args.resume and args.chunk_size is None:
+        parser.error("--resume continues a chunked output: it needs --chunk-size")
+    if args.resume and (args.jobs > 1 or args.batch):
+        parser.error("--resume works with one job only and without --batch")
+    if (args.jobs > 1 or args.batch) and (args.start or args.stop is not None
+                                          or args.start_frame is not None or args.stop_frame is not None):
+        parser.error("--start/--stop and --start-frame/--stop-frame work with one job only and without --batch")
+    profiler = StageProfiler() if args.profile or args.profile_json else None
+    if profiler is not None and (args.jobs > 1 or args.batch or args.follow):
+        parser.error("--profile works with one job only, without --batch and without --follow")
+
+    if args.follow:
+        if len(args.input_files) != 1 or args.batch or args.jobs > 1:
+            parser.error("--follow takes one input file, one job and no --batch")
+        follow_fadc_data(args.input_files[0], output_dir=args.output_dir, verbose=args.verbose,
+                         poll_interval=args.poll_interval, max_records=args.max_records,
+                         idle_timeout=args.idle_timeout, engine=args.engine, max_dumps=args.max_dumps)
+        return
+
+    if args.batch:
+        os.makedirs(args.output_dir, exist_ok=True)
+        process_fadc_batch(
+            group_by_run(args.input_files),
+            max_event=args.events,
+            output_dir=args.output_dir,
+            verbose=args.verbose,
+            output_format=args.format,
+            chunk_size=args.chunk_size,
+            jobs=args.jobs,
+            summary_file=os.path.join(args.output_dir, "batch_summary.json"),
+            engine=args.engine,
+            max_dumps=args.max_dumps,
+            keep_mismatched=args.keep_mismatched
+        )
+        return
+
     # Run the processing for each file
     for file in args.input_files:
         fadc_info = process_fadc_data(
             file,
             max_event=args.events,
             output_dir=args.output_dir,
-            verbose=args.verbose
+            verbose=args.verbose,
+            output_format=args.format,
+            chunk_size=args.chunk_size,
+            resume=args.resume,
+            jobs=args.jobs,
+            start=args.start,
+            stop=args.stop,
+            frame_start=args.start_frame,
+            frame_stop=args.stop_frame,
+            use_cache=not args.no_cache,
+            engine=args.engine,
+            profiler=profiler,
+            max_dumps=args.max_dumps,
+            keep_mismatched=args.keep_mismatched
         )
 
+    if profiler is not None:
+        profiler.summary()
+        if args.profile_json is not None:
+            profiler.save(args.profile_json)
+            print(f"Saved the profile to {args.profile_json}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,70 @@
+import argparse
+import sys
+import time
+import numpy as np
+
+from analyze_sro_fadc250 import HIT_DECODERS, HIT_DTYPES
+
+def make_hit_words(n_words, seed=0):
+    """
+    Make random streaming hit words (bit 31=0, bit 30:17 time, 16:13 channel, 12:0 charge).
+
+    Args:
+        n_words: Number of hit words
+        seed: Seed of the random generator
+
+    Returns:
+        numpy.ndarray: Big-endian uint32 words, as read from an EVIO bank
+    """
+    rng = np.random.default_rng(seed)
+    timestamp = rng.integers(0, 1 << 14, n_words, dtype=np.uint32)
+    chan = rng.integers(0, 16, n_words, dtype=np.uint32)
+    charge = rng.integers(0, 1 << 13, n_words, dtype=np.uint32)
+    words = (timestamp << 17) | (chan << 13) | charge
+    return words.astype('>u4')
+
+def time_decoder(decoder, words, payload_id, repeat):
+    """Best wall time of repeat calls of decoder, and its last result."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hits = decoder(words, payload_id)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, hits
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SRO hit word decoders")
+    parser.add_argument("-n", "--words", type=int, default=1_000_000,
+                        help="Number of hit words to decode.")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of timed repetitions (the best is reported).")
+    args = parser.parse_args()
+
+    words = make_hit_words(args.words)
+    payload_id = 15
+
+    # compile the numba kernel before it is timed
+    HIT_DECODERS['numba'](words[:16], payload_id)
+
+    times = {}
+    mismatches = 0
+    loop_time, loop_hits = time_decoder(HIT_DECODERS['python'], words, payload_id, 1)
+    times['python'] = loop_time
+    for engine in ('numpy', 'numba'):
+        times[engine], hits = time_decoder(HIT_DECODERS[engine], words, payload_id, args.repeat)
+        for key in HIT_DTYPES:
+            if not np.array_equal(loop_hits[key], hits[key]):
+                print(f"ERROR: column {key} differs between the python and {engine} decoders")
+                mismatches += 1
+
+    print(f"{'engine':<12} {'time (s)':>10} {'words/s':>14} {'speedup':>9}")
+    print("-" * 48)
+    for engine, seconds in times.items():
+        print(f"{engine:<12} {seconds:>10.4f} {args.words / seconds:>14.3e} {loop_time / seconds:>8.1f}x")
+
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
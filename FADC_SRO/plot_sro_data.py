@@ -1,15 +1,14 @@
+import os
+import sys
 import json
 import numpy as np
 import matplotlib.pyplot as plt
 
-# Read the list from the JSON file
-filename = 'output/fadc_sro_data.json'
-with open(filename, 'r') as file:
-    loaded_data = json.load(file)
+from sro_columns import load_sro_columns
+
+# Read the decoded data: a json list of frames or a columnar output directory
+filename = sys.argv[1] if len(sys.argv) > 1 else 'output/fadc_sro_data.json'
 
-nevent=len(loaded_data)
-evt_frame_number=[]
-evt_timestamp=[]
 slot3_data=[]
 slot5_data=[]
 
@@ -17,29 +16,50 @@ for ii in range(16): # initialize 16 channels
     slot3_data.append({"frame":[],"timestamp":[],'time':[], 'charge': []})
     slot5_data.append({"frame":[],"timestamp":[],'time':[], 'charge': []})
 
-for event in loaded_data:
-    evt_frame_number.append(event['sib_frame_number'])
-    evt_timestamp.append(event['sib_timestamp'])
-
-    nn = len(event['payload_id'])
-    if nn>0:
-       for ii in range(nn):
-           payload_id = event['payload_id'][ii]
-           if payload_id==15:
-              chan = event['payload_ch'][ii]
-
-              slot3_data[chan]['frame'].append(event['sib_frame_number'])
-              slot3_data[chan]['timestamp'].append(event['sib_timestamp'])
-              slot3_data[chan]['time'].append(event['payload_timestamp'][ii])
-              slot3_data[chan]['charge'].append(event['payload_charge'][ii])
-
-           if payload_id==13:
-              chan = event['payload_ch'][ii]
-
-              slot5_data[chan]['frame'].append(event['sib_frame_number'])
-              slot5_data[chan]['timestamp'].append(event['sib_timestamp'])
-              slot5_data[chan]['time'].append(event['payload_timestamp'][ii])
-              slot5_data[chan]['charge'].append(event['payload_charge'][ii])
+if os.path.isdir(filename):
+    frames, hits = load_sro_columns(filename)
+    evt_frame_number = frames['frame_number']
+    evt_timestamp = frames['sib_timestamp']
+
+    for payload_id, slot_data in ((15, slot3_data), (13, slot5_data)):
+        in_slot = hits['payload_id'] == payload_id
+        for chan in range(16):
+            sel = in_slot & (hits['channel'] == chan)
+            slot_data[chan]['frame'] = hits['frame'][sel]
+            slot_data[chan]['timestamp'] = hits['sib_timestamp'][sel]
+            slot_data[chan]['time'] = hits['time'][sel]
+            slot_data[chan]['charge'] = hits['charge'][sel]
+
+else:
+    with open(filename, 'r') as file:
+        loaded_data = json.load(file)
+
+    evt_frame_number=[]
+    evt_timestamp=[]
+
+    for event in loaded_data:
+        evt_frame_number.append(event['sib_frame_number'])
+        evt_timestamp.append(event['sib_timestamp'])
+
+        nn = len(event['payload_id'])
+        if nn>0:
+           for ii in range(nn):
+               payload_id = event['payload_id'][ii]
+               if payload_id==15:
+                  chan = event['payload_ch'][ii]
+
+                  slot3_data[chan]['frame'].append(event['sib_frame_number'])
+                  slot3_data[chan]['timestamp'].append(event['sib_timestamp'])
+                  slot3_data[chan]['time'].append(event['payload_timestamp'][ii])
+                  slot3_data[chan]['charge'].append(event['payload_charge'][ii])
+
+               if payload_id==13:
+                  chan = event['payload_ch'][ii]
+
+                  slot5_data[chan]['frame'].append(event['sib_frame_number'])
+                  slot5_data[chan]['timestamp'].append(event['sib_timestamp'])
+                  slot5_data[chan]['time'].append(event['payload_timestamp'][ii])
+                  slot5_data[chan]['charge'].append(event['payload_charge'][ii])
 
 plt.figure(figsize=(12, 10))
 plt.plot(evt_frame_number,evt_timestamp)
@@ -0,0 +1,357 @@
+import os
+import json
+import numpy as np
+
+# Columnar layout of decoded streaming FADC data. An output directory holds
+# one .npy file per column, so every column can be memory-mapped on load:
+#
+#   frames_<column>.npy  one entry per time frame
+#   hits_<column>.npy    one entry per hit, frames in file order, each frame
+#                        in hit time order (all ROCs merged, see sro_merge.py)
+#   rocs_<column>.npy    one entry per ROC time slice bank of every frame
+#
+# A streaming decode writes the same files into chunk_NNNNN/ subdirectories
+# and lists them in manifest.json (see SROColumnWriter). A parallel decode
+# writes one part_NNNNN/ per record range, listed the same way.
+#
+# The hits of frame i are hits[frames['hit_start'][i]:][:frames['hit_count'][i]].
+FRAME_DTYPES = {
+    'frame_number': np.uint32,
+    'sib_timestamp': np.uint64,
+    'rts_frame_number': np.uint32,
+    'rts_sib_timestamp': np.uint64,
+    'hit_start': np.int64,
+    'hit_count': np.uint32,
+}
+
+HIT_DTYPES = {
+    'frame': np.uint32,
+    'sib_timestamp': np.uint64,
+    'roc_id': np.uint16,
+    'payload_id': np.uint16,
+    'channel': np.uint8,
+    'time': np.uint16,
+    'charge': np.uint16,
+}
+
+# FF30 bank of each ROC; frame and sib_timestamp repeat the values of the frame
+ROC_DTYPES = {
+    'frame': np.uint32,
+    'sib_timestamp': np.uint64,
+    'roc_id': np.uint16,
+    'frame_number': np.uint32,
+    'timestamp': np.uint64,
+    'hit_count': np.uint32,
+}
+
+# hit column <- payload column of an event dict from process_event
+PAYLOAD_COLUMNS = {
+    'roc_id': 'payload_roc',
+    'payload_id': 'payload_id',
+    'channel': 'payload_ch',
+    'time': 'payload_timestamp',
+    'charge': 'payload_charge',
+}
+
+# roc column <- roc list of an event dict from process_event
+ROC_COLUMNS = {
+    'roc_id': 'roc_id',
+    'frame_number': 'roc_frame_number',
+    'timestamp': 'roc_timestamp',
+    'hit_count': 'roc_hit_count',
+}
+
+def column_path(path, table, column):
+    """File of one column: <path>/<table>_<column>.npy"""
+    return os.path.join(path, f"{table}_{column}.npy")
+
+class SROColumnWriter:
+    """
+    Collect decoded time frames and write them as columnar .npy files.
+
+    Without a chunk size every frame is kept until close(), which writes the
+    column files straight into the output directory. With a chunk size the
+    frames are written every chunk_size frames into <path>/chunk_NNNNN/, and
+    <path>/manifest.json lists the chunks written so far, so memory stays
+    bounded and an interrupted decode can resume after the last chunk.
+
+    Usage:
+        writer = SROColumnWriter("output/fadc_sro_data_run123", chunk_size=10000)
+        for event_index, event_data in events:
+            writer.add_frame(event_data, event_index)
+        writer.close()
+    """
+    def __init__(self, path, chunk_size=None, source=None, resume=False):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.source = source
+        self.n_frames = 0
+        self.n_hits = 0
+        self.next_event = 0      # event index to decode next (resume point)
+        self.chunks = []         # manifest entries of the chunks written
+        self._reset_buffers()
+
+        manifest = read_manifest(path)
+        if manifest is not None and (not resume or chunk_size is None):
+            # a new decode, or one written without chunks, replaces the chunks of an earlier one
+            os.remove(manifest_path(path))
+        elif manifest is not None:
+            if source is not None and manifest['source'] != source:
+                raise ValueError(f"Error: '{path}' was written from {manifest['source']}, not {source}.")
+            self.chunks = manifest['chunks']
+            self.next_event = manifest['next_event']
+            self.n_frames = sum(chunk['frames'] for chunk in self.chunks)
+            self.n_hits = sum(chunk['hits'] for chunk in self.chunks)
+
+    def _reset_buffers(self):
+        self._n_buffered_hits = 0
+        self._frames = {key: [] for key in FRAME_DTYPES}
+        self._hits = {key: [] for key in PAYLOAD_COLUMNS}
+        self._rocs = {key: [] for key in ROC_COLUMNS}
+        self._n_rocs = []      # ROC banks of every buffered frame
+
+    def add_frame(self, event_data, event_index=None):
+        """
+        Add one frame returned by process_event.
+
+        Args:
+            event_data: Dictionary with the frame header values and the payload hit columns
+            event_index: Index of the event in the file (the resume point follows it)
+        """
+        n_hits = len(event_data['payload_id'])
+
+        self._frames['frame_number'].append(event_data['sib_frame_number'])
+        self._frames['sib_timestamp'].append(event_data['sib_timestamp'])
+        self._frames['rts_frame_number'].append(event_data['rts_frame_number'])
+        self._frames['rts_sib_timestamp'].append(event_data['rts_sib_timestamp'])
+        self._frames['hit_start'].append(self._n_buffered_hits)
+        self._frames['hit_count'].append(n_hits)
+
+        for key, payload_key in PAYLOAD_COLUMNS.items():
+            self._hits[key].append(np.asarray(event_data[payload_key], dtype=HIT_DTYPES[key]))
+        for key, roc_key in ROC_COLUMNS.items():
+            self._rocs[key] += event_data[roc_key]
+        self._n_rocs.append(len(event_data['roc_id']))
+
+        self._n_buffered_hits += n_hits
+        self.n_frames += 1
+        self.n_hits += n_hits
+        if event_index is not None:
+            self.next_event = event_index + 1
+
+        if self.chunk_size is not None and len(self._frames['hit_start']) >= self.chunk_size:
+            self.flush()
+
+    def columns(self):
+        """
+        Build the frame, hit and ROC tables from the buffered frames.
+
+        Returns:
+            tuple: (frames, hits, rocs) dictionaries of numpy arrays
+        """
+        frames = {key: np.array(values, dtype=FRAME_DTYPES[key]) for key, values in self._frames.items()}
+
+        hits = {}
+        for key, arrays in self._hits.items():
+            if arrays:
+                hits[key] = np.concatenate(arrays)
+            else:
+                hits[key] = np.zeros(0, dtype=HIT_DTYPES[key])
+        # the per-hit frame columns repeat the frame values over its hits
+        hits['frame'] = np.repeat(frames['frame_number'], frames['hit_count'])
+        hits['sib_timestamp'] = np.repeat(frames['sib_timestamp'], frames['hit_count'])
+
+        rocs = {key: np.array(values, dtype=ROC_DTYPES[key]) for key, values in self._rocs.items()}
+        rocs['frame'] = np.repeat(frames['frame_number'], self._n_rocs)
+        rocs['sib_timestamp'] = np.repeat(frames['sib_timestamp'], self._n_rocs)
+
+        return frames, {key: hits[key] for key in HIT_DTYPES}, {key: rocs[key] for key in ROC_DTYPES}
+
+    def flush(self):
+        """Write the buffered frames as the next chunk and record it in the manifest."""
+        n_buffered = len(self._frames['hit_start'])
+        if n_buffered == 0:
+            return
+
+        name = f"chunk_{len(self.chunks):05d}"
+        save_sro_columns(os.path.join(self.path, name), *self.columns())
+
+        self.chunks.append({'name': name, 'frames': n_buffered, 'hits': self._n_buffered_hits})
+        self._write_manifest(complete=False)
+        self._reset_buffers()
+
+    def _write_manifest(self, complete):
+        manifest = {
+            'source': self.source,
+            'chunk_size': self.chunk_size,
+            'next_event': self.next_event,
+            'complete': complete,
+            'chunks': self.chunks,
+        }
+        write_manifest(self.path, manifest)
+
+    def close(self):
+        """Write the remaining frames (the last chunk, or all columns without a chunk size)."""
+        if self.chunk_size is None:
+            save_sro_columns(self.path, *self.columns())
+        else:
+            self.flush()
+            self._write_manifest(complete=True)
+
+def manifest_path(path):
+    """Manifest of a chunked output directory: <path>/manifest.json"""
+    return os.path.join(path, "manifest.json")
+
+def write_manifest(path, manifest):
+    """Write the manifest of a chunked output directory in one step, so a crash never leaves half of it."""
+    os.makedirs(path, exist_ok=True)
+    tmp_path = manifest_path(path) + ".tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(tmp_path, manifest_path(path))
+
+def read_manifest(path):
+    """
+    Read the manifest of a chunked output directory.
+
+    Returns:
+        dict: The manifest, or None when the directory holds no chunks
+    """
+    if not os.path.exists(manifest_path(path)):
+        return None
+    with open(manifest_path(path), 'r') as file:
+        return json.load(file)
+
+def save_sro_columns(path, frames, hits, rocs):
+    """
+    Save the frame, hit and ROC tables, one .npy file per column.
+
+    Args:
+        path: Output directory (created if missing)
+        frames: Dictionary of frame columns (FRAME_DTYPES)
+        hits: Dictionary of hit columns (HIT_DTYPES)
+        rocs: Dictionary of ROC columns (ROC_DTYPES)
+    """
+    os.makedirs(path, exist_ok=True)
+    for table, columns, dtypes in (('frames', frames, FRAME_DTYPES), ('hits', hits, HIT_DTYPES),
+                                   ('rocs', rocs, ROC_DTYPES)):
+        for key, dtype in dtypes.items():
+            np.save(column_path(path, table, key), np.asarray(columns[key], dtype=dtype))
+
+def append_sro_columns(path, frames, hits, rocs):
+    """
+    Append frame, hit and ROC tables to the columns saved in an output directory without chunks.
+
+    Args:
+        path: Output directory written by save_sro_columns
+        frames: Dictionary of the new frame columns; hit_start points into the new hits
+        hits: Dictionary of the new hit columns
+        rocs: Dictionary of the new ROC columns
+    """
+    old = {table: {key: np.load(column_path(path, table, key)) for key in dtypes}
+           for table, dtypes in (('frames', FRAME_DTYPES), ('hits', HIT_DTYPES), ('rocs', ROC_DTYPES))}
+
+    frames = dict(frames, hit_start=np.asarray(frames['hit_start'], dtype=np.int64) + len(old['hits']['frame']))
+    save_sro_columns(path, *({key: np.concatenate([old[table][key], np.asarray(new[key], dtype=dtype)])
+                              for key, dtype in dtypes.items()}
+                             for table, new, dtypes in (('frames', frames, FRAME_DTYPES), ('hits', hits, HIT_DTYPES),
+                                                        ('rocs', rocs, ROC_DTYPES))))
+
+def load_table(path, table, dtypes, mmap_mode='r'):
+    """The columns of a table saved in a directory; columns added after the directory was written are left out."""
+    return {key: np.load(column_path(path, table, key), mmap_mode=mmap_mode) for key in dtypes
+            if os.path.exists(column_path(path, table, key))}
+
+def chunk_dirs(path):
+    """The chunk directories of an output directory, the directory itself when it has no chunks."""
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"Error: '{path}' is not a columnar SRO output directory.")
+    manifest = read_manifest(path)
+    return [path] if manifest is None else [os.path.join(path, chunk['name']) for chunk in manifest['chunks']]
+
+def iter_sro_chunks(path, mmap_mode='r'):
+    """
+    Iterate over the chunks of an output directory, one (frames, hits) pair each.
+
+    A directory written without chunks is one chunk. The hit_start column of
+    each chunk points into the hits of that chunk.
+
+    Args:
+        path: Output directory
+        mmap_mode: Passed to np.load; 'r' maps the files instead of reading them
+
+    Yields:
+        tuple: (frames, hits) dictionaries of numpy arrays
+    """
+    for chunk_dir in chunk_dirs(path):
+        yield load_table(chunk_dir, 'frames', FRAME_DTYPES, mmap_mode), load_table(chunk_dir, 'hits', HIT_DTYPES, mmap_mode)
+
+def load_sro_columns(path, mmap_mode='r'):
+    """
+    Load the frame and hit tables of an output directory.
+
+    A directory with one chunk (or none) is returned memory-mapped. The
+    chunks of a chunked directory are concatenated in memory; use
+    iter_sro_chunks to read a long run chunk by chunk.
+
+    Args:
+        path: Output directory
+        mmap_mode: Passed to np.load; 'r' maps the files instead of reading them
+
+    Returns:
+        tuple: (frames, hits) dictionaries of numpy arrays
+    """
+    chunks = list(iter_sro_chunks(path, mmap_mode))
+    if len(chunks) == 1:
+        return chunks[0]
+
+    frames = {key: np.concatenate([chunk[0][key] for chunk in chunks]) if chunks else np.zeros(0, dtype=dtype)
+              for key, dtype in FRAME_DTYPES.items() if not chunks or key in chunks[0][0]}
+    hits = {key: np.concatenate([chunk[1][key] for chunk in chunks]) if chunks else np.zeros(0, dtype=dtype)
+            for key, dtype in HIT_DTYPES.items() if not chunks or key in chunks[0][1]}
+
+    # hit_start points into the hits of its own chunk; shift it to the joined hits
+    chunk_offsets = np.cumsum([0] + [len(chunk[1]['frame']) for chunk in chunks[:-1]])
+    frames['hit_start'] = frames['hit_start'] + np.repeat(chunk_offsets, [len(chunk[0]['hit_start']) for chunk in chunks])
+    return frames, hits
+
+def load_sro_frames(path, mmap_mode='r'):
+    """
+    Load the frame table of an output directory without its hits.
+
+    The frame columns of all chunks are joined (one entry per time frame, a
+    small table even for a long run); hit_start is left out, as it points
+    into the hits of its own chunk.
+
+    Args:
+        path: Output directory
+        mmap_mode: Passed to np.load for a directory with one chunk (or none)
+
+    Returns:
+        dict: Frame columns (FRAME_DTYPES but hit_start)
+    """
+    return load_joined(path, 'frames', {key: dtype for key, dtype in FRAME_DTYPES.items() if key != 'hit_start'},
+                       mmap_mode)
+
+def load_sro_rocs(path, mmap_mode='r'):
+    """
+    Load the ROC table of an output directory: the FF30 frame number, timestamp
+    and hit count of every ROC time slice bank, joined across chunks.
+
+    Args:
+        path: Output directory
+        mmap_mode: Passed to np.load for a directory with one chunk (or none)
+
+    Returns:
+        dict: ROC columns (ROC_DTYPES), empty for a directory written before the table existed
+    """
+    return load_joined(path, 'rocs', ROC_DTYPES, mmap_mode)
+
+def load_joined(path, table, dtypes, mmap_mode='r'):
+    """The columns of a table joined across the chunks of an output directory (mapped for one chunk)."""
+    dirs = chunk_dirs(path)
+    if len(dirs) == 1:
+        return load_table(dirs[0], table, dtypes, mmap_mode)
+    tables = [load_table(chunk_dir, table, dtypes, None) for chunk_dir in dirs]
+    return {key: np.concatenate([columns[key] for columns in tables]) if tables else np.zeros(0, dtype=dtype)
+            for key, dtype in dtypes.items() if not tables or key in tables[0]}
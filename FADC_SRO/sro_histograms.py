@@ -0,0 +1,136 @@
+import os
+import numpy as np
+
+# Incremental per-slot/channel histograms of streaming FADC hits, for
+# monitoring a run while its file is still written (analyze_sro_fadc250.py
+# --follow). Slots are identified by the ROC id and the payload id (the tag
+# of the payload bank): the ROCs of a multi-package run reuse the same payload
+# ids. The bit widths follow the hit word layout in analyze_sro_fadc250.py.
+FADC_NCHAN = 16
+CHARGE_MAX = 1 << 13      # 13-bit charge
+TIME_MAX = 1 << 14        # 14-bit hit time
+
+# SIB timestamps count a 250 MHz clock
+TICK_SECONDS = 4e-9
+
+class SROHistograms:
+    """
+    Charge and hit time histograms and hit counts per (ROC, payload id) and channel.
+
+    Row i of the tables is the slot (rocs[i], payload_ids[i]).
+
+    add_frames() folds in the hits of a list of decoded frames (the dicts
+    returned by process_event) with one bincount per table, so an update
+    costs O(hits) whatever the number of bins.
+
+    Usage:
+        histograms = SROHistograms()
+        histograms.add_frames(frames)
+        histograms.save("output/fadc_sro_live_run123.npz")
+        histograms = SROHistograms.load("output/fadc_sro_live_run123.npz")
+    """
+    def __init__(self, charge_bins=256, time_bins=256):
+        self.charge_bins = charge_bins
+        self.time_bins = time_bins
+        self.rocs = np.zeros(0, dtype=np.int64)
+        self.payload_ids = np.zeros(0, dtype=np.int64)
+        self.charge = np.zeros((0, FADC_NCHAN, charge_bins), dtype=np.int64)
+        self.time = np.zeros((0, FADC_NCHAN, time_bins), dtype=np.int64)
+        self.hits = np.zeros((0, FADC_NCHAN), dtype=np.int64)
+        self.n_frames = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+    def _rows(self, rocs, payload_ids):
+        """Histogram row of every (ROC, payload id), adding rows for new slots."""
+        keys = (rocs << 16) | payload_ids
+        known = (self.rocs << 16) | self.payload_ids
+        new_keys = np.setdiff1d(np.unique(keys), known)
+        if len(new_keys) > 0:
+            n_new = len(new_keys)
+            known = np.concatenate([known, new_keys])
+            self.rocs = np.concatenate([self.rocs, new_keys >> 16])
+            self.payload_ids = np.concatenate([self.payload_ids, new_keys & 0xFFFF])
+            self.charge = np.concatenate([self.charge, np.zeros((n_new,) + self.charge.shape[1:], dtype=np.int64)])
+            self.time = np.concatenate([self.time, np.zeros((n_new,) + self.time.shape[1:], dtype=np.int64)])
+            self.hits = np.concatenate([self.hits, np.zeros((n_new, FADC_NCHAN), dtype=np.int64)])
+        order = np.argsort(known)
+        return order[np.searchsorted(known, keys, sorter=order)]
+
+    def add_frames(self, frames):
+        """
+        Add the hits of decoded frames.
+
+        Args:
+            frames: List of event dicts from process_event
+        """
+        if len(frames) == 0:
+            return
+        timestamps = [frame['sib_timestamp'] for frame in frames]
+        if self.first_timestamp is None:
+            self.first_timestamp = min(timestamps)
+        self.last_timestamp = max(timestamps) if self.last_timestamp is None else max(self.last_timestamp, *timestamps)
+        self.n_frames += len(frames)
+
+        payload_id = np.concatenate([np.asarray(frame['payload_id'], dtype=np.int64) for frame in frames])
+        if len(payload_id) == 0:
+            return
+        roc = np.concatenate([np.asarray(frame['payload_roc'], dtype=np.int64) for frame in frames])
+        channel = np.concatenate([np.asarray(frame['payload_ch'], dtype=np.int64) for frame in frames])
+        charge = np.concatenate([np.asarray(frame['payload_charge'], dtype=np.int64) for frame in frames])
+        time = np.concatenate([np.asarray(frame['payload_timestamp'], dtype=np.int64) for frame in frames])
+
+        cell = self._rows(roc, payload_id) * FADC_NCHAN + channel
+        n_cells = self.hits.size
+        self.hits += np.bincount(cell, minlength=n_cells).reshape(self.hits.shape)
+
+        charge_bin = charge * self.charge_bins // CHARGE_MAX
+        self.charge += np.bincount(cell * self.charge_bins + charge_bin,
+                                   minlength=n_cells * self.charge_bins).reshape(self.charge.shape)
+        time_bin = time * self.time_bins // TIME_MAX
+        self.time += np.bincount(cell * self.time_bins + time_bin,
+                                 minlength=n_cells * self.time_bins).reshape(self.time.shape)
+
+    def elapsed_seconds(self):
+        """Time covered by the frames so far, from the SIB timestamps."""
+        if self.first_timestamp is None:
+            return 0.0
+        return (self.last_timestamp - self.first_timestamp) * TICK_SECONDS
+
+    def rates(self):
+        """
+        Hit rate of every slot and channel.
+
+        Returns:
+            numpy.ndarray: Hz, shape (slots, channels) in the order of rocs/payload_ids; zeros before two frames are in
+        """
+        elapsed = self.elapsed_seconds()
+        if elapsed <= 0:
+            return np.zeros(self.hits.shape)
+        return self.hits / elapsed
+
+    def save(self, path):
+        """Write the histograms to an .npz file in one step, so a reader never sees half of it."""
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, rocs=self.rocs, payload_ids=self.payload_ids, charge=self.charge, time=self.time, hits=self.hits,
+                 counters=np.array([self.n_frames,
+                                    -1 if self.first_timestamp is None else self.first_timestamp,
+                                    -1 if self.last_timestamp is None else self.last_timestamp], dtype=np.int64))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read histograms written by save()."""
+        with np.load(path) as arrays:
+            histograms = cls(arrays['charge'].shape[2], arrays['time'].shape[2])
+            histograms.rocs = arrays['rocs']
+            histograms.payload_ids = arrays['payload_ids']
+            histograms.charge = arrays['charge']
+            histograms.time = arrays['time']
+            histograms.hits = arrays['hits']
+            n_frames, first_timestamp, last_timestamp = (int(n) for n in arrays['counters'])
+        histograms.n_frames = n_frames
+        if first_timestamp >= 0:
+            histograms.first_timestamp = first_timestamp
+            histograms.last_timestamp = last_timestamp
+        return histograms
@@ -0,0 +1,121 @@
+import heapq
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from evio_common.jit import jit
+
+# Time order of the hits of one time frame.
+#
+# The hits of a frame come in streams, one per payload bank of every ROC
+# time slice bank. merge_order gives the permutation that puts all of them in
+# hit time order; hits with the same time keep the stream order (ROC bank,
+# then payload bank) and their order within the stream. Each stream is
+# sorted by time first (a stable sort, skipped for the usual already sorted
+# stream) and the streams are then merged k ways with a binary heap of the
+# stream heads, O(n log k) for n hits in k streams.
+#
+# The engines give the same permutation:
+#
+#   python  heapq.merge over the sorted streams (the reference)
+#   numpy   one stable argsort of all hit times (a radix sort for 16-bit times)
+#   numba   the heap merge compiled
+
+def sorted_streams(times, bounds):
+    """
+    Permutation that sorts every stream by time on its own.
+
+    Args:
+        times: Hit times of all streams, concatenated
+        bounds: Start of every stream and the end of the last, len(streams) + 1 entries
+
+    Returns:
+        numpy.ndarray: int64 permutation of the hits, streams in place
+    """
+    order = np.arange(len(times), dtype=np.int64)
+    descending = np.flatnonzero(np.diff(times.astype(np.int64)) < 0) + 1
+    # a step back at a stream start is not one inside the stream
+    descending = descending[~np.isin(descending, bounds)]
+    for stream in np.unique(np.searchsorted(bounds, descending, side='right') - 1):
+        start, stop = bounds[stream], bounds[stream + 1]
+        order[start:stop] = start + np.argsort(times[start:stop], kind='stable')
+    return order
+
+def merge_order_loop(times, bounds):
+    """Reference: heapq.merge of the sorted streams, ties in stream order."""
+    order = sorted_streams(times, bounds)
+    streams = [[(int(times[i]), int(i)) for i in order[bounds[s]:bounds[s + 1]]] for s in range(len(bounds) - 1)]
+    return np.array([i for _, i in heapq.merge(*streams, key=lambda hit: hit[0])], dtype=np.int64)
+
+def merge_order_numpy(times, bounds):
+    """The same permutation as merge_order_loop from one stable sort of all times."""
+    return np.argsort(times, kind='stable').astype(np.int64)
+
+@jit
+def _merge_streams(times, bounds, order, merged):
+    """Compiled kernel of merge_order_numba: sort the streams, then merge them k ways with a heap of their heads."""
+    n_streams = len(bounds) - 1
+    for stream in range(n_streams):
+        start, stop = bounds[stream], bounds[stream + 1]
+        for i in range(start, stop):
+            order[i] = i
+        for i in range(start + 1, stop):
+            if times[i] < times[i - 1]:
+                order[start:stop] = start + np.argsort(times[start:stop], kind='mergesort')
+                break
+
+    # heap keys: head time << 32 | stream, so ties go to the lower stream
+    heap = np.empty(n_streams, dtype=np.int64)
+    head = bounds[:-1].copy()                      # next hit of every stream
+    n_heap = 0
+    for stream in range(n_streams):
+        if head[stream] < bounds[stream + 1]:
+            key = (np.int64(times[order[head[stream]]]) << 32) | stream
+            child = n_heap
+            n_heap += 1
+            while child > 0 and heap[(child - 1) // 2] > key:
+                heap[child] = heap[(child - 1) // 2]
+                child = (child - 1) // 2
+            heap[child] = key
+
+    n_merged = 0
+    while n_heap > 0:
+        stream = heap[0] & 0xFFFFFFFF
+        merged[n_merged] = order[head[stream]]
+        n_merged += 1
+        head[stream] += 1
+        if head[stream] < bounds[stream + 1]:
+            key = (np.int64(times[order[head[stream]]]) << 32) | stream
+        else:
+            n_heap -= 1
+            key = heap[n_heap]
+        # sift the new key down from the top
+        parent = 0
+        while True:
+            child = 2 * parent + 1
+            if child >= n_heap:
+                break
+            if child + 1 < n_heap and heap[child + 1] < heap[child]:
+                child += 1
+            if heap[child] >= key:
+                break
+            heap[parent] = heap[child]
+            parent = child
+        if n_heap > 0:
+            heap[parent] = key
+    return n_merged
+
+def merge_order_numba(times, bounds):
+    """The same permutation as merge_order_loop, the heap merge compiled by numba."""
+    order = np.empty(len(times), dtype=np.int64)
+    merged = np.empty(len(times), dtype=np.int64)
+    _merge_streams(np.ascontiguousarray(times), np.asarray(bounds, dtype=np.int64), order, merged)
+    return merged
+
+# Merge of each --engine (see evio_common/jit.py)
+MERGERS = {
+    'python': merge_order_loop,
+    'numpy': merge_order_numpy,
+    'numba': merge_order_numba,
+}
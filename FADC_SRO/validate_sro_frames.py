@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+from sro_columns import load_sro_frames, load_sro_rocs
+
+# Frame-consistency checks of a decoded streaming run, over its frame table.
+#
+# Every check is a numpy expression over the whole run (one entry per time
+# frame), so a run of millions of frames is checked in about a second:
+#
+#   frame gaps      SIB frame numbers that skip frames, repeat or go back
+#   timestamps      SIB timestamps that do not increase, and frames whose
+#                   timestamp step is not the nominal frame period (the
+#                   median step) times their frame number step
+#   SIB/ROC         FF30 frame number or timestamp that differs from the FF31
+#                   one (kept in the table by a decode with --keep-mismatched)
+#   drift           per ROC: offset of its FF30 timestamp from the SIB one
+#                   (min/max/mean) and its slope over the run in ticks/frame
+#
+# The per-ROC checks run over the ROC table (one row per ROC time slice bank
+# and frame, split by ROC id); an output without one has the FF30 bank of the
+# first ROC in its frame table only.
+
+# frame table columns with the FF30 frame number and timestamp of the first ROC (outputs without a ROC table)
+ROC_COLUMNS = {
+    'rts': ('rts_frame_number', 'rts_sib_timestamp'),
+}
+
+def load_frames(path):
+    """
+    Frame table of a columnar output directory or of a json output.
+
+    Returns:
+        dict: frame_number, sib_timestamp, rts_frame_number and rts_sib_timestamp arrays,
+              and the ROC table under 'rocs' when the output has one
+    """
+    if os.path.isdir(path):
+        return dict(load_sro_frames(path), rocs=load_sro_rocs(path))
+    with open(path, 'r') as file:
+        events = json.load(file)
+    frames = {
+        'frame_number': np.array([event['sib_frame_number'] for event in events], dtype=np.uint32),
+        'sib_timestamp': np.array([event['sib_timestamp'] for event in events], dtype=np.uint64),
+        'rts_frame_number': np.array([event['rts_frame_number'] for event in events], dtype=np.uint32),
+        'rts_sib_timestamp': np.array([event['rts_sib_timestamp'] for event in events], dtype=np.uint64),
+    }
+    if events and 'roc_id' in events[0]:
+        n_rocs = [len(event['roc_id']) for event in events]
+        frames['rocs'] = {
+            'frame': np.repeat(frames['frame_number'], n_rocs),
+            'sib_timestamp': np.repeat(frames['sib_timestamp'], n_rocs),
+            'roc_id': np.array([roc for event in events for roc in event['roc_id']], dtype=np.uint16),
+            'frame_number': np.array([n for event in events for n in event['roc_frame_number']], dtype=np.uint32),
+            'timestamp': np.array([t for event in events for t in event['roc_timestamp']], dtype=np.uint64),
+        }
+    return frames
+
+def roc_tables(frames):
+    """
+    Split the ROC table of a frame table by ROC id.
+
+    Returns:
+        dict: roc id -> table with the frame_number and sib_timestamp of the SIB and the
+              roc_frame_number and roc_timestamp of the ROC, one row per frame with that ROC
+    """
+    rocs = frames.get('rocs')
+    if not rocs or 'roc_id' not in rocs:
+        return {roc: {'frame_number': frames['frame_number'], 'sib_timestamp': frames['sib_timestamp'],
+                      'roc_frame_number': frames[frame_column], 'roc_timestamp': frames[timestamp_column]}
+                for roc, (frame_column, timestamp_column) in ROC_COLUMNS.items() if frame_column in frames}
+    roc_id = np.asarray(rocs['roc_id'])
+    tables = {}
+    for roc in np.unique(roc_id):
+        rows = np.flatnonzero(roc_id == roc)
+        tables[int(roc)] = {'frame_number': rocs['frame'][rows], 'sib_timestamp': rocs['sib_timestamp'][rows],
+                            'roc_frame_number': rocs['frame_number'][rows], 'roc_timestamp': rocs['timestamp'][rows]}
+    return tables
+
+def examples(indices, frame_number, max_examples, row_key='row', **columns):
+    """
+    The first max_examples rows of indices.
+
+    Args:
+        indices: Rows of the table with a problem
+        frame_number: Frame number column of the table
+        max_examples: Rows to list
+        row_key: Name of the row field: 'row' for the frame table,
+            'roc_row' for the table of one ROC (roc_tables)
+        columns: Other values to list, arrays aligned with indices
+
+    Returns:
+        list: dicts with the row, frame and the columns
+    """
+    return [dict({row_key: int(i), 'frame': int(frame_number[i])}, **{key: int(values[k]) for key, values in columns.items()})
+            for k, i in enumerate(indices[:max_examples])]
+
+def check_frame_numbers(frame_number, max_examples=5):
+    """Frame number gaps, repeats and steps back between consecutive frames."""
+    step = np.diff(frame_number.astype(np.int64))
+    gaps = np.flatnonzero(step > 1)
+    back = np.flatnonzero(step <= 0)
+    return {
+        'gaps': len(gaps),
+        'missing_frames': int((step[gaps] - 1).sum()),
+        'repeated_or_backward': len(back),
+        'gap_examples': examples(gaps, frame_number, max_examples, next_frame=frame_number[gaps + 1]),
+        'backward_examples': examples(back, frame_number, max_examples, next_frame=frame_number[back + 1]),
+    }
+
+def check_timestamps(frame_number, timestamp, max_examples=5):
+    """Non-increasing SIB timestamps and timestamp steps off the nominal frame period."""
+    frame_step = np.diff(frame_number.astype(np.int64))
+    step = np.diff(timestamp.astype(np.int64))
+    non_monotonic = np.flatnonzero(step <= 0)
+
+    # nominal period: the median timestamp step between consecutive frame numbers
+    single = step[(frame_step == 1) & (step > 0)]
+    period = int(np.median(single)) if len(single) else None
+    if period is None:
+        off_period = np.zeros(0, dtype=np.int64)
+    else:
+        off_period = np.flatnonzero((frame_step > 0) & (step > 0) & (step != frame_step * period))
+    return {
+        'non_monotonic': len(non_monotonic),
+        'frame_period_ticks': period,
+        'off_period': len(off_period),
+        'non_monotonic_examples': examples(non_monotonic, frame_number, max_examples,
+                                           timestamp=timestamp[non_monotonic], next_timestamp=timestamp[non_monotonic + 1]),
+        'off_period_examples': examples(off_period, frame_number, max_examples,
+                                        timestamp=timestamp[off_period], next_timestamp=timestamp[off_period + 1]),
+    }
+
+def check_roc(frames, frame_column='roc_frame_number', timestamp_column='roc_timestamp', period=None,
+              max_examples=5):
+    """
+    SIB/ROC disagreements and timestamp drift of one ROC.
+
+    Args:
+        frames: Frame table of the ROC (roc_tables)
+        frame_column, timestamp_column: Columns with the FF30 frame number and timestamp of the ROC
+        period: Nominal frame period in ticks, for the drift in ppm
+        max_examples: Rows listed per kind of problem
+
+    Returns:
+        dict: Disagreement counts and examples (with the roc_row in the table of
+              the ROC, not the frame table row), and the offset and drift statistics
+    """
+    frame_number = frames['frame_number']
+    frame_mismatch = np.flatnonzero(frames[frame_column] != frame_number)
+    timestamp_mismatch = np.flatnonzero(frames[timestamp_column] != frames['sib_timestamp'])
+
+    offset = frames[timestamp_column].astype(np.int64) - frames['sib_timestamp'].astype(np.int64)
+    result = {
+        'frame_mismatch': len(frame_mismatch),
+        'timestamp_mismatch': len(timestamp_mismatch),
+        'frame_mismatch_examples': examples(frame_mismatch, frame_number, max_examples, 'roc_row',
+                                            roc_frame=frames[frame_column][frame_mismatch]),
+        'timestamp_mismatch_examples': examples(timestamp_mismatch, frame_number, max_examples, 'roc_row',
+                                                offset=offset[timestamp_mismatch]),
+        'offset_min': int(offset.min()) if len(offset) else 0,
+        'offset_max': int(offset.max()) if len(offset) else 0,
+        'offset_mean': float(offset.mean()) if len(offset) else 0.0,
+        'drift_ticks_per_frame': 0.0,
+        'drift_ppm': None,
+    }
+
+    # least-squares slope of the offset over the frame number
+    x = frame_number.astype(np.float64)
+    if len(x) > 1 and x.max() > x.min():
+        x -= x.mean()
+        slope = float(np.dot(x, offset - offset.mean()) / np.dot(x, x))
+        result['drift_ticks_per_frame'] = slope
+        if period:
+            result['drift_ppm'] = slope / period * 1e6
+    return result
+
+def validate_frames(frames, max_examples=5):
+    """
+    Run all checks over a frame table.
+
+    Args:
+        frames: Frame table (load_frames)
+        max_examples: Rows listed per kind of problem
+
+    Returns:
+        dict: Summary with the frame number, timestamp and per-ROC results and the problem count
+    """
+    frame_number = np.asarray(frames['frame_number'])
+    summary = {
+        'frames': len(frame_number),
+        'first_frame': int(frame_number[0]) if len(frame_number) else None,
+        'last_frame': int(frame_number[-1]) if len(frame_number) else None,
+        'frame_numbers': check_frame_numbers(frame_number, max_examples),
+        'timestamps': check_timestamps(frame_number, frames['sib_timestamp'], max_examples),
+    }
+    summary['rocs'] = {roc: check_roc(table, period=summary['timestamps']['frame_period_ticks'],
+                                      max_examples=max_examples)
+                       for roc, table in roc_tables(frames).items()}
+    summary['problems'] = (summary['frame_numbers']['gaps'] + summary['frame_numbers']['repeated_or_backward']
+                           + summary['timestamps']['non_monotonic'] + summary['timestamps']['off_period']
+                           + sum(roc['frame_mismatch'] + roc['timestamp_mismatch'] for roc in summary['rocs'].values()))
+    return summary
+
+def print_summary(summary):
+    """Print the counts of a validate_frames summary and its first examples."""
+    numbers, timestamps = summary['frame_numbers'], summary['timestamps']
+    print(f"{summary['frames']} frames, {summary['first_frame']} to {summary['last_frame']}")
+    print(f"  frame number gaps:          {numbers['gaps']} ({numbers['missing_frames']} missing frames)")
+    print(f"  repeated/backward frames:   {numbers['repeated_or_backward']}")
+    print(f"  non-monotonic timestamps:   {timestamps['non_monotonic']}")
+    print(f"  frame period:               {timestamps['frame_period_ticks']} ticks, "
+          f"{timestamps['off_period']} steps off the period")
+    for roc, result in summary['rocs'].items():
+        drift_ppm = f"{result['drift_ppm']:.3f} ppm" if result['drift_ppm'] is not None else "-"
+        print(f"  ROC {roc}: {result['frame_mismatch']} frame number and {result['timestamp_mismatch']} timestamp "
+              f"disagreements with the SIB, offset {result['offset_min']} to {result['offset_max']} ticks, "
+              f"drift {result['drift_ticks_per_frame']:.3g} ticks/frame ({drift_ppm})")
+
+    for name, rows in (("frame gap", numbers['gap_examples']), ("backward frame", numbers['backward_examples']),
+                       ("non-monotonic timestamp", timestamps['non_monotonic_examples']),
+                       ("off-period timestamp", timestamps['off_period_examples'])):
+        for row in rows:
+            print(f"  {name}: {row}")
+    for roc, result in summary['rocs'].items():
+        for row in result['frame_mismatch_examples'] + result['timestamp_mismatch_examples']:
+            print(f"  ROC {roc} disagreement: {row}")
+
+    print("Frames are consistent" if summary['problems'] == 0 else f"{summary['problems']} problems found")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the frame numbers and timestamps of a decoded SRO run")
+    parser.add_argument("input", help="Columnar output directory (or json output) of analyze_sro_fadc250.py")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Summary json file (default: <input>_validation.json).")
+    parser.add_argument("--max-examples", type=int, default=5,
+                        help="Rows listed per kind of problem.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    frames = load_frames(args.input)
+    summary = validate_frames(frames, args.max_examples)
+    summary['input'] = os.path.abspath(args.input)
+    summary['seconds'] = time.perf_counter() - start
+
+    print_summary(summary)
+    output = args.output or os.path.splitext(args.input.rstrip("/"))[0] + "_validation.json"
+    with open(output, 'w') as file:
+        json.dump(summary, file, indent=1)
+    print(f"Checked in {summary['seconds']:.2f} s, saved the summary to {output}")
+    sys.exit(1 if summary['problems'] else 0)
+
+if __name__ == "__main__":
+    main()
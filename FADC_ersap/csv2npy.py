@@ -1,31 +1,382 @@
+import argparse
+import io
+import os
 import sys
+import time
 import pandas as pd
 import numpy as np
 from pathlib import Path
 
-def convert_csv_to_npy(csv_path: str):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from evio_common.parallel import run_parallel
+from evio_common.jit import jit, HAVE_NUMBA
+
+# Conversion of an ERSAP hit list (csv text, one hit per line, no header) to
+# a structured .npy array. The .data files of the ERSAP output are read as
+# they are; renaming them to .csv is not needed.
+#
+# The file is cut into chunks of about --chunk-mb MB at line ends and the
+# lines of each chunk are counted first, so the output is preallocated with
+# its final length (np.lib.format.open_memmap). Each chunk is then parsed with
+# explicit column dtypes and written into its rows of the mapped output, one
+# chunk at a time (-j 1) or on a process pool (-j N); memory stays at a few
+# chunks whatever the size of the file. A directory converts all its hit
+# lists, one file per worker process.
+#
+# The chunks are parsed by one of two engines (--engine):
+#
+#   pandas  the C parser of pd.read_csv
+#   numba   a compiled byte parser (the default when numba is installed),
+#           several times faster for these lines of small integers
+#
+# --compare converts a file with both and prints their throughput.
+
+# hit list files of the ERSAP output, and the same renamed
+SUFFIXES = ('.data', '.csv')
+
+# Expected columns in order, with the compact type of each
+COLUMNS = ["rocID", "frameNumber", "timestamp", "crate", "slot", "channel", "charge", "time"]
+HIT_DTYPE = np.dtype([
+    ('rocID', np.uint16),
+    ('frameNumber', np.uint32),
+    ('timestamp', np.uint64),
+    ('crate', np.uint8),
+    ('slot', np.uint8),
+    ('channel', np.uint8),
+    ('charge', np.uint16),
+    ('time', np.uint32),
+])
+
+# parse types: wide enough for any line, checked against HIT_DTYPE before the cast
+PARSE_DTYPES = {name: (np.uint64 if name == 'timestamp' else np.int64) for name in COLUMNS}
+
+CHUNK_BYTES = 64 << 20
+
+PARSE_ENGINES = ["pandas", "numba"]
+DEFAULT_PARSE_ENGINE = "numba" if HAVE_NUMBA else "pandas"
+
+def count_rows(buffer):
+    """
+    Lines of a buffer with something else than blanks, the rows both parsers return.
+
+    Args:
+        buffer: bytes of whole lines
+
+    Returns:
+        int: Number of non-blank lines
+    """
+    if len(buffer) == 0:
+        return 0
+    if buffer[:1] not in b'\n\r ' and not any(blank in buffer for blank in (b'\n\n', b'\n\r', b'\n ')):
+        # no line starts with a blank: every line has content
+        return buffer.count(b'\n') + (0 if buffer.endswith(b'\n') else 1)
+
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    # a line runs from its first byte to its newline included, so no line is empty
+    line_starts = np.concatenate([[0], np.flatnonzero(data == 10) + 1])
+    line_starts = line_starts[line_starts < len(data)]
+    content = (data != 10) & (data != 13) & (data != 32)
+    return int(np.count_nonzero(np.logical_or.reduceat(content, line_starts)))
+
+def split_lines(csv_path, chunk_bytes=CHUNK_BYTES):
+    """
+    Cut a text file into chunks that end at line ends and count their non-blank lines.
+
+    Args:
+        csv_path: Text file
+        chunk_bytes: Approximate chunk size in bytes
+
+    Returns:
+        list: (byte_start, byte_stop, row_start, n_rows) of every chunk, in file order
+    """
+    size = os.path.getsize(csv_path)
+    chunks = []
+    row_start = 0
+    with open(csv_path, 'rb') as file:
+        start = 0
+        while start < size:
+            file.seek(start)
+            buffer = file.read(chunk_bytes)
+            stop = start + len(buffer)
+            if stop < size:
+                # extend the chunk to the end of its last line
+                rest = file.readline()
+                stop += len(rest)
+                buffer += rest
+            n_rows = count_rows(buffer)
+            chunks.append((start, stop, row_start, n_rows))
+            row_start += n_rows
+            start = stop
+    return chunks
+
+def to_records(columns, dtype):
+    """
+    Cast parsed columns to a structured array.
+
+    Args:
+        columns: Dictionary of integer arrays of the same length, one per field of dtype
+        dtype: Structured output type
+
+    Returns:
+        numpy.ndarray: The records
+
+    Raises:
+        ValueError: For a value that does not fit its column type
+    """
+    n_rows = len(columns[dtype.names[0]]) if dtype.names else 0
+    records = np.empty(n_rows, dtype=dtype)
+    for name in dtype.names:
+        column = columns[name]
+        info = np.iinfo(dtype[name])
+        if len(column) and (column.min() < info.min or column.max() > info.max):
+            raise ValueError(f"column {name} has values from {column.min()} to {column.max()}, "
+                             f"outside of {dtype[name]}")
+        records[name] = column
+    return records
+
+def parse_hits_pandas(buffer, dtype=HIT_DTYPE):
+    """
+    Parse csv lines of hits into a structured array with pd.read_csv.
+
+    Args:
+        buffer: bytes of whole lines
+        dtype: Structured output type, its fields in the column order of the file
+
+    Returns:
+        numpy.ndarray: One record per line
+
+    Raises:
+        ValueError: For a value that does not fit its column type
+    """
+    df = pd.read_csv(io.BytesIO(buffer), names=list(dtype.names), header=None,
+                     dtype={name: PARSE_DTYPES.get(name, np.int64) for name in dtype.names}, engine='c')
+    return to_records({name: df[name].to_numpy() for name in dtype.names}, dtype)
+
+@jit
+def _parse_uint_lines(buffer, values):
+    """Compiled kernel of parse_hits_numba: rows of comma separated unsigned integers; -(offset + 1) of a bad byte."""
+    n_cols, n_rows = values.shape
+    row = 0
+    col = 0
+    value = 0
+    digits = 0
+    for i in range(len(buffer) + 1):
+        # a missing newline at the end of the buffer ends the last line all the same
+        c = buffer[i] if i < len(buffer) else 10
+        if c >= 48 and c <= 57:                    # digit
+            value = value * 10 + (c - 48)
+            digits += 1
+            if digits > 18:
+                return -(i + 1)
+        elif c == 44:                              # ','
+            if digits == 0 or col == n_cols - 1 or row == n_rows:
+                return -(i + 1)
+            values[col, row] = value
+            col += 1
+            value = 0
+            digits = 0
+        elif c == 10:                              # end of line
+            if digits == 0 and col == 0:
+                continue                           # blank line
+            if digits == 0 or col != n_cols - 1 or row == n_rows:
+                return -(i + 1)
+            values[col, row] = value
+            row += 1
+            col = 0
+            value = 0
+            digits = 0
+        elif c != 13 and c != 32:                  # '\r' and blanks are skipped
+            return -(i + 1)
+    return row
+
+def parse_hits_numba(buffer, dtype=HIT_DTYPE):
+    """The same records as parse_hits_pandas from the compiled byte parser."""
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    # one row per column, so that the range checks and casts run over contiguous memory
+    values = np.empty((len(dtype.names), buffer.count(b'\n') + 1), dtype=np.int64)
+    n_rows = _parse_uint_lines(data, values)
+    if n_rows < 0:
+        offset = -n_rows - 1
+        line = bytes(buffer[buffer.rfind(b'\n', 0, offset) + 1:offset + 1])
+        raise ValueError(f"unexpected byte {bytes(buffer[offset:offset + 1])!r} at byte {offset} of the chunk, "
+                         f"line {line!r}")
+    return to_records({name: values[k, :n_rows] for k, name in enumerate(dtype.names)}, dtype)
+
+# Chunk parser of each --engine
+PARSERS = {
+    'pandas': parse_hits_pandas,
+    'numba': parse_hits_numba,
+}
+
+def convert_chunk(csv_path, npy_path, byte_start, byte_stop, row_start, n_rows, engine=DEFAULT_PARSE_ENGINE):
+    """
+    Parse one chunk of the csv file into its rows of the preallocated .npy file.
+
+    Args:
+        csv_path: csv file
+        npy_path: .npy file created by convert_csv_to_npy with all the rows
+        byte_start, byte_stop: Byte range of the chunk
+        row_start, n_rows: First row and number of rows of the chunk
+        engine: Chunk parser, a PARSERS key
+
+    Returns:
+        int: Rows written
+    """
+    with open(csv_path, 'rb') as file:
+        file.seek(byte_start)
+        buffer = file.read(byte_stop - byte_start)
+    records = PARSERS[engine](buffer)
+    if len(records) != n_rows:
+        raise ValueError(f"{csv_path}: {len(records)} hits in bytes {byte_start}-{byte_stop}, "
+                         f"expected {n_rows}")
+
+    out = np.load(npy_path, mmap_mode='r+')
+    out[row_start:row_start + n_rows] = records
+    out.flush()
+    del out
+    return n_rows
+
+def convert_csv_to_npy(csv_path: str, jobs=1, chunk_bytes=CHUNK_BYTES, engine=DEFAULT_PARSE_ENGINE, npy_path=None):
+    """
+    Convert an ERSAP hit list (.data, or renamed .csv) to a structured .npy array of the same name.
+
+    Args:
+        csv_path: Hit list file
+        jobs: Worker processes parsing the chunks
+        chunk_bytes: Approximate chunk size in bytes
+        engine: Chunk parser, a PARSERS key
+        npy_path: Output file (default: the input with the .npy suffix)
+
+    Returns:
+        int: Records saved
+    """
     csv_file = Path(csv_path)
-    if not csv_file.exists() or not csv_file.suffix == '.csv':
-        print(f"Error: File '{csv_path}' does not exist or is not a .csv file.")
-        sys.exit(1)
+    if not csv_file.exists() or csv_file.suffix not in SUFFIXES:
+        raise FileNotFoundError(f"Error: File '{csv_path}' does not exist or is not a .data or .csv file.")
+
+    start = time.perf_counter()
+    chunks = split_lines(csv_file, chunk_bytes)
+    n_rows = sum(chunk[3] for chunk in chunks)
 
-    # Define expected column headers in order
-    columns = ["rocID", "frameNumber", "timestamp", "crate", "slot", "channel", "charge", "time"]
+    # Save as .npy with same name, through a temporary file replaced when complete
+    npy_path = csv_file.with_suffix('.npy') if npy_path is None else Path(npy_path)
+    tmp_path = npy_path.with_suffix('.tmp.npy')
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=HIT_DTYPE, shape=(n_rows,))
+    del out
+    try:
+        tasks = [(str(csv_file), str(tmp_path)) + chunk + (engine,) for chunk in chunks]
+        if jobs > 1 and len(tasks) > 1:
+            run_parallel(convert_chunk, tasks, jobs)
+        else:
+            for task in tasks:
+                convert_chunk(*task)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, npy_path)
 
-    # Read CSV without headers
-    df = pd.read_csv(csv_file, names=columns)
+    seconds = time.perf_counter() - start
+    size = csv_file.stat().st_size
+    print(f"Saved {n_rows} records to {npy_path} ({len(chunks)} chunks, {seconds:.2f} s, "
+          f"{size / 1e6 / seconds if seconds > 0 else 0:.1f} MB/s)")
+    return n_rows
 
-    # Convert to structured array
-    records = df.to_records(index=False)
+def find_hit_lists(paths):
+    """Hit list files of the arguments: files as given, and the .data/.csv files of directories, sorted."""
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files += sorted(file for file in path.iterdir() if file.suffix in SUFFIXES and file.is_file())
+        else:
+            files.append(path)
+    return files
 
-    # Save as .npy with same name
-    npy_path = csv_file.with_suffix('.npy')
-    np.save(npy_path, records)
-    print(f"Saved {len(records)} records to {npy_path}")
+def convert_files(files, jobs=1, chunk_bytes=CHUNK_BYTES, engine=DEFAULT_PARSE_ENGINE):
+    """
+    Convert hit list files, one file per worker process (the chunks of a single file share the workers).
+
+    Args:
+        files: Hit list files
+        jobs: Worker processes
+        chunk_bytes: Approximate chunk size in bytes
+        engine: Chunk parser, a PARSERS key
+
+    Returns:
+        int: Records saved
+    """
+    if len(files) == 1:
+        return convert_csv_to_npy(files[0], jobs, chunk_bytes, engine)
+
+    start = time.perf_counter()
+    size = sum(file.stat().st_size for file in files)
+    n_rows = sum(run_parallel(convert_csv_to_npy, [(str(file), 1, chunk_bytes, engine) for file in files], jobs))
+    seconds = time.perf_counter() - start
+    print(f"{len(files)} files, {n_rows} records, {size / 1e6:.1f} MB in {seconds:.2f} s "
+          f"({size / 1e6 / seconds if seconds > 0 else 0:.1f} MB/s)")
+    return n_rows
+
+def compare_engines(csv_path, jobs=1, chunk_bytes=CHUNK_BYTES):
+    """
+    Convert a hit list with every engine, check that the outputs are the same and print their throughput.
+
+    The outputs go to <name>.<engine>.npy and are removed afterwards. The
+    numba parser is compiled (or loaded from its cache) before the clock starts.
+
+    Returns:
+        dict: Seconds of every engine
+    """
+    csv_file = Path(csv_path)
+    PARSERS['numba'](b"0,0,0,0,0,0,0,0\n")
+    seconds = {}
+    outputs = {}
+    try:
+        for engine in PARSE_ENGINES:
+            outputs[engine] = csv_file.with_suffix(f'.{engine}.npy')
+            start = time.perf_counter()
+            convert_csv_to_npy(csv_file, jobs, chunk_bytes, engine, outputs[engine])
+            seconds[engine] = time.perf_counter() - start
+        reference = np.load(outputs[PARSE_ENGINES[0]], mmap_mode='r')
+        same = all(np.array_equal(reference, np.load(outputs[engine], mmap_mode='r')) for engine in PARSE_ENGINES[1:])
+        del reference
+    finally:
+        for output in outputs.values():
+            if output.exists():
+                output.unlink()
+
+    size = csv_file.stat().st_size
+    print(f"\n{'engine':<8} {'time (s)':>9} {'MB/s':>8} {'speedup':>8}")
+    for engine in PARSE_ENGINES:
+        print(f"{engine:<8} {seconds[engine]:>9.2f} {size / 1e6 / seconds[engine]:>8.1f} "
+              f"{seconds['pandas'] / seconds[engine]:>7.2f}x")
+    print("Outputs are identical" if same else "ERROR: the outputs differ")
+    return seconds
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python csv_to_npy.py <filename.csv>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Convert ERSAP hit lists (.data or .csv) to structured .npy arrays")
+    parser.add_argument("inputs", nargs="+",
+                        help="ERSAP output files (.data, or renamed to .csv) or directories of them")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Worker processes: one file each, or the chunks of a single file.")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_BYTES / (1 << 20),
+                        help="Chunk size in MB: the memory per worker is a few times this.")
+    parser.add_argument("--engine", choices=PARSE_ENGINES, default=DEFAULT_PARSE_ENGINE,
+                        help="Chunk parser: pd.read_csv, or the compiled byte parser (the default with numba).")
+    parser.add_argument("--compare", action="store_true",
+                        help="Convert each file with both engines and print their throughput instead.")
+    args = parser.parse_args()
+    if (args.engine == "numba" or args.compare) and not HAVE_NUMBA:
+        parser.error("--engine numba needs the numba package" if not args.compare
+                     else "--compare runs the numba engine: it needs the numba package")
 
-    convert_csv_to_npy(sys.argv[1])
+    try:
+        files = find_hit_lists(args.inputs)
+        if not files:
+            raise FileNotFoundError(f"Error: no .data or .csv files in {args.inputs}")
+        if args.compare:
+            for file in files:
+                compare_engines(file, args.jobs, int(args.chunk_mb * (1 << 20)))
+        else:
+            convert_files(files, args.jobs, int(args.chunk_mb * (1 << 20)), args.engine)
+    except (FileNotFoundError, ValueError) as error:
+        print(error)
+        sys.exit(1)
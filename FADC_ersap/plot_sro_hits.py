@@ -4,6 +4,26 @@ import numpy as np
 import matplotlib.pyplot as plt
 from pathlib import Path
 
+# The .npy file is memory-mapped, not read: opening it takes the same time
+# for any size, and the methods work on the columns of the structured array,
+# read from disk when they are touched. A pandas DataFrame of all hits (a copy
+# of every column) is only built when self.df is used.
+#
+# Hits of a channel are found through an offset index, built at the first
+# selection: the permutation that sorts the hits by (crate, slot, channel),
+# keeping their file order within a channel, and the start of every channel
+# in it. Selecting a channel is then a slice of the permutation, and the
+# all-channel summaries take one pass over the hits instead of one boolean
+# mask over all hits per channel.
+
+# clock of the timestamp and time columns: 250 MHz, 4 ns ticks
+CLOCK_HZ = 250.0e6
+
+def channel_keys(crate, slot, channel):
+    """One integer key per hit, in (crate, slot, channel) order."""
+    return (np.asarray(crate, dtype=np.int64) << 16) | (np.asarray(slot, dtype=np.int64) << 8) \
+        | np.asarray(channel, dtype=np.int64)
+
 class SRODataAnalyzer:
     def __init__(self, file_path):
         path = Path(file_path)
@@ -11,7 +31,7 @@ class SRODataAnalyzer:
             raise FileNotFoundError(f"Error: '{file_path}' does not exist or is not a .npy file.")
 
         try:
-            self.data = np.load(file_path)
+            self.data = np.load(file_path, mmap_mode='r')
         except Exception as e:
             raise RuntimeError(f"Error loading .npy file: {e}")
 
@@ -20,17 +40,147 @@ class SRODataAnalyzer:
         print(f"Shape: {self.data.shape}")
         print(f"Fields: {self.data.dtype.names}")
 
-        self.df = pd.DataFrame(self.data)
-        #print(self.df.columns)
-        #print(self.df.head(5))
-        #print(self.df.tail(5))
+        self._df = None
+        self.order = None      # offset index, see build_index
+        self._hit_groups = None
+
+    @property
+    def df(self):
+        """All hits as a pandas DataFrame, built at the first use."""
+        if self._df is None:
+            self._df = pd.DataFrame(self.data)
+            #print(self._df.columns)
+            #print(self._df.head(5))
+            #print(self._df.tail(5))
+        return self._df
+
+    def build_index(self):
+        """
+        Index the hits by (crate, slot, channel): the sorting permutation and the start of every channel in it.
+
+        The sort is stable, so the hits of a channel keep their file order.
+        Only the crate, slot and channel columns are read.
+        """
+        crate, slot, channel = (np.asarray(self.data[name]) for name in ('crate', 'slot', 'channel'))
+        # dense key: a few crates x slots x channels fit in 16 bits, sorted by a radix sort
+        n_slots = int(slot.max()) + 1 if len(slot) else 1
+        n_channels = int(channel.max()) + 1 if len(channel) else 1
+        dense = (crate.astype(np.int64) * n_slots + slot) * n_channels + channel
+        if len(dense) and dense.max() < (1 << 16):
+            dense = dense.astype(np.uint16)
+        order = np.argsort(dense, kind='stable')
+        dense = dense[order]
+
+        starts = np.flatnonzero(np.diff(dense)) + 1 if len(dense) else np.zeros(0, dtype=np.int64)
+        group_dense = dense[np.concatenate([[0], starts])].astype(np.int64) if len(dense) else np.zeros(0, dtype=np.int64)
+        keys = channel_keys(group_dense // (n_slots * n_channels), group_dense // n_channels % n_slots,
+                            group_dense % n_channels)
+
+        self.group_keys = keys
+        self.group_bounds = np.concatenate([[0], starts, [len(dense)]] if len(dense) else [[0]]).astype(np.int64)
+        self.group_index = {int(key): k for k, key in enumerate(self.group_keys)}
+        self.order = order
+
+    def channel_slice(self, crate_val, slot_val, channel_val):
+        """Rows of a channel in the sorting permutation (an empty slice when it has none)."""
+        if self.order is None:
+            self.build_index()
+        k = self.group_index.get(int(channel_keys(crate_val, slot_val, channel_val)))
+        if k is None:
+            return slice(0, 0)
+        return slice(int(self.group_bounds[k]), int(self.group_bounds[k + 1]))
+
+    def select(self, crate_val, slot_val, channel_val):
+        """Hits of one channel in file order, a structured array read from the mapped file."""
+        rows = self.channel_slice(crate_val, slot_val, channel_val)
+        return self.data[self.order[rows]]
+
+    def group_ranges(self, column):
+        """
+        Hit count and min/max of a column for every channel, in one pass over the hits.
+
+        Returns:
+            tuple: (counts, minima, maxima) arrays aligned with group_keys
+        """
+        if self.order is None:
+            self.build_index()
+        values = self.data[column][self.order]
+        counts = np.diff(self.group_bounds)
+        if len(counts) == 0:
+            return counts, values[:0], values[:0]
+        starts = self.group_bounds[:-1]
+        return counts, np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts)
+
+    def hit_groups(self):
+        """Channel of every hit in file order, as an index into group_keys (for the bincount reductions)."""
+        if self._hit_groups is None:
+            if self.order is None:
+                self.build_index()
+            groups = np.empty(len(self.order), dtype=np.int64)
+            groups[self.order] = np.repeat(np.arange(len(self.group_keys)), np.diff(self.group_bounds))
+            self._hit_groups = groups
+        return self._hit_groups
+
+    def group_channels(self):
+        """Crate, slot and channel of every entry of group_keys."""
+        if self.order is None:
+            self.build_index()
+        return {'crate': self.group_keys >> 16, 'slot': (self.group_keys >> 8) & 0xFF,
+                'channel': self.group_keys & 0xFF}
+
+    def channel_rates(self, time_column='timestamp'):
+        """
+        Hit rate of every channel over the time range of its hits, all channels at once.
+
+        Args:
+            time_column: Column of the hit times in 250 MHz ticks; calculate_rate uses
+                timestamp (the frame time) and calculate_rate_all_channels time (the hit time)
+
+        Returns:
+            dict: crate, slot, channel, hits, t_min, t_max and rate (Hz; 0 for an empty time
+                range) arrays, one entry per channel with hits
+        """
+        hits, t_min, t_max = self.group_ranges(time_column)
+        seconds = (t_max.astype(np.int64) - t_min.astype(np.int64)) / CLOCK_HZ
+        rate = np.divide(hits, seconds, out=np.zeros(len(hits)), where=seconds > 0)
+        return dict(self.group_channels(), hits=hits, t_min=t_min, t_max=t_max, rate=rate)
+
+    def rate_matrix(self, window_ticks, time_column='timestamp'):
+        """
+        Hit rate of every channel in consecutive time windows, in one bincount over all hits.
+
+        The windows start at the first hit of the file and are all window_ticks wide, the last
+        one included: it may extend past the last hit (the hits of a frame share its timestamp,
+        so a run usually ends inside a window), and its rate then covers the hits up to the end
+        of the run only.
+
+        Args:
+            window_ticks: Window width in 250 MHz ticks
+            time_column: Column of the hit times in ticks (timestamp: the frame time over the run)
+
+        Returns:
+            tuple: (channels, edges, rates): crate/slot/channel arrays of the rows (group_channels),
+                window edges in ticks (n_windows + 1) and the rates in Hz (rows x n_windows)
+        """
+        if window_ticks <= 0:
+            raise ValueError(f"window_ticks must be positive, not {window_ticks}")
+        groups = self.hit_groups()
+        channels = self.group_channels()
+        times = np.asarray(self.data[time_column]).astype(np.int64)
+        if len(times) == 0:
+            return channels, np.zeros(1, dtype=np.int64), np.zeros((0, 0))
+
+        t_first = int(times.min())
+        t_end = int(times.max()) + 1
+        n_windows = -(-(t_end - t_first) // window_ticks)
+        windows = (times - t_first) // window_ticks
+        counts = np.bincount(groups * n_windows + windows, minlength=len(channels['crate']) * n_windows)
+
+        edges = t_first + window_ticks * np.arange(n_windows + 1, dtype=np.int64)
+        return channels, edges, counts.reshape(-1, n_windows) / (window_ticks / CLOCK_HZ)
 
     def plot_npy(self, crate_val=2, slot_val=13, channel_val=1):
-        df_sel = self.df[
-            (self.df['crate'] == crate_val) &
-            (self.df['slot'] == slot_val) &
-            (self.df['channel'] == channel_val)
-        ]
+        df_sel = self.select(crate_val, slot_val, channel_val)
 
         plt.figure(figsize=(8, 5))
         plt.scatter(df_sel['time'], df_sel['charge'], s=10)
@@ -42,12 +192,8 @@ class SRODataAnalyzer:
 
 
     def calculate_rate(self, crate_val=2, slot_val=13, channel_val=1):
-        df_sel = self.df[
-            (self.df['crate'] == crate_val) &
-            (self.df['slot'] == slot_val) &
-            (self.df['channel'] == channel_val)
-        ]
-        if df_sel.empty:
+        df_sel = self.select(crate_val, slot_val, channel_val)
+        if len(df_sel) == 0:
             print("No matching data found.")
             return None
 
@@ -67,29 +213,14 @@ class SRODataAnalyzer:
     def calculate_rate_all_channels(self, crate_val=2, slots=(13, 15), channels=range(16)):
         plt.figure(figsize=(8, 5))
 
+        # rate of every channel, one pass over all hits
+        channel_rates = self.channel_rates('time')['rate']
+
         for slot in slots:
             rates = []
             for ch in channels:
-                df_sel = self.df[
-                    (self.df['crate'] == crate_val) &
-                    (self.df['slot'] == slot) &
-                    (self.df['channel'] == ch)
-                ]
-
-                if df_sel.empty:
-                    rates.append(0)
-                    continue
-
-                time_min = df_sel['time'].min()
-                time_max = df_sel['time'].max()
-                total_time = (time_max - time_min)/250.0e6
-
-                if total_time <= 0:
-                    rates.append(0)
-                    continue
-
-                rate = len(df_sel) / total_time
-                rates.append(rate)
+                k = self.group_index.get(int(channel_keys(crate_val, slot, ch)))
+                rates.append(0 if k is None else channel_rates[k])
 
             plt.plot(channels, rates, marker='o', label=f"Slot {slot}")
 
@@ -100,13 +231,27 @@ class SRODataAnalyzer:
         plt.legend()
         plt.show()
 
+    def plot_rate_vs_time(self, crate_val=2, slot_val=13, window_ticks=250_000_000, channels=range(16)):
+        channel_info, edges, rates = self.rate_matrix(window_ticks)
+        seconds = (edges[:-1] - edges[0]) / CLOCK_HZ
+
+        plt.figure(figsize=(10, 5))
+        for ch in channels:
+            rows = np.flatnonzero((channel_info['crate'] == crate_val) & (channel_info['slot'] == slot_val)
+                                  & (channel_info['channel'] == ch))
+            if len(rows):
+                plt.step(seconds, rates[rows[0]], where='post', label=f"Ch {ch}")
+
+        plt.xlabel("Time since the first hit (s)")
+        plt.ylabel("Rate (Hz)")
+        plt.title(f"Rate vs Time (crate={crate_val}, slot={slot_val}, window={window_ticks} ticks)")
+        plt.grid(True)
+        plt.legend(ncol=4, fontsize='small')
+        plt.show()
+
     def plot_charge_histogram(self, crate_val=2, slot_val=13, channel_val=1, bins=50):
-        df_sel = self.df[
-            (self.df['crate'] == crate_val) &
-            (self.df['slot'] == slot_val) &
-            (self.df['channel'] == channel_val)
-        ]
-        if df_sel.empty:
+        df_sel = self.select(crate_val, slot_val, channel_val)
+        if len(df_sel) == 0:
             print("No matching data found.")
             return
 
@@ -124,15 +269,12 @@ class SRODataAnalyzer:
         fig, axes = plt.subplots(4, 4, figsize=(16, 12))
         axes = axes.flatten()
 
+        # the channels of the slot are consecutive slices of the offset index
         for i, ch in enumerate(channels):
             ax = axes[i]
-            df_sel = self.df[
-                (self.df['crate'] == crate_val) &
-                (self.df['slot'] == slot_val) &
-                (self.df['channel'] == ch)
-            ]
+            df_sel = self.select(crate_val, slot_val, ch)
 
-            if df_sel.empty:
+            if len(df_sel) == 0:
                 ax.text(0.5, 0.5, "No data", ha="center", va="center")
                 ax.set_title(f"Ch {ch}")
                 ax.axis("off")
@@ -156,5 +298,6 @@ if __name__ == "__main__":
 #    analyzer.plot_npy()
 #    analyzer.calculate_rate()
 #    analyzer.calculate_rate_all_channels()
+#    analyzer.plot_rate_vs_time(2, 13, window_ticks=250_000_000)
 #    analyzer.plot_charge_histogram(2,15,15)
     analyzer.plot_charge_histograms_all_channels(2,13)
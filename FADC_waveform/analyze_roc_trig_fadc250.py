@@ -1,10 +1,37 @@
 import argparse
 import numpy as np
-from pyevio import EvioFile
 from pyevio.decoders.fadc250_triggered import FaDecoder, FadcDataStruct
 import matplotlib.pyplot as plt
 import os
 import re
+import sys
+import shutil
+import time
+
+from fadc_storage import FADC_INFO_DTYPE, FADC_NPED, FadcBatch, RaggedWaveforms, channel_mask, active_channels
+from fadc_storage import load_fadc_info, load_waveforms, append_dense, append_ragged
+
+# shared EVIO helpers live in evio_common/ at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from evio_common.parallel import iter_range_events, run_parallel
+from evio_common.batch import group_by_run, plan_batch, BatchProgress
+from evio_common.payload import bank_words, open_evio
+from evio_common.index import load_index, TRIGGERED_TAG, STREAMING_TAG
+from evio_common.cache import DecodeCache
+from evio_common.jit import HAVE_NUMBA, ENGINES, DEFAULT_ENGINE
+from evio_common.profiling import StageProfiler, profile_stage, path_bytes
+from evio_common.diagnostics import Diagnostics, report, save_diagnostics
+
+from fadc_decode import decode_fadc_words, decode_fadc_words_numba
+
+# Version of the decoded output; a new version invalidates the decode cache
+DECODER_VERSION = 1
+
+# Bank decoder of each --engine but "python" (FaDecoder, word by word; see evio_common/jit.py)
+BLOCK_DECODERS = {
+    'numpy': decode_fadc_words,
+    'numba': decode_fadc_words_numba,
+}
 
 #def decode_fadc_bank(bank, decoder, verbose=False):  # this function can't decode multi slot data
 #    """
@@ -30,185 +57,256 @@ import re
 #
 #    return decoder
 
-def process_event(event, event_index, verbose=False):
+def summarize_channels(raw):
+    """
+    Valid samples and waveform summary of several channels at once.
+
+    Samples are valid up to the last positive one (0 means no data). The
+    pedestal is the mean of the first FADC_NPED valid samples (all of them in
+    a shorter window, 0 without data).
+
+    Args:
+        raw: Array (channels, samples) of raw samples
+
+    Returns:
+        dict: 'lengths', 'peaks', 'peak_positions', 'pedestals', 'wf_integrals', one entry per channel
+    """
+    nsamples = raw.shape[1]
+    positive = raw > 0
+    has_data = positive.any(axis=1)
+    lengths = np.where(has_data, nsamples - np.argmax(positive[:, ::-1], axis=1), 0)
+    in_window = np.arange(nsamples) < lengths[:, np.newaxis]
+
+    n_ped = np.minimum(lengths, FADC_NPED)
+    head = raw[:, :FADC_NPED]
+    ped_sums = np.where(np.arange(head.shape[1]) < n_ped[:, np.newaxis], head, 0).sum(axis=1, dtype=np.int64)
+    pedestals = ped_sums / np.maximum(n_ped, 1)
+    sums = np.where(in_window, raw, 0).sum(axis=1, dtype=np.int64)
+
+    return {
+        'lengths': lengths,
+        'peaks': np.maximum(raw.max(axis=1), 0),
+        'peak_positions': np.where(has_data, np.argmax(raw, axis=1), 0),
+        'pedestals': pedestals,
+        'wf_integrals': sums - pedestals * lengths,
+    }
+
+def add_block(batch, event_row, slot_id, evt_num, time, channels, width, integrals, over, raw):
+    """
+    Add one decoded slot block to the batch.
+
+    Args:
+        batch: FadcBatch that takes the block
+        event_row: Row of the event in the batch
+        slot_id, evt_num, time: Block header, event header and trigger time values
+        channels: Channels with hits
+        width: Window width of the block
+        integrals: Pulse integral of each hit channel
+        over: Window sum overflow flag of the block
+        raw: Array (channels, samples) of raw samples of the hit channels
+    """
+    row = batch.add_block(event_row)
+    info = batch.info[row]
+    info['slot_id'] = slot_id
+    info['evt_num'] = evt_num
+    info['time'] = time
+    if len(channels) == 0:
+        return
+
+    # Update the slot info with the hit channels
+    info['channel_mask'] = channel_mask(channels)
+    info['widths'][channels] = width
+    info['integrals'][channels] = integrals
+    info['overs'][channels] = bool(over)
+
+    # Summarize the raw samples of all hit channels together
+    summary = summarize_channels(raw)
+    info['peaks'][channels] = summary['peaks']
+    info['peak_positions'][channels] = summary['peak_positions']
+    info['pedestals'][channels] = summary['pedestals']
+    info['wf_integrals'][channels] = summary['wf_integrals']
+
+    batch.add_waveforms(event_row, info['slot_id'], channels, summary['lengths'], raw)
+
+def process_event(event, event_index, batch, verbose=False, engine=DEFAULT_ENGINE, profiler=None, diagnostics=None):
     """
     Process a single event to extract FADC data.
 
     Args:
         event: Event object to process
         event_index: Index of this event
-        verbose: Enable verbose output
+        batch: FadcBatch that takes the slot blocks of the event
+        verbose: Enable the verbose output of FaDecoder (python engine)
+        engine: "numpy" or "numba" decode each bank at once (BLOCK_DECODERS),
+            "python" feeds its words one by one to FaDecoder (the reference)
+        profiler: Optional StageProfiler that takes the time of the bank
+            traversal, the payload decoding and the block building
+        diagnostics: Optional Diagnostics that counts the bad events and keeps
+            hex dumps of the first ones; without one the errors are printed
 
     Returns:
-        dict: Dictionary containing processed event data or None if no valid data
+        int: Number of slot blocks added to the batch, or None if no valid data
     """
+    mark = batch.mark()
+    if profiler is not None:
+        event_start = time.perf_counter()
+        decode_seconds = build_seconds = 0.0
+        n_bytes = 0
     try:
         # Get the root bank for this event
         root_bank = event.get_bank()
 
         # Check for physics events (0xFF50 or 0xFF60)
         if root_bank.tag not in [0xFF50, 0xFF60]:
-            if verbose:
-                print(f"Skipping non-physics event {event_index} with tag 0x{root_bank.tag:04X}")
+            if diagnostics is not None:
+                diagnostics.report("non-physics event", event_index, f"root bank tag 0x{root_bank.tag:04X}")
             return None
 
-        # Get child banks
+        # Get child banks: FF21 bank (trigger bank) and the FADC banks
         children = list(root_bank.get_children())
         if len(children) < 2:
+            report(diagnostics, "short event", event_index, f"{len(children)} banks in the event",
+                   bank_words(root_bank))
             return None
-
-        # Find FF21 bank (trigger bank)
-        if children[0].tag == 0xFF21:
-            if verbose:
-                print(f"Found FF21 bank in event {event_index}")
-        else:
+        if children[0].tag != 0xFF21:
+            report(diagnostics, "missing FF21", event_index, f"first bank tag 0x{children[0].tag:04X}",
+                   bank_words(root_bank))
             return None
 
-        # Initialize data structures
-        FADC_NCHAN = 16
-        MAX_SAMPLES = 4096
-
-        # Data structures to hold results
-        event_list=[]  # a list of slot data
-
+        # Row of this event in the batch
+        event_row = batch.n_events
+        n_blocks = 0
 
         # Process all FADC banks
         for bank in children[1:]:
 
+            # Payload words as a view into the file mapping (no copy)
+            words = bank_words(bank)
+
+            if profiler is not None:
+                start = time.perf_counter()
+                build_before = build_seconds
+                n_bytes += words.nbytes
+
+            if engine in BLOCK_DECODERS:
+                # all blocks of the bank at once
+                blocks = BLOCK_DECODERS[engine](words, min_samples=FADC_NPED)
+                if profiler is not None:
+                    decode_seconds += time.perf_counter() - start
+                    start = time.perf_counter()
+                for b in range(len(blocks['slot_id'])):
+                    channels = np.flatnonzero(blocks['nhit'][b] > 0)
+                    add_block(batch, event_row, blocks['slot_id'][b], blocks['evt_num'][b], blocks['time'][b],
+                              channels, blocks['width'][b], blocks['integrals'][b, channels], blocks['over'][b],
+                              blocks['raw'][b, channels])
+                    n_blocks += 1
+                if profiler is not None:
+                    build_seconds += time.perf_counter() - start
+                continue
+
             # Create a new decoder for each event block (which is one slot of data)
             decoder = FaDecoder()
 
             # Decode the bank
             #decoder = decode_fadc_bank(bank, decoder, verbose) # can't decode multi slots
 
-            # Get the raw data from the bank
-            payload = bank.get_data()
-
-            # Convert payload to words
-            words = np.frombuffer(payload, dtype=np.dtype(f'{bank.endian}u4'))
-
             # Process each word with the decoder
             for word in words:
                 decoder.faDataDecode(int(word), verbose=verbose)
                 if decoder.block_trailer_found:
-                    event_data = {
-                        'waveforms': np.zeros((FADC_NCHAN, MAX_SAMPLES), dtype=np.int16),
-                        'info': {
-                            'slot_id': 0,
-                            'evt_num': 0,
-                            'time': 0,
-                            'channels': [],
-                            'widths': np.zeros(FADC_NCHAN, dtype=np.int32),
-                            'integrals': np.zeros(FADC_NCHAN, dtype=np.int32),
-                            'peaks': np.zeros(FADC_NCHAN, dtype=np.int32),
-                            'overs': np.zeros(FADC_NCHAN, dtype=np.bool_),
-                        },
-                        'has_data': False
-                    } # per slot
-                    # Check if we have raw data
-                    event_data['info']['slot_id'] = decoder.fadc_data.slot_id_hd
-                    event_data['info']['evt_num'] = decoder.fadc_data.evt_num_1
-                    event_data['info']['time'] = decoder.fadc_trigtime
-                    for chan in range(FADC_NCHAN):
-                        if decoder.fadc_nhit[chan] > 0:
-                            # Update event data with info from this channel
-                            if chan not in event_data['info']['channels']:
-                                event_data['info']['channels'].append(chan)
-
-                            event_data['info']['widths'][chan] = decoder.fadc_data.width
-                            event_data['info']['integrals'][chan] = decoder.fadc_int[chan]
-                            event_data['info']['overs'][chan] = bool(decoder.fadc_data.over)
-
-                            # Copy the raw data to our waveform array
-                            if hasattr(decoder, 'frawdata'):
-                                # Determine the number of valid samples
-                                valid_samples = 0
-                                for i, sample in enumerate(decoder.frawdata[chan]):
-                                    if sample > 0:  # Assuming 0 means no data
-                                        valid_samples = i + 1
-                                        # Update peak if this sample is larger
-                                        if sample > event_data['info']['peaks'][chan]:
-                                            event_data['info']['peaks'][chan] = sample
-
-                                # Copy data to waveform array
-                                event_data['waveforms'][chan, :valid_samples] = decoder.frawdata[chan][:valid_samples]
-                                event_data['has_data'] = True
-
-                    event_list.append(event_data)
+                    if profiler is not None:
+                        block_start = time.perf_counter()
+                    # one block per slot
+                    channels = np.flatnonzero(np.array(decoder.fadc_nhit) > 0)
+                    add_block(batch, event_row, decoder.fadc_data.slot_id_hd, decoder.fadc_data.evt_num_1,
+                              decoder.fadc_trigtime, channels, decoder.fadc_data.width,
+                              np.array(decoder.fadc_int)[channels], decoder.fadc_data.over,
+                              np.array([decoder.frawdata[chan] for chan in channels], dtype=np.int16))
+                    n_blocks += 1
+                    if profiler is not None:
+                        build_seconds += time.perf_counter() - block_start
+
                     del decoder
                     decoder = FaDecoder()  # each block (each slot) has its decoder
 
+            if profiler is not None:
+                decode_seconds += time.perf_counter() - start - (build_seconds - build_before)
 
-        if event_list is not None:
-            return event_list
-        else:
-            return None
+        batch.n_events += 1
+        return n_blocks
 
     except Exception as e:
-        print(f"Error processing event {event_index}: {e}")
+        report(diagnostics, "exception", event_index, f"{type(e).__name__}: {e}")
+        batch.rollback(mark)
         return None
 
-def collect_event_data(events_data):
+    finally:
+        if profiler is not None:
+            profiler.add("decode payload", decode_seconds, n_bytes)
+            profiler.add("build blocks", build_seconds)
+            profiler.add("bank traversal", time.perf_counter() - event_start - decode_seconds - build_seconds)
+
+def collect_event_data(batch, ragged=False, dense_file=None):
     """
     Collect data from processed events into arrays.
 
+    The dense waveform array is sized from the longest waveform the batch
+    saw while decoding and filled once from the ragged sample buffer.
+
     Args:
-        events_data: List of dictionaries containing event data
+        batch: FadcBatch filled by process_event
+        ragged: Return the waveforms as RaggedWaveforms instead of a dense array
+        dense_file: Write the dense array straight into this .npy file
+            (memory-mapped) instead of building it in memory
 
     Returns:
-        tuple: (waveforms array, info structured array)
+        tuple: (waveforms array or RaggedWaveforms, info structured array)
     """
     FADC_SLOT=[3,4]
     FADC_NCHAN = 16
 
     # Count valid events
-    valid_events = len(events_data)
+    valid_events = batch.n_events
 
     if valid_events == 0:
         return np.array([]), np.array([])
 
-    # Find maximum sample count
-    max_samples = 0
-    for event_data in events_data:
-        for chan in range(FADC_NCHAN):
-            # Find the last non-zero sample
-            non_zero = np.nonzero(event_data[0]['waveforms'][chan])[0]
-            if len(non_zero) > 0:
-                max_samples = max(max_samples, non_zero[-1] + 1)
-
-    # Create waveform array
-    waveforms = np.zeros((valid_events, len(FADC_SLOT), FADC_NCHAN, max_samples), dtype=np.int16)
-
-    # Create structured array for metadata
-    fadc_dtype = np.dtype([
-        ('slot_id', np.int32),
-        ('evt_num', np.int32),
-        ('time', np.int64),
-        ('channels', np.object_),  # List of active channels
-        ('widths', np.object_),    # Array of channel widths
-        ('integrals', np.object_), # Array of channel integrals
-        ('peaks', np.object_),     # Array of channel peaks
-        ('overs', np.object_)      # Array of channel over flags
-    ])
-
-    fadc_info = np.zeros((valid_events,len(FADC_SLOT)), dtype=fadc_dtype)
-
-    # Fill arrays
-    for i, event_list in enumerate(events_data):
-        for event_data in event_list:
-            # Copy metadata
-            slot_idx = FADC_SLOT.index(event_data['info']['slot_id'])
-            fadc_info[i][slot_idx]['slot_id'] = event_data['info']['slot_id']
-            fadc_info[i][slot_idx]['evt_num'] = event_data['info']['evt_num']
-            fadc_info[i][slot_idx]['time'] = event_data['info']['time']
-            fadc_info[i][slot_idx]['channels'] = event_data['info']['channels']
-            fadc_info[i][slot_idx]['widths'] = event_data['info']['widths']
-            fadc_info[i][slot_idx]['integrals'] = event_data['info']['integrals']
-            fadc_info[i][slot_idx]['peaks'] = event_data['info']['peaks']
-            fadc_info[i][slot_idx]['overs'] = event_data['info']['overs']
-
-            # Copy waveform data
-            waveforms[i, slot_idx, :, :] = event_data['waveforms'][:, :max_samples]
+    # slot id -> index into FADC_SLOT
+    slot_index = np.full(32, -1, dtype=np.int64)
+    slot_index[FADC_SLOT] = np.arange(len(FADC_SLOT))
+
+    # Create structured array for metadata (fixed width, see fadc_storage.py)
+    fadc_info = np.zeros((valid_events,len(FADC_SLOT)), dtype=FADC_INFO_DTYPE)
+
+    # Place every slot block at its (event, slot); a later block of the same slot replaces an earlier one
+    blocks = batch.info[:batch.n_blocks]
+    block_event = batch.block_event[:batch.n_blocks]
+    block_slot = slot_index[blocks['slot_id']]
+    if np.any(block_slot < 0):
+        raise ValueError(f"slot ids {np.unique(blocks['slot_id'][block_slot < 0])} are not in {FADC_SLOT}")
+    cell = block_event.astype(np.int64) * len(FADC_SLOT) + block_slot
+    _, last_from_end = np.unique(cell[::-1], return_index=True)
+    kept = np.zeros(batch.n_blocks, dtype=bool)
+    kept[batch.n_blocks - 1 - last_from_end] = True
+    fadc_info[block_event[kept], block_slot[kept]] = blocks[kept]
+
+    # Waveform index, with slots as index into FADC_SLOT
+    index = {key: column[:batch.n_waveforms] for key, column in batch.index.items()}
+    max_length = batch.max_length
+    if not kept.all():
+        # the waveforms of a replaced block go with it
+        row_block = np.searchsorted(batch.block_waveform[:batch.n_blocks], np.arange(batch.n_waveforms), side='right') - 1
+        index = {key: column[kept[row_block]] for key, column in index.items()}
+        max_length = int(index['length'].max()) if len(index['length']) > 0 else 0
+    index['slot'] = slot_index[index['slot']].astype(index['slot'].dtype)
+
+    waveforms = RaggedWaveforms(batch.samples[:batch.n_samples], index,
+                                (valid_events, len(FADC_SLOT), FADC_NCHAN, max_length))
+    if not ragged:
+        out = None
+        if dense_file is not None:
+            out = np.lib.format.open_memmap(dense_file, mode='w+', dtype=np.int16, shape=waveforms.shape)
+        waveforms = waveforms.dense(out=out)
 
     return waveforms, fadc_info
 
@@ -350,14 +448,9 @@ def generate_diagnostic_plots(waveforms, fadc_info, output_dir):
 
         # Plot histogram of peak ADC values
         # Extract peaks from the structured array
-        all_peaks = []
-        for i in range(len(fadc_info)):
-            peaks = fadc_info[i]['peaks']
-            for chan in range(len(peaks)):
-                if peaks[chan] > 0:
-                    all_peaks.append(peaks[chan])
-
-        if all_peaks:
+        all_peaks = fadc_info['peaks'][fadc_info['peaks'] > 0]
+
+        if len(all_peaks) > 0:
             plt.figure(figsize=(10, 6))
             plt.hist(all_peaks, bins=50)
             plt.title("Histogram of Peak ADC Values")
@@ -368,14 +461,9 @@ def generate_diagnostic_plots(waveforms, fadc_info, output_dir):
             plt.close()
 
         # Plot of all integral values
-        all_integrals = []
-        for i in range(len(fadc_info)):
-            integrals = fadc_info[i]['integrals']
-            for chan in range(len(integrals)):
-                if integrals[chan] > 0:
-                    all_integrals.append(integrals[chan])
-
-        if all_integrals:
+        all_integrals = fadc_info['integrals'][fadc_info['integrals'] > 0]
+
+        if len(all_integrals) > 0:
             plt.figure(figsize=(10, 6))
             plt.hist(all_integrals, bins=50)
             plt.title("Histogram of All Integral Values")
@@ -386,26 +474,18 @@ def generate_diagnostic_plots(waveforms, fadc_info, output_dir):
             plt.close()
 
         # Find all active channels
-        active_channels = set()
-        for i in range(len(fadc_info)):
-            channels = fadc_info[i]['channels']
-            if isinstance(channels, list):
-                active_channels.update(channels)
+        chan_active = active_channels(fadc_info)
+        channels_seen = np.flatnonzero(chan_active.reshape(-1, chan_active.shape[-1]).any(axis=0))
 
-        print(f"Generating integral histograms for {len(active_channels)} active channels...")
+        print(f"Generating integral histograms for {len(channels_seen)} active channels...")
 
         # Plot integral histograms for each active channel
-        for chan in sorted(active_channels):
-            # Collect integral values for this channel
-            chan_integrals = []
-            for i in range(len(fadc_info)):
-                # Make sure the channel is active in this event
-                if chan in fadc_info[i]['channels']:
-                    integral = fadc_info[i]['integrals'][chan]
-                    if integral > 0:
-                        chan_integrals.append(integral)
-
-            if chan_integrals:
+        for chan in channels_seen:
+            # Collect integral values for this channel where it is active
+            integrals = fadc_info['integrals'][..., chan]
+            chan_integrals = integrals[chan_active[..., chan] & (integrals > 0)]
+
+            if len(chan_integrals) > 0:
                 plt.figure(figsize=(10, 6))
                 counts, bins, _ = plt.hist(chan_integrals, bins=50, alpha=0.75)
 
@@ -441,83 +521,320 @@ def generate_diagnostic_plots(waveforms, fadc_info, output_dir):
 
                 print(f"  Created histogram for channel {chan} with {len(chan_integrals)} entries")
 
-def process_fadc_data(filename, max_event=None, output_dir="output", verbose=False):
+def decode_file(filename, max_event=None, verbose=False, start=0, stop=None, engine=DEFAULT_ENGINE, profiler=None,
+                diagnostics=None):
     """
-    Process EVIO file and extract FADC250 data into numpy arrays.
+    Decode the events of an EVIO file in one process.
 
     Args:
         filename: Input EVIO file
-        max_event: Maximum number of events to process (None for all)
-        output_dir: Directory for output files
+        max_event: Maximum number of events to process, counted from start (None for all)
         verbose: Enable verbose output
+        start: First event to decode
+        stop: Decode the events before this one (None for all)
+        engine: Bank decoder, see process_event
+        profiler: Optional StageProfiler (see process_event); also times the index and the record reading
+        diagnostics: Optional Diagnostics that counts the bad events (see process_event)
 
     Returns:
-        tuple: (waveforms array, info structured array)
+        tuple: (FadcBatch with the slot blocks of all processed events, EvioIndex of the file)
     """
-    print(f"Processing file: {filename}")
-
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
-
-    # get the run number
-    match = re.search(r'_(\d+)\.evio\.', filename)
-    if match:
-       run_number = match.group(1)
-       
     # Open the EVIO file
-    with EvioFile(filename) as evio_file:
-        total_event_count = evio_file.get_total_event_count()
+    with open_evio(filename) as evio_file:
+        # the sidecar index gives the event count and the root tags without parsing the events
+        with profile_stage(profiler, "load index"):
+            index = load_index(evio_file)
+        total_event_count = len(index)
         print(f"File contains {evio_file.record_count} records")
         print(f"File total_event_count = {total_event_count}")
 
+        stop = total_event_count if stop is None else min(stop, total_event_count)
         if max_event is None:
-            max_event = total_event_count
+            max_event = stop
         else:
-            max_event = min(max_event, total_event_count)
+            max_event = min(start + max_event, stop)
 
         print(f"max_event is set to: {max_event}")
 
-        # List to store processed event data
-        processed_events = []
+        # Only the physics events in the range are read
+        selected = index.select(start, max_event, tags=[TRIGGERED_TAG, STREAMING_TAG])
+        if len(selected) < max(max_event - start, 0):
+            print(f"Skipping {max(max_event - start, 0) - len(selected)} non-physics events")
+
+        # Buffers that take the slot blocks of the processed events
+        batch = FadcBatch()
 
         # Iterate through events
-        for global_evt_index, (record, event) in enumerate(evio_file.iter_events()):
+        events = index.iter_events(evio_file, selected)
+        if profiler is not None:
+            events = profiler.iterate("read records", events)
+        for global_evt_index, event in events:
+            # Process this event
+            n_blocks = process_event(event, global_evt_index, batch, verbose, engine, profiler, diagnostics)
+
+            if verbose and n_blocks is not None and batch.n_events % 100 == 0:
+                print(f"Processed {batch.n_events} valid events so far...")
+
+    return batch, index
+
+def decode_record_range(filename, record_start, record_stop, first_event, max_event, part_path, verbose=False,
+                        engine=DEFAULT_ENGINE, max_dumps=3):
+    """
+    Worker of the parallel decode: decode a range of records into a FadcBatch file.
+
+    Args:
+        filename: Input EVIO file
+        record_start: First record (inclusive)
+        record_stop: Last record (exclusive)
+        first_event: Global index of the first event of record_start
+        max_event: Stop before this global event index
+        part_path: .npz file that takes the batch
+        verbose: Enable verbose output
+        engine: Bank decoder, see process_event
+        max_dumps: Hex dumps kept per decode error category
+
+    Returns:
+        tuple: (number of events with FADC data in the range, Diagnostics.to_dict() of the range)
+    """
+    batch = FadcBatch()
+    diagnostics = Diagnostics(max_dumps)
+    with open_evio(filename) as evio_file:
+        for global_evt_index, event in iter_range_events(evio_file, record_start, record_stop, first_event):
             if global_evt_index >= max_event:
                 break
+            process_event(event, global_evt_index, batch, verbose, engine, diagnostics=diagnostics)
 
-            # Process this event
-            event_data = process_event(event, global_evt_index, verbose)
+    batch.save(part_path)
+    return batch.n_events, diagnostics.to_dict()
 
-            # Store valid event data
-            if event_data is not None:
-                processed_events.append(event_data)
+def decode_batch(runs, max_event=None, output_dir="output", verbose=False, jobs=2, summary_file=None,
+                 engine=DEFAULT_ENGINE, max_dumps=3):
+    """
+    Decode EVIO files on one pool of worker processes, split by record.
 
-                if verbose and len(processed_events) % 100 == 0:
-                    print(f"Processed {len(processed_events)} valid events so far...")
+    Every file is split into contiguous record ranges, and the ranges of all
+    files go to the same pool. Each worker decodes its range into a partial
+    FadcBatch file; the parts of a run are joined in file order, so the
+    result is the same for any number of jobs.
 
-        print(f"Processed {len(processed_events)} events with FADC data")
+    Args:
+        runs: run number -> list of files in order (evio_common.batch.group_by_run)
+        max_event: Maximum number of events to process per file (None for all)
+        output_dir: Directory for the partial output files
+        verbose: Enable verbose output
+        jobs: Number of worker processes
+        summary_file: Optional json file for the per-file throughput summary
+        engine: Bank decoder, see process_event
+        max_dumps: Hex dumps kept per decode error category (see diagnostics_path)
 
-        # Collect data into arrays
-        waveforms, fadc_info = collect_event_data(processed_events)
+    Returns:
+        dict: run number -> FadcBatch with the slot blocks of all processed events of the run
+    """
+    plan = plan_batch(runs, jobs, max_event)
+    print(f"Decoding {len(plan)} record ranges of {sum(len(files) for files in runs.values())} files with {jobs} jobs")
+
+    part_paths = []
+    for i, task in enumerate(plan):
+        parts_dir = os.path.join(output_dir, f".parts_{task['run']}")
+        os.makedirs(parts_dir, exist_ok=True)
+        part_paths.append(os.path.join(parts_dir, f"part_{i:05d}.npz"))
+
+    tasks = [(task['file'], task['record_start'], task['record_stop'], task['first_event'], task['max_event'],
+              part_path, verbose, engine, max_dumps)
+             for task, part_path in zip(plan, part_paths)]
+    progress = BatchProgress(plan)
+    results = run_parallel(decode_record_range, tasks, jobs,
+                           progress=lambda i, result, seconds: progress.done(i, result[0], seconds))
+
+    # Merge the parts of each run in file order
+    batches = {}
+    for run in runs:
+        batches[run] = FadcBatch()
+        diagnostics = Diagnostics(max_dumps)
+        for task, part_path, (_, part_diagnostics) in zip(plan, part_paths, results):
+            if task['run'] == run:
+                batches[run].extend(FadcBatch.load(part_path))
+                diagnostics.merge(part_diagnostics)
+        shutil.rmtree(os.path.join(output_dir, f".parts_{run}"), ignore_errors=True)
+        print(f"\nDecode errors of run {run}:")
+        save_diagnostics(diagnostics, diagnostics_path(run, output_dir))
+
+    progress.summary()
+    if summary_file is not None:
+        progress.save(summary_file)
+        print(f"Saved the batch summary to {summary_file}")
+
+    return batches
+
+def output_paths(run_number, output_dir="output", waveform_format="dense"):
+    """
+    Output files of a run.
 
-        if len(processed_events) > 0:
-            print(f"Final waveform array shape: {waveforms.shape}")
+    Returns:
+        tuple: (waveform .npy file or ragged directory, info .npy file)
+    """
+    if waveform_format == "ragged":
+        waveform_path = os.path.join(output_dir, f"fadc_waveforms_{run_number}")
+    else:
+        waveform_path = os.path.join(output_dir, f"fadc_waveforms_{run_number}.npy")
+    return waveform_path, os.path.join(output_dir, f"fadc_info_{run_number}.npy")
 
-            # Save data to numpy files
-            np.save(os.path.join(output_dir, f"fadc_waveforms_{run_number}.npy"), waveforms)
-            np.save(os.path.join(output_dir, f"fadc_info_{run_number}.npy"), fadc_info)
+def diagnostics_path(run_number, output_dir="output"):
+    """json file with the decode errors of a run (evio_common/diagnostics.py)."""
+    return os.path.join(output_dir, f"fadc_diagnostics_{run_number}.json")
 
-            # Generate time histogram
-            #print("\nGenerating time histogram...")
-            #generate_time_histogram(fadc_info, output_dir)
+def append_run(batch, run_number, output_dir="output", waveform_format="dense", profiler=None):
+    """
+    Append newly decoded events to the saved waveform and info arrays of a run.
 
-            # Generate diagnostic plots if requested
-            #if verbose:
-            #    generate_diagnostic_plots(waveforms, fadc_info, output_dir)
+    Args:
+        batch: FadcBatch with the slot blocks of the new events
+        run_number: Run number used in the output file names
+        output_dir: Directory for output files
+        waveform_format: "dense" or "ragged" (see process_fadc_data)
+        profiler: Optional StageProfiler that times the collection and the writing
+
+    Returns:
+        tuple: (waveforms array or RaggedWaveforms, info structured array), memory-mapped
+    """
+    print(f"Processed {batch.n_events} new events with FADC data")
+    waveform_path, info_path = output_paths(run_number, output_dir, waveform_format)
+
+    if batch.n_events > 0:
+        with profile_stage(profiler, "collect events"):
+            waveforms, fadc_info = collect_event_data(batch, ragged=True)
+        start = time.perf_counter()
+        if waveform_format == "ragged":
+            append_ragged(waveform_path, waveforms)
+        else:
+            append_dense(waveform_path, waveforms)
+        np.save(info_path, np.concatenate([load_fadc_info(info_path, mmap_mode=None), fadc_info]))
+        if profiler is not None:
+            profiler.add("serialize", time.perf_counter() - start, path_bytes(waveform_path, info_path))
+
+    waveforms = load_waveforms(waveform_path)
+    print(f"Final waveform array shape: {waveforms.shape}")
+    return waveforms, load_fadc_info(info_path)
+
+def save_run(batch, run_number, output_dir="output", waveform_format="dense", profiler=None):
+    """
+    Collect the decoded events of a run and save the waveform and info arrays.
+
+    Args:
+        batch: FadcBatch with the slot blocks of the run
+        run_number: Run number used in the output file names
+        output_dir: Directory for output files
+        waveform_format: "dense" or "ragged" (see process_fadc_data)
+        profiler: Optional StageProfiler that times the collection and the writing
+
+    Returns:
+        tuple: (waveforms array or RaggedWaveforms, info structured array)
+    """
+    print(f"Processed {batch.n_events} events with FADC data")
+
+    # Collect data into arrays; the dense waveforms go straight to their file
+    waveform_path, info_path = output_paths(run_number, output_dir, waveform_format)
+    dense_file = None
+    if batch.n_events > 0 and waveform_format == "dense":
+        dense_file = waveform_path
+    with profile_stage(profiler, "collect events"):
+        waveforms, fadc_info = collect_event_data(batch, ragged=(waveform_format == "ragged"), dense_file=dense_file)
+
+    if batch.n_events > 0:
+        print(f"Final waveform array shape: {waveforms.shape}")
+
+        # Save data to numpy files
+        start = time.perf_counter()
+        if waveform_format == "ragged":
+            waveforms.save(waveform_path)
         else:
-            print("No valid FADC data found in this file.")
+            waveforms.flush()
+        np.save(info_path, fadc_info)
+        if profiler is not None:
+            profiler.add("serialize", time.perf_counter() - start, path_bytes(waveform_path, info_path))
+
+        # Generate time histogram
+        #print("\nGenerating time histogram...")
+        #generate_time_histogram(fadc_info, output_dir)
+
+        # Generate diagnostic plots if requested
+        #if verbose:
+        #    generate_diagnostic_plots(waveforms, fadc_info, output_dir)
+    else:
+        print("No valid FADC data found in this file.")
+
+    return waveforms, fadc_info
 
-        return waveforms, fadc_info
+def process_fadc_data(filename, max_event=None, output_dir="output", verbose=False, waveform_format="dense", jobs=1,
+                      start=0, stop=None, use_cache=True, engine=DEFAULT_ENGINE, profiler=None, max_dumps=3):
+    """
+    Process EVIO file and extract FADC250 data into numpy arrays.
+
+    Args:
+        filename: Input EVIO file
+        max_event: Maximum number of events to process (None for all)
+        output_dir: Directory for output files
+        verbose: Enable verbose output
+        waveform_format: "dense" for one 4D .npy array, "ragged" for a directory
+            with the valid samples only (see RaggedWaveforms in fadc_storage.py)
+        jobs: Number of worker processes; more than 1 decodes record ranges in parallel
+        start: First event to decode (one job only)
+        stop: Decode the events before this one (None for all; one job only)
+        use_cache: Reuse the outputs of an earlier decode of the unchanged file,
+            and only decode the new records of a file that grew (one job only)
+        engine: Bank decoder, see process_event (both give the same outputs)
+        profiler: Optional StageProfiler filled by the decode and the save (one job only)
+        max_dumps: Hex dumps kept per decode error category (see diagnostics_path)
+
+    Returns:
+        tuple: (waveforms array or RaggedWaveforms, info structured array)
+    """
+    print(f"Processing file: {filename}")
+
+    # Create output directory if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+
+    # get the run number
+    match = re.search(r'_(\d+)\.evio\.', filename)
+    run_number = match.group(1) if match else "unknown"
+
+    if jobs > 1:
+        batch = decode_batch({run_number: [filename]}, max_event, output_dir, verbose, jobs,
+                             engine=engine, max_dumps=max_dumps)[run_number]
+        return save_run(batch, run_number, output_dir, waveform_format)
+
+    diagnostics = Diagnostics(max_dumps)
+    if not use_cache:
+        batch, index = decode_file(filename, max_event, verbose, start, stop, engine, profiler, diagnostics)
+        save_diagnostics(diagnostics, diagnostics_path(run_number, output_dir))
+        return save_run(batch, run_number, output_dir, waveform_format, profiler)
+
+    # Decode cache: the options that change the outputs are part of its key
+    cache = DecodeCache(output_dir)
+    options = {'waveform_format': waveform_format, 'max_event': max_event, 'start': start, 'stop': stop}
+    status, entry = cache.lookup(filename, "fadc250_triggered", DECODER_VERSION, options)
+    whole_file = max_event is None and start == 0 and stop is None
+
+    if status == "hit":
+        waveform_path, info_path = output_paths(run_number, output_dir, waveform_format)
+        print(f"Outputs are up to date (decode cache): {waveform_path}, {info_path}")
+        return load_waveforms(waveform_path), load_fadc_info(info_path)
+
+    if status == "grown" and whole_file and entry['outputs']:
+        # only the records written since the last decode are new
+        print(f"File grew since the last decode: decoding the events from {entry['events']}")
+        batch, index = decode_file(filename, verbose=verbose, start=entry['events'], engine=engine,
+                                   profiler=profiler, diagnostics=diagnostics)
+        save_diagnostics(diagnostics, diagnostics_path(run_number, output_dir), append=True)
+        waveforms, fadc_info = append_run(batch, run_number, output_dir, waveform_format, profiler)
+    else:
+        batch, index = decode_file(filename, max_event, verbose, start, stop, engine, profiler, diagnostics)
+        save_diagnostics(diagnostics, diagnostics_path(run_number, output_dir))
+        waveforms, fadc_info = save_run(batch, run_number, output_dir, waveform_format, profiler)
+
+    outputs = list(output_paths(run_number, output_dir, waveform_format)) if len(fadc_info) > 0 else []
+    cache.store(filename, "fadc250_triggered", DECODER_VERSION, options, index, outputs)
+    return waveforms, fadc_info
 
 def main():
     parser = argparse.ArgumentParser(description="Process EVIO files and extract FADC250 data")
@@ -528,12 +845,53 @@ def main():
                         help="Directory where output files will be saved.")
     parser.add_argument("-v", "--verbose", action="store_true",
                         help="Enable verbose output.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of worker processes decoding record ranges in parallel.")
+    parser.add_argument("--start", type=int, default=0,
+                        help="First event to decode (-e counts from here).")
+    parser.add_argument("--stop", type=int, default=None,
+                        help="Decode the events before this one.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Decode again even when the decode cache has up-to-date outputs.")
+    parser.add_argument("-b", "--batch", action="store_true",
+                        help="Decode all input files on one worker pool and write one output per run.")
+    parser.add_argument("-w", "--waveform-format", choices=["dense", "ragged"], default="dense",
+                        help="Save the waveforms as one dense 4D array or as ragged valid samples.")
+    parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                        help="Bank decoder: the word-by-word FaDecoder reference (python), vectorized numpy, "
+                             "or numba kernels (the default when numba is installed).")
+    parser.add_argument("--max-dumps", type=int, default=3,
+                        help="Hex dumps kept for the first bad events of each decode error category.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time the decode stages (record reading, bank traversal, payload decoding, "
+                             "block building, collection, writing) and print a summary table.")
+    parser.add_argument("--profile-json", default=None,
+                        help="Also save the --profile table to this json file (implies --profile).")
 #    parser.add_argument("-p", "--plot", action="store_true",
 #                        help="Generate diagnostic plots.")
 #    parser.add_argument("-t", "--time-hist", action="store_true",
 #                        help="Generate only the time histogram without other plots.")
     args = parser.parse_args()
 
+    if args.engine == "numba" and not HAVE_NUMBA:
+        parser.error("--engine numba needs the numba package")
+    if (args.jobs > 1 or args.batch) and (args.start or args.stop is not None):
+        parser.error("--start/--stop work with one job only and without --batch")
+    profiler = StageProfiler() if args.profile or args.profile_json else None
+    if profiler is not None and (args.jobs > 1 or args.batch):
+        parser.error("--profile works with one job only and without --batch")
+
+    if args.batch:
+        os.makedirs(args.output_dir, exist_ok=True)
+        batches = decode_batch(group_by_run(args.input_files), max_event=args.events, output_dir=args.output_dir,
+                               verbose=args.verbose, jobs=args.jobs,
+                               summary_file=os.path.join(args.output_dir, "batch_summary.json"), engine=args.engine,
+                               max_dumps=args.max_dumps)
+        for run, batch in batches.items():
+            print(f"\nRun {run}:")
+            save_run(batch, run, args.output_dir, args.waveform_format)
+        return
+
     # Run the processing for each file
     for file in args.input_files:
         fadc_info = process_fadc_data(
@@ -541,7 +899,15 @@ def main():
             max_event=args.events,
             output_dir=args.output_dir,
             #verbose=args.verbose or args.plot or args.time_hist
-            verbose=args.verbose
+            verbose=args.verbose,
+            waveform_format=args.waveform_format,
+            jobs=args.jobs,
+            start=args.start,
+            stop=args.stop,
+            use_cache=not args.no_cache,
+            engine=args.engine,
+            profiler=profiler,
+            max_dumps=args.max_dumps
         )
 
         #if waveforms.size > 0:
@@ -568,5 +934,11 @@ def main():
         #else:
         #    print("No valid FADC data found.")
 
+    if profiler is not None:
+        profiler.summary()
+        if args.profile_json is not None:
+            profiler.save(args.profile_json)
+            print(f"Saved the profile to {args.profile_json}")
+
 if __name__ == "__main__":
     main()
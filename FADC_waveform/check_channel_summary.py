@@ -0,0 +1,113 @@
+import argparse
+import sys
+import numpy as np
+
+from analyze_roc_trig_fadc250 import summarize_channels
+from check_fadc_decode import file_payloads
+from fadc_decode import decode_fadc_words
+from fadc_storage import FADC_NPED
+
+# Equivalence check of summarize_channels against the per-sample loop the
+# decoder used before it was vectorized, extended with the pedestal, peak
+# position and pedestal-subtracted integral: the hit channels of the slot
+# blocks of EVIO files and random sample windows (short windows, trailing
+# zeros, empty channels) are summarized both ways and every field is compared.
+
+FIELDS = ('lengths', 'peaks', 'peak_positions', 'pedestals', 'wf_integrals')
+
+def reference_summary(samples):
+    """Summary of one channel, sample by sample."""
+    valid_samples = 0
+    peak = 0
+    peak_position = 0
+    for i, sample in enumerate(samples):
+        if sample > 0:  # Assuming 0 means no data
+            valid_samples = i + 1
+            # Update peak if this sample is larger
+            if sample > peak:
+                peak = sample
+                peak_position = i
+
+    n_ped = min(FADC_NPED, valid_samples)
+    pedestal = sum(int(s) for s in samples[:n_ped]) / n_ped if n_ped > 0 else 0.0
+    integral = sum(int(s) for s in samples[:valid_samples]) - pedestal * valid_samples
+    return {
+        'lengths': valid_samples,
+        'peaks': peak,
+        'peak_positions': peak_position,
+        'pedestals': pedestal,
+        'wf_integrals': integral,
+    }
+
+def compare(raw):
+    """
+    Summarize raw with summarize_channels and with reference_summary.
+
+    Args:
+        raw: Array (channels, samples) of raw samples
+
+    Returns:
+        list: Names of the fields that differ
+    """
+    summary = summarize_channels(raw)
+    mismatches = set()
+    for c, samples in enumerate(raw):
+        expected = reference_summary(samples)
+        for key in FIELDS:
+            if not np.isclose(summary[key][c], expected[key]):
+                mismatches.add(key)
+    return sorted(mismatches)
+
+def random_raw(rng):
+    """Random sample windows: a pulse on a pedestal, valid lengths from 0 to the full window."""
+    n_channels = int(rng.integers(1, 17))
+    n_samples = int(rng.integers(FADC_NPED, 40))
+    raw = rng.integers(1, 4096, size=(n_channels, n_samples)).astype(np.int16)
+    lengths = rng.integers(0, n_samples + 1, size=n_channels)
+    raw[np.arange(n_samples) >= lengths[:, np.newaxis]] = 0
+    raw[rng.random(raw.shape) < 0.05] = 0                      # zeros inside the window
+    return raw
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare summarize_channels with the per-sample waveform loop")
+    parser.add_argument("input_files", nargs="*", help="EVIO files with triggered FADC250 data.")
+    parser.add_argument("-e", "--events", type=int, default=None,
+                        help="If set, only check this many events per file.")
+    parser.add_argument("-r", "--random", type=int, default=1000,
+                        help="Number of random sample windows to check.")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="Seed of the random sample windows.")
+    args = parser.parse_args()
+
+    failed = 0
+    for filename in args.input_files:
+        n_blocks = 0
+        n_channels = 0
+        for words in file_payloads(filename, args.events):
+            blocks = decode_fadc_words(words, min_samples=FADC_NPED)
+            for b in range(len(blocks['slot_id'])):
+                channels = np.flatnonzero(blocks['nhit'][b] > 0)
+                mismatches = compare(blocks['raw'][b, channels])
+                if mismatches:
+                    failed += 1
+                    print(f"{filename}: slot {blocks['slot_id'][b]} event {blocks['evt_num'][b]} "
+                          f"differs in {', '.join(mismatches)}")
+                n_blocks += 1
+                n_channels += len(channels)
+        print(f"{filename}: {n_blocks} slot blocks, {n_channels} channels checked")
+
+    rng = np.random.default_rng(args.seed)
+    for i in range(args.random):
+        mismatches = compare(random_raw(rng))
+        if mismatches:
+            failed += 1
+            print(f"Random window {i}: differs in {', '.join(mismatches)}")
+    print(f"{args.random} random sample windows checked")
+
+    if failed:
+        print(f"{failed} blocks differ from the per-sample loop")
+        sys.exit(1)
+    print("summarize_channels matches the per-sample loop")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import os
+import sys
+import tempfile
+import numpy as np
+
+from analyze_roc_trig_fadc250 import collect_event_data, process_event
+from check_fadc_decode import reference_blocks
+from fadc_storage import FADC_NCHAN, FadcBatch, channel_mask
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from evio_common.jit import ENGINES
+from evio_common.payload import bank_words, open_evio
+from evio_common.synthetic_evio import write_triggered_file
+
+# Check of events with two blocks of the same slot: a synthetic triggered
+# file whose events hold the blocks of slots 3, 4 and 3 again is decoded with
+# every engine, and fadc_info and the dense and ragged waveforms must hold
+# the later slot 3 block only, as if the earlier one was not there (the
+# baseline replaced the whole slot entry), with FaDecoder as the reference.
+
+FADC_SLOT = [3, 4]
+SLOTS = (3, 4, 3)
+
+def valid_length(samples):
+    """Samples up to the last positive one."""
+    positive = np.flatnonzero(samples > 0)
+    return positive[-1] + 1 if len(positive) > 0 else 0
+
+def expected_output(filename):
+    """
+    fadc_info fields and waveforms of every event, a later block of a slot replacing the earlier one.
+
+    Returns:
+        tuple: (dense waveform array, dict of fadc_info fields)
+    """
+    events = []
+    with open_evio(filename) as evio_file:
+        for record, event in evio_file.iter_events():
+            slots = {}
+            for bank in list(event.get_bank().get_children())[1:]:
+                for block in reference_blocks(np.array(bank_words(bank), dtype=np.uint32)):
+                    slots[block['slot_id']] = block
+            events.append(slots)
+
+    max_length = max((valid_length(raw) for slots in events for block in slots.values() for raw in block['raw']),
+                     default=0)
+    waveforms = np.zeros((len(events), len(FADC_SLOT), FADC_NCHAN, max_length), dtype=np.int16)
+    info = {key: np.zeros((len(events), len(FADC_SLOT)), dtype=np.int64)
+            for key in ('slot_id', 'evt_num', 'time', 'channel_mask')}
+    info['integrals'] = np.zeros((len(events), len(FADC_SLOT), FADC_NCHAN), dtype=np.int64)
+    for e, slots in enumerate(events):
+        for slot_id, block in slots.items():
+            s = FADC_SLOT.index(slot_id)
+            channels = np.flatnonzero(block['nhit'] > 0)
+            info['slot_id'][e, s] = slot_id
+            info['evt_num'][e, s] = block['evt_num']
+            info['time'][e, s] = block['time']
+            info['channel_mask'][e, s] = channel_mask(channels)
+            info['integrals'][e, s, channels] = block['integrals'][channels]
+            for chan in channels:
+                length = valid_length(block['raw'][chan])
+                waveforms[e, s, chan, :length] = block['raw'][chan][:length]
+    return waveforms, info
+
+def decoded_output(filename, engine):
+    """Dense waveforms, ragged waveforms and fadc_info of a file decoded with an engine."""
+    batch = FadcBatch()
+    with open_evio(filename) as evio_file:
+        for event_index, (record, event) in enumerate(evio_file.iter_events()):
+            process_event(event, event_index, batch, engine=engine)
+    ragged, _ = collect_event_data(batch, ragged=True)
+    waveforms, fadc_info = collect_event_data(batch)
+    return waveforms, ragged, fadc_info
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the decoders on events with a duplicated slot block")
+    parser.add_argument("-n", "--events", type=int, default=200,
+                        help="Events of the synthetic file.")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="Seed of the synthetic file.")
+    args = parser.parse_args()
+
+    failed = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "duplicate_run_1.evio.0")
+        write_triggered_file(filename, args.events, slots=SLOTS, seed=args.seed)
+        waveforms, info = expected_output(filename)
+
+        for engine in ENGINES:
+            decoded, ragged, fadc_info = decoded_output(filename, engine)
+            mismatches = [key for key, column in info.items() if not np.array_equal(fadc_info[key], column)]
+            if decoded.shape != waveforms.shape or not np.array_equal(decoded, waveforms):
+                mismatches.append('dense waveforms')
+            if ragged.shape != waveforms.shape or not np.array_equal(ragged.dense(), waveforms):
+                mismatches.append('ragged waveforms')
+            if mismatches:
+                failed += 1
+                print(f"{engine}: {', '.join(mismatches)} differ")
+            else:
+                print(f"{engine}: {args.events} events with slots {SLOTS} match")
+
+    if failed:
+        print(f"{failed} engines keep the replaced slot blocks")
+        sys.exit(1)
+    print("A later block of a slot replaces the earlier one in every output")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import numpy as np
+from pyevio.decoders.fadc250_triggered import FaDecoder
+
+from fadc_decode import decode_fadc_words, decode_fadc_words_numba, MAXRAW
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from evio_common.payload import bank_words, open_evio
+from evio_common.index import TRIGGERED_TAG
+
+# Equivalence check of decode_fadc_words and decode_fadc_words_numba against
+# FaDecoder, the word by word reference: the payloads of the triggered events of EVIO files and random
+# word streams (repeated channels, long trigger times, words outside blocks)
+# are decoded both ways and every block field is compared.
+
+DECODERS = {
+    'decode_fadc_words': decode_fadc_words,
+    'decode_fadc_words_numba': decode_fadc_words_numba,
+}
+
+def reference_blocks(words):
+    """Decode words with FaDecoder the way process_event does, one decoder per block."""
+    blocks = []
+    decoder = FaDecoder()
+    for word in words:
+        # the warnings of FaDecoder about odd words are not compared
+        with contextlib.redirect_stdout(io.StringIO()):
+            decoder.faDataDecode(int(word))
+        if decoder.block_trailer_found:
+            blocks.append({
+                'slot_id': decoder.fadc_data.slot_id_hd,
+                'evt_num': decoder.fadc_data.evt_num_1,
+                'time': decoder.fadc_trigtime,
+                'width': decoder.fadc_data.width,
+                'over': bool(decoder.fadc_data.over),
+                'nhit': np.array(decoder.fadc_nhit),
+                'integrals': np.array(decoder.fadc_int),
+                'raw': np.array(decoder.frawdata, dtype=np.int16),
+            })
+            decoder = FaDecoder()
+    return blocks
+
+def compare(words, decode, expected=None):
+    """
+    Decode words with FaDecoder and with decode.
+
+    Args:
+        words: Payload words
+        decode: Decoder to check (a DECODERS value)
+        expected: reference_blocks(words), when already decoded
+
+    Returns:
+        list: Names of the fields that differ ('blocks' for a different block count)
+    """
+    if expected is None:
+        expected = reference_blocks(words)
+    decoded = decode(words)
+    if len(decoded['slot_id']) != len(expected):
+        return ['blocks']
+
+    mismatches = set()
+    for b, block in enumerate(expected):
+        for key in ('slot_id', 'evt_num', 'time', 'width', 'over', 'nhit', 'integrals'):
+            if not np.array_equal(decoded[key][b], block[key]):
+                mismatches.add(key)
+        raw = decoded['raw'][b]
+        if raw.shape[1] > MAXRAW or not np.array_equal(raw, block['raw'][:, :raw.shape[1]]) \
+                or block['raw'][:, raw.shape[1]:].any():
+            mismatches.add('raw')
+    return sorted(mismatches)
+
+def random_words(rng, n_blocks):
+    """Random FADC250 blocks: block/event headers, trigger times, raw windows, sums and integrals."""
+    words = []
+    for _ in range(n_blocks):
+        if rng.random() < 0.2:
+            words.append(int(rng.integers(0, 1 << 31)))        # continuation word before the header
+        words.append((1 << 31) | (0 << 27) | (int(rng.integers(0, 32)) << 22) | int(rng.integers(0, 1 << 18)))
+        for _ in range(int(rng.integers(1, 4))):
+            words.append((1 << 31) | (2 << 27) | int(rng.integers(0, 1 << 27)))
+            for _ in range(int(rng.integers(0, 3))):
+                words.append(int(rng.integers(0, 1 << 31)))    # event header 2
+            words.append((1 << 31) | (3 << 27) | int(rng.integers(0, 1 << 27)))
+            for _ in range(int(rng.integers(0, 4))):
+                words.append(int(rng.integers(0, 1 << 31)))    # trigger time 2 (and more)
+            for _ in range(int(rng.integers(0, 6))):
+                chan = int(rng.integers(0, 4))                 # few channels: repeats and returns
+                kind = rng.choice([4, 5, 6, 7, 8, 12, 15])
+                words.append((1 << 31) | (int(kind) << 27) | (chan << 23) | int(rng.integers(0, 1 << 23)))
+                if kind in (4, 6, 12):
+                    words += [int(w) for w in rng.integers(0, 1 << 31, size=int(rng.integers(0, 12)))]
+        words.append((1 << 31) | (1 << 27) | int(rng.integers(0, 1 << 27)))
+        if rng.random() < 0.2:
+            words.append(int(rng.integers(0, 1 << 31)))        # continuation word after the trailer
+    if rng.random() < 0.5:
+        words.append((1 << 31) | (4 << 27) | 5)                # unterminated block
+        words.append(0x00010002)
+    return np.array(words, dtype=np.uint32)
+
+def file_payloads(filename, max_event):
+    """Payload words of the FADC banks of the triggered events of an EVIO file."""
+    payloads = []
+    with open_evio(filename) as evio_file:
+        for event_index, (record, event) in enumerate(evio_file.iter_events()):
+            if max_event is not None and event_index >= max_event:
+                break
+            root_bank = event.get_bank()
+            if root_bank.tag != TRIGGERED_TAG:
+                continue
+            children = list(root_bank.get_children())
+            payloads += [np.array(bank_words(bank), dtype=np.uint32) for bank in children[1:]]
+    return payloads
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the vectorized and numba FADC250 decoders with FaDecoder")
+    parser.add_argument("input_files", nargs="*", help="EVIO files with triggered FADC250 data.")
+    parser.add_argument("-e", "--events", type=int, default=None,
+                        help="If set, only check this many events per file.")
+    parser.add_argument("-r", "--random", type=int, default=200,
+                        help="Number of random word streams to check.")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="Seed of the random word streams.")
+    args = parser.parse_args()
+
+    # compile the numba kernels before anything is timed
+    decode_fadc_words_numba(random_words(np.random.default_rng(0), 1))
+
+    failed = 0
+    for filename in args.input_files:
+        payloads = file_payloads(filename, args.events)
+        n_words = sum(len(words) for words in payloads)
+
+        start = time.perf_counter()
+        expected = [reference_blocks(words) for words in payloads]
+        reference_seconds = time.perf_counter() - start
+        print(f"{filename}: {len(payloads)} banks, {n_words} words")
+        print(f"  {'FaDecoder':<24} {n_words / reference_seconds / 1e6:8.2f} Mwords/s")
+
+        for name, decode in DECODERS.items():
+            bad = [i for i, words in enumerate(payloads) if compare(words, decode, expected[i])]
+            failed += len(bad)
+            start = time.perf_counter()
+            for words in payloads:
+                decode(words)
+            seconds = time.perf_counter() - start
+            print(f"  {name:<24} {n_words / seconds / 1e6:8.2f} Mwords/s ({reference_seconds / seconds:.1f}x), "
+                  f"{len(bad)} banks differ")
+
+    rng = np.random.default_rng(args.seed)
+    for i in range(args.random):
+        words = random_words(rng, int(rng.integers(1, 5)))
+        expected = reference_blocks(words)
+        for name, decode in DECODERS.items():
+            mismatches = compare(words, decode, expected)
+            if mismatches:
+                failed += 1
+                print(f"Random stream {i}: {name} differs in {', '.join(mismatches)}")
+    print(f"{args.random} random word streams checked")
+
+    if failed:
+        print(f"{failed} payloads differ from FaDecoder")
+        sys.exit(1)
+    print("Both decoders match FaDecoder")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import sys
+import numpy as np
+from pathlib import Path
+
+from fadc_storage import convert_fadc_info_array
+
+def convert_fadc_info(info_path: str):
+    info_file = Path(info_path)
+    if not info_file.exists() or info_file.suffix != '.npy':
+        print(f"Error: File '{info_path}' does not exist or is not a .npy file.")
+        sys.exit(1)
+
+    old_info = np.load(info_file, allow_pickle=True)
+    if not old_info.dtype.hasobject:
+        print(f"{info_file} has no object fields, nothing to convert")
+        return
+
+    new_info = convert_fadc_info_array(old_info)
+
+    # Replace the file in place; the old layout is not kept
+    np.save(info_file, new_info)
+    print(f"Converted {new_info.size} entries in {info_file}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python convert_fadc_info.py <fadc_info file.npy> ...")
+        sys.exit(1)
+
+    for info_path in sys.argv[1:]:
+        convert_fadc_info(info_path)
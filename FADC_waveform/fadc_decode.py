@@ -0,0 +1,311 @@
+import os
+import sys
+import numpy as np
+
+# shared EVIO helpers live in evio_common/ at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from evio_common.jit import jit
+
+# Vectorized decoder of FADC250 triggered mode data (the words of one ROC
+# bank). It gives the same values as pyevio's FaDecoder fed word by word with
+# a new decoder per block, but works on whole arrays:
+#
+#   - a word with bit 31 set defines a new data type (bits 30:27); the words
+#     after it continue that type, up to the next type-defining word
+#   - a block ends with its block trailer (type 1); the decoder state starts
+#     over after it, so words before the first type-defining word of a block
+#     are filler (type 15)
+#
+# For each block the decoded fields are those process_event reads from the
+# decoder state once the trailer is found: the last block header, event
+# header, trigger time, window raw data header and window sum of the block,
+# the hits per channel, the pulse integral per channel (kept when it is the
+# first hit of the channel) and the raw samples per channel.
+FADC_NCHAN = 16
+MAXRAW = 4096             # raw samples per channel the decoder keeps
+
+BLOCK_HEADER = 0
+BLOCK_TRAILER = 1
+EVENT_HEADER = 2
+TRIGGER_TIME = 3
+WINDOW_RAW_DATA = 4
+WINDOW_SUM = 5
+PULSE_RAW_DATA = 6
+PULSE_INTEGRAL = 7
+FILLER = 15
+
+def _last_per_group(groups):
+    """Positions of the last entry of each run of equal values in a sorted array."""
+    return np.flatnonzero(np.r_[groups[1:] != groups[:-1], True])
+
+def _last_in_block(mask, block, values, n_blocks, dtype):
+    """Value of the last word of each block where mask is set (0 for blocks without one)."""
+    out = np.zeros(n_blocks, dtype=dtype)
+    positions = np.flatnonzero(mask)
+    if len(positions) > 0:
+        last = positions[_last_per_group(block[positions])]
+        out[block[last]] = values[last]
+    return out
+
+def decode_fadc_words(words, min_samples=0):
+    """
+    Decode the FADC250 blocks in the payload words of one bank.
+
+    Words after the last block trailer belong to no block and are ignored.
+
+    Args:
+        words: Payload words (any unsigned 32-bit array, e.g. from bank_words)
+        min_samples: Make the raw sample array at least this long
+
+    Returns:
+        dict: One entry per block:
+            'slot_id', 'evt_num', 'time', 'width', 'over' - shape (blocks,)
+            'nhit', 'integrals' - shape (blocks, 16)
+            'raw' - int16 samples, shape (blocks, 16, samples); samples that
+                were never written are 0, as in FaDecoder.frawdata
+    """
+    words = np.asarray(words, dtype=np.uint32)
+    new = (words & 0x80000000) != 0
+    new_type = (words >> 27) & 0xF
+
+    # blocks end with their trailer; what follows the last one is dropped
+    ends = np.flatnonzero(new & (new_type == BLOCK_TRAILER))
+    n_blocks = len(ends)
+    if n_blocks == 0:
+        return {
+            'slot_id': np.zeros(0, dtype=np.int32),
+            'evt_num': np.zeros(0, dtype=np.int32),
+            'time': np.zeros(0, dtype=np.int64),
+            'width': np.zeros(0, dtype=np.int32),
+            'over': np.zeros(0, dtype=np.bool_),
+            'nhit': np.zeros((0, FADC_NCHAN), dtype=np.int32),
+            'integrals': np.zeros((0, FADC_NCHAN), dtype=np.int32),
+            'raw': np.zeros((0, FADC_NCHAN, min_samples), dtype=np.int16),
+        }
+    n = ends[-1] + 1
+    words, new, new_type = words[:n], new[:n], new_type[:n]
+    positions = np.arange(n)
+
+    block = np.zeros(n, dtype=np.int64)
+    block[ends[:-1] + 1] = 1
+    block = np.cumsum(block)
+    starts = np.r_[0, ends[:-1] + 1]
+
+    # type of every word: that of the last type-defining word of its block
+    last_new = np.maximum.accumulate(np.where(new, positions, -1))
+    in_block = last_new >= starts[block]
+    types = np.where(in_block, new_type[np.maximum(last_new, 0)], FILLER)
+    chan = ((words & 0x07800000) >> 23).astype(np.int64)
+
+    # block header, event header, trigger time, window raw data header and window sum
+    slot_id = _last_in_block(new & (types == BLOCK_HEADER), block, (words & 0x7C00000) >> 22, n_blocks, np.int32)
+    evt_num = _last_in_block(new & (types == EVENT_HEADER), block, words & 0x3FFFFF, n_blocks, np.int32)
+    width = _last_in_block(new & (types == WINDOW_RAW_DATA), block, words & 0xFFF, n_blocks, np.int32)
+    over = _last_in_block(types == WINDOW_SUM, block, (words & 0x400000) != 0, n_blocks, np.bool_)
+
+    # the trigger time is set by its second word, together with the first word before it
+    time_2 = ~new & (types == TRIGGER_TIME)
+    time_1 = np.zeros(n, dtype=np.int64)
+    time_1[time_2] = words[last_new[time_2]] & 0xFFFFFF
+    trigtime = ((words.astype(np.int64) & 0xFFFFFF) << 24) | time_1
+    time = _last_in_block(time_2, block, trigtime, n_blocks, np.int64)
+
+    # hits: window raw data and pulse raw data headers, and every pulse integral word
+    raw_header = new & (types == WINDOW_RAW_DATA)
+    integral = types == PULSE_INTEGRAL
+    hit = raw_header | (new & (types == PULSE_RAW_DATA)) | integral
+    cell = block * FADC_NCHAN + chan
+    nhit = np.bincount(cell[hit], minlength=n_blocks * FADC_NCHAN).astype(np.int32)
+
+    # pulse integral of the channels whose first hit is a pulse integral
+    integrals = np.zeros(n_blocks * FADC_NCHAN, dtype=np.int32)
+    hit_words = np.flatnonzero(hit)
+    hit_cells, first = np.unique(cell[hit_words], return_index=True)
+    first_integral = integral[hit_words[first]]
+    integrals[hit_cells[first_integral]] = words[hit_words[first][first_integral]] & 0x7FFFF
+
+    raw = _raw_samples(words, new, types, last_new, block, chan, raw_header, n_blocks, min_samples)
+
+    return {
+        'slot_id': slot_id,
+        'evt_num': evt_num,
+        'time': time,
+        'width': width,
+        'over': over,
+        'nhit': nhit.reshape(n_blocks, FADC_NCHAN),
+        'integrals': integrals.reshape(n_blocks, FADC_NCHAN),
+        'raw': raw,
+    }
+
+def _raw_samples(words, new, types, last_new, block, chan, raw_header, n_blocks, min_samples):
+    """
+    Raw samples of the window raw data words, shape (blocks, 16, samples).
+
+    Each continuation word holds two samples. They are written from sample 0
+    after a window raw data header whose channel differs from that of the
+    previous header of the block, and continue where the previous window
+    stopped otherwise (FaDecoder.nrawdata). A channel that comes back later
+    in the block overwrites its earlier samples.
+    """
+    samples = ~new & (types == WINDOW_RAW_DATA)
+    headers = np.flatnonzero(raw_header)
+    if not samples.any():
+        return np.zeros((n_blocks, FADC_NCHAN, min_samples), dtype=np.int16)
+
+    # a run of headers of one channel shares one sample counter
+    header_block, header_chan = block[headers], chan[headers]
+    run_start = np.r_[True, (header_block[1:] != header_block[:-1]) | (header_chan[1:] != header_chan[:-1])]
+    run = np.cumsum(run_start) - 1
+
+    # sample words written before each run started
+    written = np.cumsum(samples)
+    run_base = written[headers[run_start]]
+
+    sample_words = np.flatnonzero(samples)
+    header = np.searchsorted(headers, last_new[sample_words])
+    sample_run = run[header]
+    position = 2 * (written[sample_words] - 1 - run_base[sample_run])
+    keep = position < MAXRAW
+    sample_words, position = sample_words[keep], position[keep]
+
+    cell = block[sample_words] * FADC_NCHAN + chan[headers[header[keep]]]
+    run_cells = header_block[run_start] * FADC_NCHAN + header_chan[run_start]
+    if len(np.unique(run_cells)) < len(run_cells):
+        # a channel has several runs: the last write of each sample wins
+        target = cell * MAXRAW + position
+        _, last = np.unique(target[::-1], return_index=True)
+        last = np.sort(len(target) - 1 - last)
+        sample_words, cell, position = sample_words[last], cell[last], position[last]
+
+    n_samples = max(int(position.max()) + 2 if len(position) > 0 else 0, min_samples)
+    raw = np.zeros((n_blocks * FADC_NCHAN, n_samples), dtype=np.int16)
+    pair = words[sample_words]
+    raw[cell, position] = (pair & 0x1FFF0000) >> 16
+    raw[cell, position + 1] = pair & 0x1FFF
+    return raw.reshape(n_blocks, FADC_NCHAN, n_samples)
+
+@jit
+def _scan_fadc_blocks(words):
+    """Compiled kernel: number of blocks and the longest raw window (in samples) of a bank."""
+    n_blocks = 0
+    n_samples = 0
+    block_samples = 0       # of the block being read; words after the last trailer do not count
+    type_last = FILLER
+    chan = 0
+    old_chan = -1
+    n_raw = 0
+    for i in range(len(words)):
+        word = np.int64(words[i])
+        new = (word & 0x80000000) != 0
+        data_type = (word >> 27) & 0xF if new else type_last
+        if data_type == BLOCK_TRAILER and new:
+            n_blocks += 1
+            n_samples = max(n_samples, block_samples)
+            block_samples = 0
+            type_last = FILLER
+            old_chan = -1
+            n_raw = 0
+            continue
+        if data_type == WINDOW_RAW_DATA:
+            if new:
+                chan = (word >> 23) & 0xF
+                if chan != old_chan:
+                    n_raw = 0
+                    old_chan = chan
+            elif n_raw < MAXRAW:
+                n_raw += 2
+                block_samples = max(block_samples, n_raw)
+        type_last = data_type
+    return n_blocks, n_samples
+
+@jit
+def _decode_fadc_blocks(words, slot_id, evt_num, time, width, over, nhit, integrals, raw):
+    """Compiled kernel: FaDecoder's word loop, filling the output arrays block by block."""
+    n_blocks = len(slot_id)
+    block = 0
+    type_last = FILLER
+    time_last = 0
+    time_1 = 0
+    chan = 0
+    old_chan = -1
+    n_raw = 0
+    for i in range(len(words)):
+        if block == n_blocks:
+            break
+        word = np.int64(words[i])
+        new = (word & 0x80000000) != 0
+        data_type = (word >> 27) & 0xF if new else type_last
+
+        if data_type == BLOCK_HEADER:
+            if new:
+                slot_id[block] = (word & 0x7C00000) >> 22
+        elif data_type == BLOCK_TRAILER:
+            if new:
+                # the next block starts with a new decoder state
+                block += 1
+                type_last = FILLER
+                time_last = 0
+                old_chan = -1
+                n_raw = 0
+                continue
+        elif data_type == EVENT_HEADER:
+            if new:
+                evt_num[block] = word & 0x3FFFFF
+        elif data_type == TRIGGER_TIME:
+            if new:
+                time_1 = word & 0xFFFFFF
+                time_last = 1
+            elif time_last == 1:
+                time[block] = ((word & 0xFFFFFF) << 24) | time_1
+        elif data_type == WINDOW_RAW_DATA:
+            if new:
+                chan = (word & 0x07800000) >> 23
+                width[block] = word & 0xFFF
+                if chan != old_chan:
+                    n_raw = 0
+                    old_chan = chan
+                nhit[block, chan] += 1
+            elif n_raw < MAXRAW:
+                raw[block, chan, n_raw] = (word & 0x1FFF0000) >> 16
+                raw[block, chan, n_raw + 1] = word & 0x1FFF
+                n_raw += 2
+        elif data_type == WINDOW_SUM:
+            over[block] = (word & 0x400000) != 0
+        elif data_type == PULSE_RAW_DATA:
+            if new:
+                nhit[block, (word & 0x07800000) >> 23] += 1
+        elif data_type == PULSE_INTEGRAL:
+            hit_chan = (word & 0x07800000) >> 23
+            nhit[block, hit_chan] += 1
+            if nhit[block, hit_chan] == 1:
+                integrals[block, hit_chan] = word & 0x7FFFF
+        type_last = data_type
+
+def decode_fadc_words_numba(words, min_samples=0):
+    """
+    The same result as decode_fadc_words, from one compiled pass over the words.
+
+    Args:
+        words: Payload words (any unsigned 32-bit array, e.g. from bank_words)
+        min_samples: Make the raw sample array at least this long
+
+    Returns:
+        dict: See decode_fadc_words
+    """
+    # the kernels take native byte order words
+    words = np.asarray(words, dtype=np.uint32)
+    n_blocks, n_samples = _scan_fadc_blocks(words)
+    blocks = {
+        'slot_id': np.zeros(n_blocks, dtype=np.int32),
+        'evt_num': np.zeros(n_blocks, dtype=np.int32),
+        'time': np.zeros(n_blocks, dtype=np.int64),
+        'width': np.zeros(n_blocks, dtype=np.int32),
+        'over': np.zeros(n_blocks, dtype=np.bool_),
+        'nhit': np.zeros((n_blocks, FADC_NCHAN), dtype=np.int32),
+        'integrals': np.zeros((n_blocks, FADC_NCHAN), dtype=np.int32),
+        'raw': np.zeros((n_blocks, FADC_NCHAN, max(n_samples, min_samples)), dtype=np.int16),
+    }
+    if n_blocks > 0:
+        _decode_fadc_blocks(words, blocks['slot_id'], blocks['evt_num'], blocks['time'], blocks['width'],
+                            blocks['over'], blocks['nhit'], blocks['integrals'], blocks['raw'])
+    return blocks
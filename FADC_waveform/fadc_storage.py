@@ -0,0 +1,471 @@
+import os
+import numpy as np
+
+FADC_NCHAN = 16
+
+# Fixed-width layout of fadc_info (one entry per event and slot). Every field
+# has a fixed size, so the array is saved without pickle and can be
+# memory-mapped. Bit n of channel_mask is set when channel n has a hit.
+# The waveform summary fields (pedestals, peak_positions, wf_integrals) are
+# computed from the raw samples by the decoder; converted files leave them 0.
+FADC_INFO_DTYPE = np.dtype([
+    ('slot_id', np.int32),
+    ('evt_num', np.int32),
+    ('time', np.int64),
+    ('channel_mask', np.uint16),
+    ('widths', np.int32, (FADC_NCHAN,)),
+    ('integrals', np.int32, (FADC_NCHAN,)),
+    ('peaks', np.int32, (FADC_NCHAN,)),
+    ('overs', np.bool_, (FADC_NCHAN,)),
+    ('pedestals', np.float32, (FADC_NCHAN,)),     # mean of the first FADC_NPED valid samples
+    ('peak_positions', np.int16, (FADC_NCHAN,)),  # sample index of the peak
+    ('wf_integrals', np.float32, (FADC_NCHAN,)),  # pedestal-subtracted sum of the valid samples
+])
+
+# Samples at the start of a window that make the pedestal
+FADC_NPED = 4
+
+def channel_mask(channels):
+    """
+    Bitmask of a list of channels.
+
+    Args:
+        channels: Iterable of channel numbers (0-15)
+
+    Returns:
+        int: Mask with bit n set for channel n
+    """
+    mask = 0
+    for chan in channels:
+        mask |= 1 << int(chan)
+    return mask
+
+def mask_channels(mask):
+    """
+    List of the channels set in one channel mask.
+
+    Args:
+        mask: Channel bitmask
+
+    Returns:
+        list: Channel numbers in increasing order
+    """
+    return [chan for chan in range(FADC_NCHAN) if (int(mask) >> chan) & 1]
+
+def active_channels(fadc_info):
+    """
+    Boolean channel flags of fadc_info entries.
+
+    Args:
+        fadc_info: Array with FADC_INFO_DTYPE, any shape
+
+    Returns:
+        numpy.ndarray: Bool array of shape fadc_info.shape + (16,)
+    """
+    bits = np.arange(FADC_NCHAN, dtype=np.uint16)
+    return ((fadc_info['channel_mask'][..., np.newaxis] >> bits) & 1).astype(np.bool_)
+
+def convert_fadc_info_array(old_info):
+    """
+    Convert a fadc_info array with object fields to FADC_INFO_DTYPE.
+
+    Args:
+        old_info: fadc_info array whose channels/widths/integrals/peaks/overs
+            fields are Python objects (the earlier decoder output)
+
+    Returns:
+        numpy.ndarray: Array of the same shape with FADC_INFO_DTYPE
+    """
+    new_info = np.zeros(old_info.shape, dtype=FADC_INFO_DTYPE)
+    for key in ('slot_id', 'evt_num', 'time'):
+        new_info[key] = old_info[key]
+
+    for index in np.ndindex(old_info.shape):
+        entry = old_info[index]
+        # entries of slots without data keep the zero from np.zeros
+        if isinstance(entry['channels'], (list, np.ndarray)):
+            new_info['channel_mask'][index] = channel_mask(entry['channels'])
+        for key in ('widths', 'integrals', 'peaks', 'overs'):
+            if isinstance(entry[key], np.ndarray):
+                new_info[key][index] = entry[key]
+
+    return new_info
+
+def load_fadc_info(filename, mmap_mode='r'):
+    """
+    Load a fadc_info file.
+
+    Files with FADC_INFO_DTYPE are memory-mapped. Files written with object
+    fields are read with pickle and converted in memory; convert_fadc_info.py
+    rewrites them once.
+
+    Args:
+        filename: fadc_info .npy file
+        mmap_mode: Passed to np.load for fixed-width files
+
+    Returns:
+        numpy.ndarray: fadc_info array with FADC_INFO_DTYPE
+    """
+    try:
+        return np.load(filename, mmap_mode=mmap_mode)
+    except ValueError:
+        # object arrays refuse to load without pickle
+        print(f"Warning: {filename} has object fields; run convert_fadc_info.py on it")
+        return convert_fadc_info_array(np.load(filename, allow_pickle=True))
+
+# Ragged waveform layout: the valid samples of every (event, slot, channel)
+# with data, back to back in one int16 buffer, and one index row per
+# waveform. Saved as a directory of .npy files:
+#
+#   samples.npy          all samples
+#   index_<column>.npy   event, slot (index into the slot list), channel, offset, length
+#   shape.npy            shape of the dense array (events, slots, channels, samples)
+WAVEFORM_INDEX_DTYPES = {
+    'event': np.int32,
+    'slot': np.uint8,
+    'channel': np.uint8,
+    'offset': np.int64,
+    'length': np.uint16,
+}
+
+class RaggedWaveforms:
+    """
+    Waveforms stored without the zero padding of the dense 4D array.
+
+    Indexing with [event], [event, slot], [event, slot, channel] or an
+    event slice gives the same values as the dense array, built on demand
+    for the selected events only.
+
+    Parameters:
+    -----------
+    samples : numpy.ndarray
+        int16 buffer with the samples of all waveforms
+    index : dict
+        Index columns (WAVEFORM_INDEX_DTYPES), rows sorted by event
+    shape : tuple
+        Shape of the dense array (events, slots, channels, samples)
+    """
+    def __init__(self, samples, index, shape):
+        self.samples = samples
+        self.index = index
+        self.shape = tuple(int(n) for n in shape)
+        self.nevents, self.nslots, self.nchannels, self.nsamples = self.shape
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load a ragged waveform directory, memory-mapped by default."""
+        samples = np.load(os.path.join(path, "samples.npy"), mmap_mode=mmap_mode)
+        index = {key: np.load(os.path.join(path, f"index_{key}.npy"), mmap_mode=mmap_mode)
+                 for key in WAVEFORM_INDEX_DTYPES}
+        shape = np.load(os.path.join(path, "shape.npy"))
+        return cls(samples, index, shape)
+
+    def save(self, path):
+        """Save as a directory of .npy files (see WAVEFORM_INDEX_DTYPES)."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "samples.npy"), np.asarray(self.samples, dtype=np.int16))
+        for key, dtype in WAVEFORM_INDEX_DTYPES.items():
+            np.save(os.path.join(path, f"index_{key}.npy"), np.asarray(self.index[key], dtype=dtype))
+        np.save(os.path.join(path, "shape.npy"), np.array(self.shape, dtype=np.int64))
+
+    def __len__(self):
+        return self.nevents
+
+    def waveform(self, event, slot, channel):
+        """
+        Valid samples of one waveform, without padding.
+
+        Returns:
+            numpy.ndarray: int16 samples (empty when the channel has no data)
+        """
+        lo, hi = np.searchsorted(self.index['event'], [event, event + 1])
+        rows = lo + np.flatnonzero((self.index['slot'][lo:hi] == slot) & (self.index['channel'][lo:hi] == channel))
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int16)
+        row = rows[-1]
+        offset = self.index['offset'][row]
+        return np.asarray(self.samples[offset:offset + self.index['length'][row]])
+
+    def dense(self, start=0, stop=None, out=None):
+        """
+        Dense 4D array (events, slots, channels, samples) of an event range.
+
+        Args:
+            start: First event (inclusive)
+            stop: Last event (exclusive), None for all events
+            out: Zero-filled int16 array of the result shape to fill (for
+                example a np.lib.format.open_memmap file); a new array if None
+
+        Returns:
+            numpy.ndarray: int16 array of shape (stop - start, slots, channels, samples)
+        """
+        stop = self.nevents if stop is None else min(stop, self.nevents)
+        start = min(start, stop)
+        if out is None:
+            out = np.zeros((stop - start, self.nslots, self.nchannels, self.nsamples), dtype=np.int16)
+
+        # Copy the rows in groups, so the position arrays stay small next to the output
+        lo, hi = np.searchsorted(self.index['event'], [start, stop])
+        rows_per_group = max(1, self.DENSE_GROUP_SAMPLES // max(self.nsamples, 1))
+        for group in range(lo, hi, rows_per_group):
+            self._fill_rows(out, group, min(group + rows_per_group, hi), start)
+        return out
+
+    # samples copied per group by dense()
+    DENSE_GROUP_SAMPLES = 1 << 22
+
+    def _fill_rows(self, out, lo, hi, start):
+        """Copy the waveforms of index rows lo:hi into out, whose first event is start."""
+        lengths = self.index['length'][lo:hi].astype(np.int64)
+        total = int(lengths.sum())
+        if total == 0:
+            return
+
+        # Flat destination and source position of every sample of the rows
+        event = self.index['event'][lo:hi].astype(np.int64) - start
+        slot = self.index['slot'][lo:hi].astype(np.int64)
+        channel = self.index['channel'][lo:hi].astype(np.int64)
+        row_start = ((event * self.nslots + slot) * self.nchannels + channel) * self.nsamples
+        within = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+        flat = out.reshape(-1)
+        flat[np.repeat(row_start, lengths) + within] = self.samples[np.repeat(self.index['offset'][lo:hi], lengths) + within]
+
+    def to_dense(self):
+        """Dense 4D array of all events."""
+        return self.dense()
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        event, rest = key[0], key[1:]
+
+        if isinstance(event, slice):
+            start, stop, step = event.indices(self.nevents)
+            if step != 1:
+                return self.dense(start, stop)[::step][(slice(None),) + rest]
+            return self.dense(start, stop)[(slice(None),) + rest]
+
+        event = int(event)
+        if event < 0:
+            event += self.nevents
+        if event < 0 or event >= self.nevents:
+            raise IndexError(f"event {key[0]} out of range (0-{self.nevents - 1})")
+        return self.dense(event, event + 1)[(0,) + rest]
+
+def load_waveforms(path, mmap_mode='r'):
+    """
+    Load waveforms saved as a dense .npy file or a ragged directory.
+
+    Returns:
+        numpy.ndarray or RaggedWaveforms: Both index as [event, slot, channel, sample]
+    """
+    if os.path.isdir(path):
+        return RaggedWaveforms.load(path, mmap_mode=mmap_mode)
+    return np.load(path, mmap_mode=mmap_mode)
+
+def append_ragged(path, new):
+    """
+    Append the events of a RaggedWaveforms to a saved ragged waveform directory.
+
+    Args:
+        path: Ragged waveform directory (RaggedWaveforms.save)
+        new: RaggedWaveforms of the events that follow the saved ones
+    """
+    old = RaggedWaveforms.load(path, mmap_mode=None)
+    index = {key: np.concatenate([old.index[key], new.index[key]]).astype(dtype)
+             for key, dtype in WAVEFORM_INDEX_DTYPES.items()}
+    index['event'][len(old.index['event']):] += old.nevents
+    index['offset'][len(old.index['offset']):] += len(old.samples)
+    shape = (old.nevents + new.nevents, old.nslots, old.nchannels, max(old.nsamples, new.nsamples))
+    RaggedWaveforms(np.concatenate([old.samples, new.samples]), index, shape).save(path)
+
+def append_dense(dense_file, new):
+    """
+    Append the events of a RaggedWaveforms to a dense waveform .npy file.
+
+    The file is rewritten (through a temporary file) with the longer of the
+    two sample lengths; the new events are never held in memory all at once.
+
+    Args:
+        dense_file: Dense 4D .npy file (events, slots, channels, samples)
+        new: RaggedWaveforms of the events that follow the saved ones
+    """
+    old = np.load(dense_file, mmap_mode='r')
+    nsamples = max(old.shape[3], new.nsamples)
+    tmp_file = dense_file + ".tmp.npy"
+    out = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=np.int16,
+                                    shape=(old.shape[0] + new.nevents,) + old.shape[1:3] + (nsamples,))
+
+    events_per_group = max(1, RaggedWaveforms.DENSE_GROUP_SAMPLES // max(old[0].size, 1))
+    for start in range(0, old.shape[0], events_per_group):
+        stop = min(start + events_per_group, old.shape[0])
+        out[start:stop, :, :, :old.shape[3]] = old[start:stop]
+    for start in range(0, new.nevents, events_per_group):
+        stop = min(start + events_per_group, new.nevents)
+        out[old.shape[0] + start:old.shape[0] + stop, :, :, :new.nsamples] = new.dense(start, stop)
+
+    out.flush()
+    del out, old
+    os.replace(tmp_file, dense_file)
+
+def _grow(array, size):
+    """Copy of array with room for at least size entries (capacity doubles)."""
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+class FadcBatch:
+    """
+    Preallocated buffers for the slot blocks of many decoded events.
+
+    Every slot block takes one fadc_info row (the event row it belongs to is
+    kept in block_event) and its waveforms are appended to a ragged sample
+    buffer (its first waveform row is kept in block_waveform). The buffers double when full, so nothing is allocated per event.
+
+    Usage:
+        batch = FadcBatch()
+        row = batch.add_block(batch.n_events)
+        batch.info[row]['slot_id'] = 3
+        batch.add_waveforms(batch.n_events, 3, channels, lengths, raw)
+        batch.n_events += 1
+    """
+    def __init__(self, block_capacity=1024, waveform_capacity=4096, sample_capacity=1 << 20):
+        self.n_events = 0
+        self.n_blocks = 0
+        self.n_waveforms = 0
+        self.n_samples = 0
+        self.max_length = 0      # longest waveform so far, sizes the dense array
+        self.info = np.zeros(block_capacity, dtype=FADC_INFO_DTYPE)
+        self.block_event = np.zeros(block_capacity, dtype=np.int32)
+        self.block_waveform = np.zeros(block_capacity, dtype=np.int64)
+        # waveform index; 'slot' holds the slot id until collect maps it to the slot list
+        self.index = {key: np.zeros(waveform_capacity, dtype=dtype) for key, dtype in WAVEFORM_INDEX_DTYPES.items()}
+        self.samples = np.zeros(sample_capacity, dtype=np.int16)
+
+    def mark(self):
+        """State to roll back to when an event fails half way."""
+        return (self.n_events, self.n_blocks, self.n_waveforms, self.n_samples, self.max_length)
+
+    def rollback(self, mark):
+        """Drop everything added after mark."""
+        n_blocks = self.n_blocks
+        self.n_events, self.n_blocks, self.n_waveforms, self.n_samples, self.max_length = mark
+        self.info[self.n_blocks:n_blocks] = 0
+
+    def add_block(self, event):
+        """
+        Add an empty slot block to an event.
+
+        Args:
+            event: Event row of the block
+
+        Returns:
+            int: Row of the block in info
+        """
+        row = self.n_blocks
+        if row >= len(self.info):
+            self.info = _grow(self.info, row + 1)
+            self.block_event = _grow(self.block_event, row + 1)
+            self.block_waveform = _grow(self.block_waveform, row + 1)
+        self.block_event[row] = event
+        self.block_waveform[row] = self.n_waveforms
+        self.n_blocks += 1
+        return row
+
+    def add_waveforms(self, event, slot_id, channels, lengths, raw):
+        """
+        Append the valid samples of several channels of one slot block.
+
+        Args:
+            event: Event row
+            slot_id: Slot number of the block
+            channels: Channel numbers, one per row of raw
+            lengths: Valid samples of each channel
+            raw: int16 array (channels, samples) of raw samples
+        """
+        keep = lengths > 0
+        channels, lengths, raw = channels[keep], lengths[keep], raw[keep]
+        n = len(channels)
+        if n == 0:
+            return
+
+        total = int(lengths.sum())
+        if self.n_waveforms + n > len(self.index['event']):
+            self.index = {key: _grow(column, self.n_waveforms + n) for key, column in self.index.items()}
+        if self.n_samples + total > len(self.samples):
+            self.samples = _grow(self.samples, self.n_samples + total)
+
+        rows = slice(self.n_waveforms, self.n_waveforms + n)
+        self.index['event'][rows] = event
+        self.index['slot'][rows] = slot_id
+        self.index['channel'][rows] = channels
+        self.index['length'][rows] = lengths
+        self.index['offset'][rows] = self.n_samples + np.cumsum(lengths) - lengths
+
+        # valid samples of each row, back to back
+        self.samples[self.n_samples:self.n_samples + total] = raw[np.arange(raw.shape[1]) < lengths[:, np.newaxis]]
+
+        self.n_waveforms += n
+        self.n_samples += total
+        self.max_length = max(self.max_length, int(lengths.max()))
+
+    def save(self, path):
+        """Save the filled part of the buffers to one .npz file (a partial output of a parallel decode)."""
+        arrays = {f"index_{key}": column[:self.n_waveforms] for key, column in self.index.items()}
+        np.savez(path,
+                 counts=np.array([self.n_events, self.max_length], dtype=np.int64),
+                 info=self.info[:self.n_blocks],
+                 block_event=self.block_event[:self.n_blocks],
+                 block_waveform=self.block_waveform[:self.n_blocks],
+                 samples=self.samples[:self.n_samples],
+                 **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load a batch saved with save()."""
+        batch = cls(block_capacity=0, waveform_capacity=0, sample_capacity=0)
+        with np.load(path) as arrays:
+            batch.n_events, batch.max_length = (int(n) for n in arrays['counts'])
+            batch.info = arrays['info']
+            batch.block_event = arrays['block_event']
+            batch.block_waveform = arrays['block_waveform']
+            batch.samples = arrays['samples']
+            batch.index = {key: arrays[f"index_{key}"] for key in WAVEFORM_INDEX_DTYPES}
+        batch.n_blocks = len(batch.info)
+        batch.n_waveforms = len(batch.index['event'])
+        batch.n_samples = len(batch.samples)
+        return batch
+
+    def extend(self, other):
+        """
+        Append the events of another batch after the events of this one.
+
+        Args:
+            other: FadcBatch whose event rows follow the rows of this batch
+        """
+        blocks = slice(self.n_blocks, self.n_blocks + other.n_blocks)
+        self.info = _grow(self.info, blocks.stop)
+        self.block_event = _grow(self.block_event, blocks.stop)
+        self.block_waveform = _grow(self.block_waveform, blocks.stop)
+        self.info[blocks] = other.info[:other.n_blocks]
+        self.block_event[blocks] = other.block_event[:other.n_blocks] + self.n_events
+        self.block_waveform[blocks] = other.block_waveform[:other.n_blocks] + self.n_waveforms
+
+        rows = slice(self.n_waveforms, self.n_waveforms + other.n_waveforms)
+        self.index = {key: _grow(column, rows.stop) for key, column in self.index.items()}
+        for key, column in self.index.items():
+            column[rows] = other.index[key][:other.n_waveforms]
+        self.index['event'][rows] += self.n_events
+        self.index['offset'][rows] += self.n_samples
+
+        self.samples = _grow(self.samples, self.n_samples + other.n_samples)
+        self.samples[self.n_samples:self.n_samples + other.n_samples] = other.samples[:other.n_samples]
+
+        self.n_events += other.n_events
+        self.n_blocks += other.n_blocks
+        self.n_waveforms += other.n_waveforms
+        self.n_samples += other.n_samples
+        self.max_length = max(self.max_length, other.max_length)
@@ -2,6 +2,8 @@ import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
+from fadc_storage import load_fadc_info, load_waveforms
+
 #nevents=1500
 #chan=0
 #slot=0
@@ -35,13 +37,14 @@ class fadc_waveform:
         -----------
         waveforms_file : str
             Path to the waveform numpy file (4D array: event, slot, channel, sample)
+            or to a ragged waveform directory
         info_file : str, optional
             Path to the metadata numpy file (structured array: event, slot)
         """
-        self.waveforms = np.load(waveforms_file, allow_pickle=True)
+        self.waveforms = load_waveforms(waveforms_file)
         self.info = None
         if info_file is not None:
-            self.info = np.load(info_file, allow_pickle=True)
+            self.info = load_fadc_info(info_file)
 
         self.nevents, self.nslots, self.nchannels, self.nsamples = self.waveforms.shape
 
@@ -153,7 +156,7 @@ class fadc_waveform:
 if __name__ == "__main__":
 
    if len(sys.argv) < 2:
-        print("Usage: python plot_waveform.py <filename.npy>")
+        print("Usage: python plot_waveform.py <filename.npy or ragged waveform directory>")
         sys.exit(1)
 
    fw = fadc_waveform(sys.argv[1])
@@ -0,0 +1,2 @@
+# Helpers shared by the FADC_SRO and FADC_waveform decoders. The decoder
+# scripts put the repository root on sys.path to import them.
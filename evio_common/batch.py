@@ -0,0 +1,152 @@
+import os
+import re
+import json
+import time
+from pyevio import EvioFile
+
+from evio_common.parallel import split_records
+
+# Data files of a run: <name>_<run number>.evio.<file number>
+RUN_FILE_PATTERN = re.compile(r'_(\d+)\.evio\.(\d+)')
+
+def run_number(filename):
+    """
+    Run number of an EVIO data file name.
+
+    Returns:
+        str: The run number, or "unknown" when the name has none
+    """
+    match = RUN_FILE_PATTERN.search(os.path.basename(filename))
+    return match.group(1) if match else "unknown"
+
+def file_number(filename):
+    """Position of a data file in its run (the N of .evio.N, 0 when missing)."""
+    match = RUN_FILE_PATTERN.search(os.path.basename(filename))
+    return int(match.group(2)) if match else 0
+
+def group_by_run(filenames):
+    """
+    Group data files by run number, each run in file number order.
+
+    Args:
+        filenames: EVIO files, any order
+
+    Returns:
+        dict: run number -> list of files, runs in order of first appearance
+    """
+    runs = {}
+    for filename in filenames:
+        runs.setdefault(run_number(filename), []).append(filename)
+    return {run: sorted(files, key=file_number) for run, files in runs.items()}
+
+def plan_batch(runs, jobs, max_event=None):
+    """
+    Split every file of every run into record ranges for one shared worker pool.
+
+    Args:
+        runs: run number -> list of files (group_by_run)
+        jobs: Number of worker processes
+        max_event: Only decode the first max_event events of each file (None for all)
+
+    Returns:
+        list: One dict per range, runs and files in order, with the keys run,
+            file, record_start, record_stop, first_event, max_event, events and bytes
+    """
+    plan = []
+    for run, files in runs.items():
+        for filename in files:
+            with EvioFile(filename) as evio_file:
+                records = list(evio_file.iter_records())
+                event_counts = [record.event_count for record in records]
+                record_sizes = [record.size for record in records]
+
+            total_event_count = sum(event_counts)
+            file_max_event = total_event_count if max_event is None else min(max_event, total_event_count)
+            print(f"{filename}: run {run}, {len(records)} records, {total_event_count} events")
+
+            # a few ranges per worker even out files and records of different sizes
+            for start, stop, first in split_records(event_counts, 4 * jobs, file_max_event):
+                plan.append({
+                    'run': run,
+                    'file': filename,
+                    'record_start': start,
+                    'record_stop': stop,
+                    'first_event': first,
+                    'max_event': file_max_event,
+                    'events': min(first + sum(event_counts[start:stop]), file_max_event) - first,
+                    'bytes': sum(record_sizes[start:stop]),
+                })
+    return plan
+
+class BatchProgress:
+    """
+    Per-file progress and throughput of a batch decode.
+
+    Call done() as each record range finishes; it prints one progress line.
+    summary() prints the per-file table and save() writes it as json.
+
+    Usage:
+        progress = BatchProgress(plan)
+        run_parallel(worker, tasks, jobs, progress=progress.done)
+        progress.summary()
+    """
+    def __init__(self, plan):
+        self.plan = plan
+        self.start_time = time.perf_counter()
+        self.n_done = 0
+        self.files = {}
+        for task in plan:
+            stats = self.files.setdefault(task['file'], {
+                'run': task['run'], 'ranges': 0, 'ranges_done': 0,
+                'events': 0, 'bytes': 0, 'frames': 0, 'seconds': 0.0,
+            })
+            stats['ranges'] += 1
+
+    def done(self, task_index, frames, seconds):
+        """
+        Record a finished record range.
+
+        Args:
+            task_index: Index of the range in the plan
+            frames: Number of events with FADC data the range gave
+            seconds: Time the worker spent on the range
+        """
+        task = self.plan[task_index]
+        stats = self.files[task['file']]
+        stats['ranges_done'] += 1
+        stats['events'] += task['events']
+        stats['bytes'] += task['bytes']
+        stats['frames'] += frames
+        stats['seconds'] += seconds
+        self.n_done += 1
+
+        elapsed = time.perf_counter() - self.start_time
+        print(f"[{self.n_done}/{len(self.plan)}] {os.path.basename(task['file'])} "
+              f"records {task['record_start']}-{task['record_stop']}: "
+              f"{task['events']} events in {seconds:.2f} s ({elapsed:.1f} s elapsed)")
+
+    def rows(self):
+        """Per-file summary rows with the events/s and MB/s of the worker time."""
+        rows = []
+        for filename, stats in self.files.items():
+            seconds = stats['seconds']
+            rows.append(dict(stats, file=filename,
+                             events_per_s=stats['events'] / seconds if seconds > 0 else 0.0,
+                             mb_per_s=stats['bytes'] / 1e6 / seconds if seconds > 0 else 0.0))
+        return rows
+
+    def summary(self):
+        """Print the per-file summary table."""
+        elapsed = time.perf_counter() - self.start_time
+        print(f"\n{'file':40s} {'run':>8s} {'events':>10s} {'frames':>10s} {'MB':>9s} {'s':>8s} {'events/s':>10s} {'MB/s':>8s}")
+        for row in self.rows():
+            print(f"{os.path.basename(row['file']):40s} {row['run']:>8s} {row['events']:10d} {row['frames']:10d} "
+                  f"{row['bytes'] / 1e6:9.1f} {row['seconds']:8.2f} {row['events_per_s']:10.0f} {row['mb_per_s']:8.1f}")
+        total_bytes = sum(stats['bytes'] for stats in self.files.values())
+        print(f"{len(self.files)} files, {total_bytes / 1e6:.1f} MB in {elapsed:.2f} s wall time "
+              f"({total_bytes / 1e6 / elapsed if elapsed > 0 else 0.0:.1f} MB/s)")
+
+    def save(self, path):
+        """Write the per-file summary rows to a json file."""
+        with open(path, 'w') as file:
+            json.dump({'wall_seconds': time.perf_counter() - self.start_time, 'files': self.rows()}, file, indent=1)
@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+from evio_common.jit import ENGINES, DEFAULT_ENGINE
+from evio_common.synthetic_evio import write_streaming_file, write_triggered_file
+
+# Decoder benchmark on synthetic EVIO files (synthetic_evio.py).
+#
+# Every case (data layout, engine, stage) runs in a fresh Python process, so
+# its peak RSS is its own; the first event is decoded once before the clock
+# starts, so numba compilation is not timed (--cold-cache gives every case an
+# empty numba cache, so the kernels are compiled in that warm-up, as on a first
+# run after an install):
+#
+#   decode  process_event over all events of the file (record reading, bank
+#           traversal, payload decoding, building the frame dicts / batch)
+#   full    process_fadc_data, from the file to the saved output
+#
+# The table reports events/s, payload words/s, peak RSS and output size;
+# --json saves it and --baseline compares with a saved run.
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+# payload ids of the streaming slots, and the slots the triggered decoder keeps (FADC_SLOT)
+STREAMING_PAYLOAD_IDS = (13, 15, 17, 19, 21, 23, 25, 27)
+TRIGGERED_SLOTS = (3, 4)
+
+def output_bytes(path):
+    """Bytes of the files below a directory."""
+    total = 0
+    for root, _, names in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in names)
+    return total
+
+def run_case(case):
+    """
+    Time one case in this process.
+
+    Args:
+        case: dict with mode, engine, stage, file, output_dir and the output options
+
+    Returns:
+        dict: The case with events, words, seconds, peak_rss and output_bytes
+    """
+    if case['mode'] == "streaming":
+        sys.path.insert(0, os.path.join(REPO_DIR, "FADC_SRO"))
+        import analyze_sro_fadc250 as decoder
+    else:
+        sys.path.insert(0, os.path.join(REPO_DIR, "FADC_waveform"))
+        import analyze_roc_trig_fadc250 as decoder
+    from evio_common.payload import open_evio
+    from evio_common.index import build_index
+
+    with open_evio(case['file']) as evio_file:
+        index = build_index(evio_file)
+        # warm-up: numba kernels are compiled (or loaded from their cache) at their first call
+        record, event = next(evio_file.iter_events())
+        if case['mode'] == "triggered":
+            decoder.process_event(event, 0, decoder.FadcBatch(), engine=case['engine'])
+        else:
+            decoder.process_event(event, 0, engine=case['engine'])
+        del record, event
+    n_events = len(index)
+    n_words = int(index.events['length'].sum()) // 4
+
+    if case['stage'] == "decode":
+        batch = decoder.FadcBatch() if case['mode'] == "triggered" else None
+        frames = []
+        start = time.perf_counter()
+        with open_evio(case['file']) as evio_file:
+            for event_index, (record, event) in enumerate(evio_file.iter_events()):
+                if batch is not None:
+                    decoder.process_event(event, event_index, batch, engine=case['engine'])
+                else:
+                    frames.append(decoder.process_event(event, event_index, engine=case['engine']))
+        seconds = time.perf_counter() - start
+        n_output = 0
+    else:
+        start = time.perf_counter()
+        if case['mode'] == "streaming":
+            decoder.process_fadc_data(case['file'], output_dir=case['output_dir'], output_format=case['format'],
+                                      use_cache=False, engine=case['engine'])
+        else:
+            decoder.process_fadc_data(case['file'], output_dir=case['output_dir'],
+                                      waveform_format=case['waveform_format'], use_cache=False,
+                                      engine=case['engine'])
+        seconds = time.perf_counter() - start
+        n_output = output_bytes(case['output_dir'])
+
+    return dict(case, events=n_events, words=n_words, seconds=seconds,
+                peak_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, output_bytes=n_output)
+
+def spawn_case(case, cold_cache=False):
+    """Run one case in a new Python process (with an empty numba cache when cold_cache) and return its result."""
+    env = None
+    cache_dir = None
+    if cold_cache:
+        cache_dir = tempfile.mkdtemp(prefix="fadc_numba_cache_")
+        env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir)
+    try:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case)],
+                                   capture_output=True, text=True, env=env)
+    finally:
+        if cache_dir is not None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"benchmark case {case['mode']}/{case['engine']}/{case['stage']} exited with "
+                           f"{completed.returncode}:\n{completed.stdout[-2000:]}{completed.stderr[-2000:]}")
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"benchmark case {case['mode']}/{case['engine']}/{case['stage']} failed:\n"
+                       f"{completed.stdout[-2000:]}{completed.stderr[-2000:]}")
+
+def case_key(result):
+    return f"{result['mode']}/{result['engine']}/{result['stage']}"
+
+def print_table(results, baseline=None):
+    """Print the results, with the events/s change against a baseline run when given."""
+    baseline = {case_key(result): result for result in (baseline or [])}
+    header = f"{'case':<28} {'events':>8} {'time (s)':>9} {'events/s':>10} {'Mwords/s':>9} {'RSS (MB)':>9} {'out (MB)':>9}"
+    if baseline:
+        header += f" {'vs base':>8}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        rate = result['events'] / result['seconds']
+        line = (f"{case_key(result):<28} {result['events']:>8} {result['seconds']:>9.3f} {rate:>10.0f} "
+                f"{result['words'] / result['seconds'] / 1e6:>9.2f} {result['peak_rss'] / 1e6:>9.1f} "
+                f"{result['output_bytes'] / 1e6:>9.2f}")
+        if baseline:
+            previous = baseline.get(case_key(result))
+            line += f" {rate / (previous['events'] / previous['seconds']):>7.2f}x" if previous else f" {'-':>8}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the FADC250 decoders on synthetic EVIO files")
+    parser.add_argument("--modes", nargs="+", choices=["streaming", "triggered"], default=["streaming", "triggered"],
+                        help="Data layouts to benchmark.")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=[DEFAULT_ENGINE],
+                        help="Decoder engines to benchmark.")
+    parser.add_argument("--stages", nargs="+", choices=["decode", "full"], default=["decode", "full"],
+                        help="decode: process_event over all events; full: process_fadc_data with its output.")
+    parser.add_argument("-n", "--events", type=int, default=5000,
+                        help="Time frames / triggered events per synthetic file.")
+    parser.add_argument("--slots", type=int, default=2,
+                        help="FADC slots (payload banks per frame, blocks per triggered event).")
+    parser.add_argument("--rocs", type=int, default=1,
+                        help="Streaming: ROC time slice banks per frame.")
+    parser.add_argument("--occupancy", type=float, default=1.0,
+                        help="Streaming: mean hits per channel and frame.")
+    parser.add_argument("--trigger-occupancy", type=float, default=0.3,
+                        help="Triggered: probability of a window per channel.")
+    parser.add_argument("--samples", type=int, default=100,
+                        help="Triggered: samples per window.")
+    parser.add_argument("-f", "--format", choices=["json", "columnar"], default="columnar",
+                        help="Streaming output format of the full stage.")
+    parser.add_argument("-w", "--waveform-format", choices=["dense", "ragged"], default="dense",
+                        help="Triggered waveform format of the full stage.")
+    parser.add_argument("--cold-cache", action="store_true",
+                        help="Run every case with an empty numba cache (checks a first run after an install).")
+    parser.add_argument("--work-dir", default=None,
+                        help="Directory for the synthetic files and outputs (default: a temporary one, removed).")
+    parser.add_argument("--json", default=None,
+                        help="Save the results to this json file.")
+    parser.add_argument("--baseline", default=None,
+                        help="json file of an earlier run to compare the events/s with.")
+    parser.add_argument("--run-case", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case is not None:
+        print(RESULT_PREFIX + json.dumps(run_case(json.loads(args.run_case))))
+        return
+
+    if "triggered" in args.modes and args.slots > len(TRIGGERED_SLOTS):
+        parser.error(f"the triggered decoder keeps slots {list(TRIGGERED_SLOTS)} only: --slots <= {len(TRIGGERED_SLOTS)}")
+    if args.slots > len(STREAMING_PAYLOAD_IDS):
+        parser.error(f"--slots <= {len(STREAMING_PAYLOAD_IDS)}")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="fadc_benchmark_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        files = {}
+        if "streaming" in args.modes:
+            files['streaming'] = os.path.join(work_dir, "synthetic_streaming_run_1.evio.0")
+            n_bytes = write_streaming_file(files['streaming'], args.events, STREAMING_PAYLOAD_IDS[:args.slots],
+                                           args.occupancy, roc_ids=tuple(range(1, args.rocs + 1)))
+            print(f"Streaming file: {args.events} frames, {args.rocs} ROCs x {args.slots} slots, "
+                  f"{args.occupancy} hits/channel/frame, {n_bytes / 1e6:.1f} MB")
+        if "triggered" in args.modes:
+            files['triggered'] = os.path.join(work_dir, "synthetic_triggered_run_2.evio.0")
+            n_bytes = write_triggered_file(files['triggered'], args.events, TRIGGERED_SLOTS[:args.slots],
+                                           args.samples, args.trigger_occupancy)
+            print(f"Triggered file: {args.events} events, {args.slots} slots, {args.samples} samples, "
+                  f"{args.trigger_occupancy} window occupancy, {n_bytes / 1e6:.1f} MB")
+        print()
+
+        results = []
+        for mode, filename in files.items():
+            for engine in args.engines:
+                for stage in args.stages:
+                    output_dir = os.path.join(work_dir, f"output_{mode}_{engine}_{stage}")
+                    shutil.rmtree(output_dir, ignore_errors=True)
+                    results.append(spawn_case({
+                        'mode': mode, 'engine': engine, 'stage': stage, 'file': filename,
+                        'output_dir': output_dir, 'format': args.format,
+                        'waveform_format': args.waveform_format,
+                    }, args.cold_cache))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)['results']
+    print_table(results, baseline)
+
+    if args.json is not None:
+        with open(args.json, 'w') as file:
+            json.dump({'options': {key: value for key, value in vars(args).items()
+                                   if key not in ('run_case', 'json', 'baseline')},
+                       'results': results}, file, indent=1)
+        print(f"\nSaved the results to {args.json}")
+
+if __name__ == "__main__":
+    main()
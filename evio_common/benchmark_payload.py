@@ -0,0 +1,74 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from evio_common.payload import bank_words, open_evio
+
+def copy_words(bank):
+    """Payload words the way the decoders used to read them: a bytes copy, then np.frombuffer."""
+    return np.frombuffer(bank.get_data(), dtype=np.dtype(f'{bank.endian}u4'))
+
+def leaf_banks(bank):
+    """All banks below bank that hold data instead of other banks."""
+    if not bank.is_container():
+        return [bank]
+    leaves = []
+    for child in bank.get_children():
+        leaves += leaf_banks(child)
+    return leaves
+
+def time_reader(banks, reader, repeat):
+    """
+    Best time of reading every payload once and touching all of its words.
+
+    Returns:
+        tuple: (seconds, checksum of the words)
+    """
+    best = None
+    for _ in range(repeat):
+        checksum = 0
+        start = time.perf_counter()
+        for bank in banks:
+            words = reader(bank)
+            if len(words) > 0:
+                checksum ^= int(np.bitwise_xor.reduce(words))
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, checksum
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the bank payload throughput of get_data() and mmap views")
+    parser.add_argument("input_files", nargs="+", help="One or more EVIO files.")
+    parser.add_argument("-e", "--events", type=int, default=None,
+                        help="If set, only read the payloads of this many events per file.")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of timing repetitions (the best one is reported).")
+    args = parser.parse_args()
+
+    for filename in args.input_files:
+        with open_evio(filename) as evio_file:
+            # Parse the bank headers first, so only the payload access is timed
+            banks = []
+            for event_index, (record, event) in enumerate(evio_file.iter_events()):
+                if args.events is not None and event_index >= args.events:
+                    break
+                banks += leaf_banks(event.get_bank())
+            n_bytes = sum(bank.data_length for bank in banks)
+
+            copy_seconds, copy_checksum = time_reader(banks, copy_words, args.repeat)
+            view_seconds, view_checksum = time_reader(banks, bank_words, args.repeat)
+            if copy_checksum != view_checksum:
+                print(f"ERROR: the payload words of {filename} differ between get_data() and the mmap view")
+
+            print(f"{filename}: {len(banks)} payload banks, {n_bytes / 1e6:.1f} MB")
+            print(f"  get_data + frombuffer: {n_bytes / 1e6 / copy_seconds:8.1f} MB/s")
+            print(f"  mmap view (bank_words): {n_bytes / 1e6 / view_seconds:8.1f} MB/s "
+                  f"({copy_seconds / view_seconds:.2f}x)")
+
+            del banks
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+
+# Decode cache of an output directory: <output dir>/decode_cache.json
+#
+# One entry per (input file, decoder, options) with what the last decode saw
+# of the input: its size and mtime, and a content hash of the records it
+# decoded (bytes data_start to data_end; the file header is left out because
+# the writer of a live run rewrites it), and the size and mtime of every
+# output it wrote. A repeated decode of an unchanged file reuses the outputs
+# while nothing else has rewritten them; a file that only grew gets its new
+# records decoded and appended.
+CACHE_FILE = "decode_cache.json"
+
+HASH_BLOCK_SIZE = 1 << 24
+
+def content_digest(filename, start, stop):
+    """
+    Hash of the bytes start to stop of a file.
+
+    Returns:
+        str: blake2b hex digest
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            block = file.read(min(HASH_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+def output_stamp(path):
+    """
+    Size and mtime of an output file, or of every file of an output directory.
+
+    Returns:
+        list: [name, size, mtime_ns] entries, empty when the output is missing
+    """
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(path, name) for name in os.listdir(path))
+    elif os.path.exists(path):
+        paths = [path]
+    else:
+        return []
+    stamp = []
+    for file_path in paths:
+        stat = os.stat(file_path)
+        stamp.append([os.path.basename(file_path), stat.st_size, stat.st_mtime_ns])
+    return stamp
+
+def record_span(index):
+    """
+    Bytes covered by the records of an event index.
+
+    Args:
+        index: EvioIndex of the file
+
+    Returns:
+        tuple: (data_start, data_end) file offsets
+    """
+    records = index.records
+    if len(records['offset']) == 0:
+        return 0, 0
+    return int(records['offset'][0]), int(records['offset'][-1] + records['size'][-1])
+
+class DecodeCache:
+    """
+    Cache entries of the decodes written to one output directory.
+
+    Usage:
+        cache = DecodeCache(output_dir)
+        status, entry = cache.lookup(filename, "sro", DECODER_VERSION, options)
+        if status == "hit":
+            return                                   # outputs are up to date
+        if status == "grown":
+            start = entry['events']                  # decode the new events only
+        ...
+        cache.store(filename, "sro", DECODER_VERSION, options, index, outputs)
+    """
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, CACHE_FILE)
+        self.entries = []
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                self.entries = json.load(file)
+
+    @staticmethod
+    def _key(filename, decoder, version, options):
+        return {
+            'path': os.path.abspath(filename),
+            'decoder': decoder,
+            'version': version,
+            'options': json.loads(json.dumps(options, sort_keys=True)),
+        }
+
+    def _find(self, key):
+        for entry in self.entries:
+            if all(entry[name] == value for name, value in key.items()):
+                return entry
+        return None
+
+    def lookup(self, filename, decoder, version, options):
+        """
+        Check the cache entry of a decode.
+
+        Args:
+            filename: Input EVIO file
+            decoder: Name of the decoder
+            version: Version of the decoder (a new version invalidates its entries)
+            options: Dictionary of the options that change the outputs
+
+        Returns:
+            tuple: (status, entry); status is "hit" when the outputs are up to date,
+                "grown" when the decoded records are unchanged and new ones follow
+                them, and "miss" otherwise (entry is None)
+        """
+        entry = self._find(self._key(filename, decoder, version, options))
+        if entry is None:
+            return "miss", None
+        # outputs that are gone or were rewritten by another decode are stale
+        if any(output_stamp(output) != stamp for output, stamp in zip(entry['outputs'], entry['output_stamps'])):
+            return "miss", None
+
+        stat = os.stat(filename)
+        if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+            return "hit", entry
+        if stat.st_size < entry['data_end']:
+            return "miss", None
+
+        # the file changed on disk: the content of the decoded records decides
+        if content_digest(filename, entry['data_start'], entry['data_end']) != entry['digest']:
+            return "miss", None
+        if stat.st_size == entry['size']:
+            return "hit", entry
+        return "grown", entry
+
+    def store(self, filename, decoder, version, options, index, outputs):
+        """
+        Record a finished decode and save the cache file.
+
+        Args:
+            filename: Input EVIO file
+            decoder: Name of the decoder
+            version: Version of the decoder
+            options: Dictionary of the options that change the outputs
+            index: EvioIndex of the file as it was decoded (from load_index)
+            outputs: Output files and directories of the decode
+        """
+        key = self._key(filename, decoder, version, options)
+        entry = self._find(key)
+        if entry is None:
+            entry = dict(key)
+            self.entries.append(entry)
+
+        # the file as it was indexed: anything written after that is new next time
+        _, size, mtime_ns = (int(value) for value in index.stamp)
+        data_start, data_end = record_span(index)
+        entry.update({
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'data_start': data_start,
+            'data_end': data_end,
+            'digest': content_digest(filename, data_start, data_end),
+            'events': len(index),
+            'outputs': outputs,
+            'output_stamps': [output_stamp(output) for output in outputs],
+        })
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(self.entries, file, indent=1)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,108 @@
+import argparse
+import os
+import pickle
+import sys
+import tempfile
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "FADC_SRO"))
+sys.path.insert(0, os.path.join(REPO_DIR, "FADC_waveform"))
+import analyze_sro_fadc250
+import analyze_roc_trig_fadc250
+from evio_common import payload
+from evio_common.payload import bank_words, open_evio
+from evio_common.synthetic_evio import write_streaming_file, write_triggered_file
+
+# Check of bank_words on compressed records: synthetic streaming and
+# triggered files are written uncompressed and gzip/LZ4 compressed, every
+# payload is compared with get_data(), both decoders decode every file, and
+# the payload view cache must hold nothing but the file mapping while a file
+# is read and nothing once it is closed (no decompressed record kept alive).
+
+def compressions():
+    """Record compressions to check: gzip, and LZ4 when the lz4 package is installed."""
+    try:
+        import lz4.block  # noqa: F401
+    except ImportError:
+        return [None, 'gzip']
+    return [None, 'gzip', 'lz4']
+
+def leaf_banks(bank):
+    """All banks below bank that hold data instead of other banks."""
+    if not bank.is_container():
+        return [bank]
+    leaves = []
+    for child in bank.get_children():
+        leaves += leaf_banks(child)
+    return leaves
+
+def cached_mappings(evio_file):
+    """Mappings in the payload view cache other than the file mapping."""
+    return [entry[0] for entry in payload._mapped_words.values() if entry[0] is not evio_file.mm]
+
+def decode_file(filename, mode):
+    """
+    Read and decode every event of a file.
+
+    Args:
+        filename: EVIO file
+        mode: 'streaming' or 'triggered'
+
+    Returns:
+        tuple: (list of errors, pickled decoder output)
+    """
+    errors = []
+    frames = []
+    batch = analyze_roc_trig_fadc250.FadcBatch()
+    with open_evio(filename) as evio_file:
+        for event_index, (record, event) in enumerate(evio_file.iter_events()):
+            for bank in leaf_banks(event.get_bank()):
+                expected = np.frombuffer(bank.get_data(), dtype=np.dtype(f'{bank.endian}u4'))
+                if not np.array_equal(bank_words(bank), expected):
+                    errors.append(f"event {event_index}: payload of bank 0x{bank.tag:04X} differs from get_data()")
+            if mode == 'streaming':
+                frames.append(analyze_sro_fadc250.process_event(event, event_index))
+            else:
+                analyze_roc_trig_fadc250.process_event(event, event_index, batch)
+        if cached_mappings(evio_file):
+            errors.append(f"{len(cached_mappings(evio_file))} record buffers in the payload view cache")
+    if payload._mapped_words:
+        errors.append(f"{len(payload._mapped_words)} mappings in the payload view cache after closing")
+    output = frames if mode == 'streaming' else batch.info[:batch.n_blocks]
+    return errors, pickle.dumps(output)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check bank_words and the payload view cache on compressed records")
+    parser.add_argument("-n", "--events", type=int, default=500,
+                        help="Events per synthetic file.")
+    parser.add_argument("--events-per-record", type=int, default=50,
+                        help="Events per record (several records per file).")
+    args = parser.parse_args()
+
+    writers = {'streaming': write_streaming_file, 'triggered': write_triggered_file}
+    failed = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode, write in writers.items():
+            reference = None
+            for compression in compressions():
+                filename = os.path.join(tmp_dir, f"{mode}_{compression or 'none'}.evio.0")
+                write(filename, args.events, events_per_record=args.events_per_record, compression=compression)
+                errors, output = decode_file(filename, mode)
+                if reference is None:
+                    reference = output
+                elif output != reference:
+                    errors.append("decoded output differs from the uncompressed file")
+                failed += len(errors)
+                for error in errors:
+                    print(f"{mode} ({compression or 'uncompressed'}): {error}")
+                print(f"{mode} ({compression or 'uncompressed'}): {args.events} events checked")
+
+    if failed:
+        print(f"{failed} checks failed")
+        sys.exit(1)
+    print("Compressed and uncompressed records decode the same, no record buffer is kept")
+
+if __name__ == "__main__":
+    main()
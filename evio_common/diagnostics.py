@@ -0,0 +1,125 @@
+import json
+import os
+import numpy as np
+
+# Decode errors of both decoders, counted by category.
+#
+# process_event reports a bad event (missing FF21/FF31/FF30 bank, frame or
+# timestamp mismatch between the stream info banks, hit words with bit 31
+# set, an exception, ...) to a Diagnostics instead of printing it. The hex
+# dump of the offending words is formatted for the first max_samples events
+# of each category only, so a noisy run costs one counter increment per bad
+# event; the good events do not look at the Diagnostics at all.
+
+class Diagnostics:
+    """
+    Error counts by category, with the hex dumps of the first offenders.
+
+    Usage:
+        diagnostics = Diagnostics(max_samples=3)
+        report(diagnostics, "missing FF31", event_index, "first bank is not FF31", words)
+        diagnostics.summary()
+        diagnostics.save("diagnostics.json")
+    """
+    def __init__(self, max_samples=3):
+        self.max_samples = max_samples
+        self.counts = {}     # category -> number of reports (or of bad words)
+        self.samples = {}    # category -> list of {event, message, hex} of the first reports
+
+    def report(self, category, event_index, message="", words=None, count=1):
+        """
+        Count an error and keep a sample of it while the category has fewer than max_samples.
+
+        Args:
+            category: Error category, e.g. "missing FF31"
+            event_index: Global index of the event
+            message: One-line description
+            words: Optional offending words, kept as a hex dump in the sample
+            count: Number of errors of this report (e.g. bad words in a bank)
+        """
+        n_reports = len(self.samples.get(category, ()))
+        self.counts[category] = self.counts.get(category, 0) + count
+        if n_reports < self.max_samples:
+            sample = {'event': int(event_index), 'message': message}
+            if words is not None:
+                sample['hex'] = hex_dump(words)
+            self.samples.setdefault(category, []).append(sample)
+
+    def merge(self, other):
+        """Add the counts and samples of another Diagnostics or of its to_dict()."""
+        if isinstance(other, Diagnostics):
+            other = other.to_dict()
+        for category, count in other['counts'].items():
+            self.counts[category] = self.counts.get(category, 0) + count
+        for category, samples in other['samples'].items():
+            kept = self.samples.setdefault(category, [])
+            kept += samples[:max(self.max_samples - len(kept), 0)]
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def to_dict(self):
+        return {'counts': dict(self.counts), 'samples': {key: list(value) for key, value in self.samples.items()}}
+
+    def summary(self):
+        """Print the counts and the sampled events of each category."""
+        if not self.counts:
+            print("No decode errors")
+            return
+        print(f"\n{'decode error':<28} {'count':>10}")
+        print("-" * 39)
+        for category, count in sorted(self.counts.items(), key=lambda item: -item[1]):
+            print(f"{category:<28} {count:>10}")
+        for category, samples in self.samples.items():
+            for sample in samples:
+                print(f"\n[{category}] event {sample['event']}: {sample['message']}")
+                if 'hex' in sample:
+                    print(sample['hex'])
+
+    def save(self, path):
+        """Write the counts and samples to a json file."""
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=1)
+
+def report(diagnostics, category, event_index, message="", words=None, count=1):
+    """
+    Report an error to diagnostics, or print it when there is none (the decoders without a Diagnostics).
+
+    Args:
+        diagnostics: Diagnostics or None
+        category, event_index, message, words, count: See Diagnostics.report
+    """
+    if diagnostics is None:
+        print(f"ERROR: event {event_index}: {message}")
+    else:
+        diagnostics.report(category, event_index, message, words, count)
+
+def save_diagnostics(diagnostics, path, append=False):
+    """
+    Print the decode errors of a run and save them to a json file.
+
+    Without errors a file left by an earlier decode is removed.
+
+    Args:
+        diagnostics: Diagnostics of the decode
+        path: json file
+        append: Add the errors saved by an earlier decode (of a file that grew since)
+    """
+    if append and os.path.exists(path):
+        with open(path, 'r') as file:
+            diagnostics.merge(json.load(file))
+    diagnostics.summary()
+    if len(diagnostics) > 0:
+        diagnostics.save(path)
+        print(f"Saved the decode errors to {path}")
+    elif os.path.exists(path):
+        os.remove(path)
+
+def hex_dump(words, max_words=64, per_line=8):
+    """Hex dump of (the first max_words of) 32-bit words, per_line words per line with their offset."""
+    words = np.asarray(words, dtype=np.uint32)
+    lines = [f"{offset:6d}: " + " ".join(f"{int(word):08X}" for word in words[offset:offset + per_line])
+             for offset in range(0, min(len(words), max_words), per_line)]
+    if len(words) > max_words:
+        lines.append(f"        ... {len(words) - max_words} more words")
+    return "\n".join(lines)
@@ -0,0 +1,114 @@
+import os
+import time
+from pyevio.file_header import FileHeader
+from pyevio.record import Record, padded_to_words
+from pyevio.record_header import RecordHeader
+
+class RecordFollower:
+    """
+    Read the records of an EVIO file while another process is still writing it.
+
+    The file stays open; every poll() looks at the current file size and
+    returns the records that were completed since the last call, each read
+    into its own bytes buffer (so nothing depends on a mapping of the old
+    file size). A record whose bytes are not all written yet is picked up by
+    a later poll. The trailer record, written when the file is closed, ends
+    the follow.
+
+    Usage:
+        follower = RecordFollower(filename)
+        while not follower.finished:
+            for record in follower.poll(max_records=50):
+                for event in record.get_events():
+                    ...
+            time.sleep(0.5)
+        follower.close()
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        self.endian = None
+        self.offset = None        # file offset of the next record, once the file header is in
+        self.n_records = 0
+        self.n_events = 0         # events in the records returned so far
+        self.n_bytes = 0          # bytes of the records returned so far
+        self.finished = False     # the trailer record was read
+
+    def _read(self, offset, size):
+        self.file.seek(offset)
+        return self.file.read(size)
+
+    def _read_file_header(self, file_size):
+        if file_size < FileHeader.HEADER_SIZE:
+            return False
+        header = FileHeader.from_buffer(self._read(0, FileHeader.HEADER_SIZE), 0)
+        first_record = (header.header_length * 4 + header.index_array_length
+                        + padded_to_words(header.user_header_length))
+        if file_size < first_record:
+            return False
+        self.endian = header.endian
+        self.offset = first_record
+        return True
+
+    def poll(self, max_records=None):
+        """
+        Return the records completed since the last poll.
+
+        Args:
+            max_records: Return at most this many records (the rest follow in
+                later polls), which bounds the work of one update
+
+        Returns:
+            list: pyevio Record objects in file order, index = record number in the file
+        """
+        records = []
+        file_size = os.fstat(self.file.fileno()).st_size
+        if self.offset is None and not self._read_file_header(file_size):
+            return records
+
+        while not self.finished and (max_records is None or len(records) < max_records):
+            if self.offset + RecordHeader.HEADER_SIZE > file_size:
+                break
+            header = RecordHeader.parse(self._read(self.offset, RecordHeader.HEADER_SIZE), 0)
+            if header.magic_number != RecordHeader.MAGIC_NUMBER:
+                raise ValueError(f"Error: no EVIO record header at offset 0x{self.offset:X} of {self.filename}")
+            size = header.record_length * 4
+            if size < RecordHeader.HEADER_SIZE or self.offset + size > file_size:
+                break
+
+            record = Record(self._read(self.offset, size), 0, self.endian, index=self.n_records)
+            self.offset += size
+            if record.is_trailer:
+                self.finished = True
+                break
+
+            self.n_records += 1
+            self.n_events += record.event_count
+            self.n_bytes += size
+            records.append(record)
+
+        return records
+
+    def wait(self, poll_interval=0.5, max_records=None, idle_timeout=None):
+        """
+        Poll until new records arrive, the file is finished or it stays idle too long.
+
+        Args:
+            poll_interval: Seconds between looks at the file size
+            max_records: Passed to poll()
+            idle_timeout: Give up after this many seconds without a new record (None waits forever)
+
+        Returns:
+            list: The new records; empty when the file is finished or the wait timed out
+        """
+        start = time.monotonic()
+        while True:
+            records = self.poll(max_records)
+            if records or self.finished:
+                return records
+            if idle_timeout is not None and time.monotonic() - start >= idle_timeout:
+                return records
+            time.sleep(poll_interval)
+
+    def close(self):
+        self.file.close()
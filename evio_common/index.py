@@ -0,0 +1,200 @@
+import os
+import numpy as np
+
+# Sidecar event index of an EVIO file: <file>.idx.npz
+#
+#   records_*  one entry per record: offset and size in the file, event_count, first_event
+#   events_*   one entry per event: record, offset (into the record buffer),
+#              length, tag of the root bank, frame (SIB frame number, -1 when
+#              the event has no 0xFF31 stream info bank)
+#
+# It is built once with one pass over the record headers and reused while
+# the size and modification time of the file are unchanged.
+INDEX_VERSION = 2
+
+RECORD_DTYPES = {
+    'offset': np.int64,
+    'size': np.int64,
+    'event_count': np.uint32,
+    'first_event': np.int64,
+}
+
+EVENT_DTYPES = {
+    'record': np.uint32,
+    'offset': np.int64,
+    'length': np.uint32,
+    'tag': np.uint16,
+    'frame': np.int64,
+}
+
+# root bank tags of physics events
+TRIGGERED_TAG = 0xFF50
+STREAMING_TAG = 0xFF60
+SIB_TAG = 0xFF31
+
+def index_path(filename):
+    """Sidecar index of an EVIO file: <file>.idx.npz"""
+    return filename + ".idx.npz"
+
+def _file_stamp(filename):
+    stat = os.stat(filename)
+    return np.array([INDEX_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+def _scan_record(record):
+    """Offsets, lengths, root tags and SIB frame numbers of the events of one record."""
+    event_info = np.array(record.get_event_offsets(), dtype=np.int64).reshape(-1, 2)
+    offsets, lengths = event_info[:, 0], event_info[:, 1]
+
+    # word view of the record buffer: the file mapping, or the decompressed record
+    buffer = record.buffer
+    words = np.frombuffer(buffer, dtype=np.dtype(f'{record.endian}u4'), count=len(buffer) // 4)
+    first = offsets // 4
+
+    tags = np.zeros(len(offsets), dtype=np.uint16)
+    frames = np.full(len(offsets), -1, dtype=np.int64)
+    has_header = lengths >= 8
+    tags[has_header] = words[first[has_header] + 1] >> 16
+
+    # streaming events: the first child bank (root header + 2 words) is the SIB,
+    # with the frame number in its second data word
+    streaming = has_header & (tags == STREAMING_TAG) & (lengths >= 24)
+    sib_tags = words[first[streaming] + 3] >> 16
+    frames[np.flatnonzero(streaming)[sib_tags == SIB_TAG]] = words[first[streaming][sib_tags == SIB_TAG] + 5]
+
+    return offsets, lengths, tags, frames
+
+def build_index(evio_file):
+    """
+    Scan an open EVIO file and build its event index.
+
+    Args:
+        evio_file: Open EvioFile
+
+    Returns:
+        EvioIndex: The index
+    """
+    records = {key: [] for key in RECORD_DTYPES}
+    events = {key: [] for key in EVENT_DTYPES}
+    first_event = 0
+    for record_index, record in enumerate(evio_file.iter_records()):
+        offsets, lengths, tags, frames = _scan_record(record)
+        records['offset'].append(record.offset)
+        records['size'].append(record.size)
+        records['event_count'].append(len(offsets))
+        records['first_event'].append(first_event)
+        events['record'].append(np.full(len(offsets), record_index))
+        events['offset'].append(offsets)
+        events['length'].append(lengths)
+        events['tag'].append(tags)
+        events['frame'].append(frames)
+        first_event += len(offsets)
+
+    records = {key: np.array(values, dtype=RECORD_DTYPES[key]) for key, values in records.items()}
+    events = {key: np.concatenate(values).astype(EVENT_DTYPES[key]) if values else np.zeros(0, dtype=EVENT_DTYPES[key])
+              for key, values in events.items()}
+    return EvioIndex(records, events)
+
+def load_index(evio_file, save=True):
+    """
+    Load the sidecar index of an open EVIO file, building it when it is missing or stale.
+
+    Args:
+        evio_file: Open EvioFile
+        save: Write a new or rebuilt index next to the file
+
+    Returns:
+        EvioIndex: The index
+    """
+    filename = evio_file.filename
+    path = index_path(filename)
+    stamp = _file_stamp(filename)
+
+    if os.path.exists(path):
+        with np.load(path) as arrays:
+            if np.array_equal(arrays['stamp'], stamp):
+                records = {key: arrays[f"records_{key}"] for key in RECORD_DTYPES}
+                events = {key: arrays[f"events_{key}"] for key in EVENT_DTYPES}
+                return EvioIndex(records, events, stamp)
+
+    print(f"Building the event index of {filename}")
+    index = build_index(evio_file)
+    index.stamp = stamp
+    if save:
+        try:
+            index.save(path, stamp)
+        except OSError as error:
+            print(f"Warning: could not save the event index {path}: {error}")
+    return index
+
+class EvioIndex:
+    """
+    Record and event tables of an EVIO file (see load_index).
+
+    Usage:
+        with open_evio(filename) as evio_file:
+            index = load_index(evio_file)
+            selected = index.select(start=1000, stop=2000, tags=[STREAMING_TAG])
+            for event_index, event in index.iter_events(evio_file, selected):
+                ...
+    """
+    def __init__(self, records, events, stamp=None):
+        self.records = records
+        self.events = events
+        self.stamp = stamp      # (version, size, mtime_ns) of the file when it was indexed
+
+    def __len__(self):
+        return len(self.events['tag'])
+
+    def save(self, path, stamp):
+        """Write the index to an .npz file together with the stamp of its EVIO file (see _file_stamp)."""
+        arrays = {f"records_{key}": column for key, column in self.records.items()}
+        arrays.update({f"events_{key}": column for key, column in self.events.items()})
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, stamp=stamp, **arrays)
+        os.replace(tmp_path, path)
+
+    def select(self, start=None, stop=None, tags=None, frame_start=None, frame_stop=None):
+        """
+        Global indices of the events in a range, optionally only some root tags and frames.
+
+        Args:
+            start: First event (inclusive, None for 0)
+            stop: Last event (exclusive, None for all)
+            tags: Root bank tags to keep (None for all events)
+            frame_start: Only events with a SIB frame number >= frame_start
+            frame_stop: Only events with a SIB frame number < frame_stop
+
+        Returns:
+            numpy.ndarray: Event indices in file order
+        """
+        keep = np.zeros(len(self), dtype=bool)
+        keep[slice(start, stop)] = True
+        if tags is not None:
+            keep &= np.isin(self.events['tag'], tags)
+        if frame_start is not None:
+            keep &= self.events['frame'] >= frame_start
+        if frame_stop is not None:
+            keep &= (self.events['frame'] >= 0) & (self.events['frame'] < frame_stop)
+        return np.flatnonzero(keep)
+
+    def iter_events(self, evio_file, event_indices):
+        """
+        Iterate over some events, reading only the records that hold them.
+
+        Args:
+            evio_file: The open EvioFile the index belongs to
+            event_indices: Global event indices in file order (select)
+
+        Yields:
+            tuple: (global event index, Event)
+        """
+        event_record = self.events['record'][event_indices]
+        bounds = np.flatnonzero(np.diff(event_record)) + 1
+        for group in np.split(np.asarray(event_indices), bounds):
+            if len(group) == 0:
+                continue
+            record_index = int(self.events['record'][group[0]])
+            events = evio_file.get_record(record_index).get_events()
+            first_event = int(self.records['first_event'][record_index])
+            for event_index in group:
+                yield int(event_index), events[event_index - first_event]
@@ -0,0 +1,35 @@
+import functools
+import importlib.util
+
+# Optional numba support for the decode kernels.
+#
+# A kernel decorated with @jit is compiled by numba when it is installed and
+# stays a plain Python function otherwise, so the decoders import and run
+# without numba. numba itself is only imported (and the kernel compiled, or
+# loaded from the on-disk cache) at the first call of a kernel, so the other
+# engines do not pay for it. The decoders pick their engine with --engine:
+#
+#   python  word by word reference (FaDecoder, decode_hit_words_loop)
+#   numpy   vectorized over the words of a bank
+#   numba   compiled kernels (the default when numba is installed)
+HAVE_NUMBA = importlib.util.find_spec("numba") is not None
+
+ENGINES = ["python", "numpy", "numba"]
+DEFAULT_ENGINE = "numba" if HAVE_NUMBA else "numpy"
+
+def jit(function):
+    """Compile a kernel with numba (nopython mode, cached on disk) when numba is installed."""
+    if not HAVE_NUMBA:
+        return function
+
+    compiled = None
+
+    @functools.wraps(function)
+    def kernel(*args):
+        nonlocal compiled
+        if compiled is None:
+            import numba
+            compiled = numba.njit(cache=True, nogil=True)(function)
+        return compiled(*args)
+
+    return kernel
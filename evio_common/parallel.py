@@ -0,0 +1,96 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from pyevio import EvioFile
+
+def record_event_counts(filename):
+    """
+    Number of events in each record of an EVIO file, from the record headers.
+
+    Args:
+        filename: EVIO file
+
+    Returns:
+        list: Event count of every record
+    """
+    with EvioFile(filename) as evio_file:
+        return [record.event_count for record in evio_file.iter_records()]
+
+def split_records(event_counts, n_parts, max_event=None):
+    """
+    Split the records into contiguous ranges with about the same number of events.
+
+    Args:
+        event_counts: Events in each record (record_event_counts)
+        n_parts: Number of ranges wanted (fewer when there are fewer records)
+        max_event: Only cover the first max_event events (None for all)
+
+    Returns:
+        list: (record_start, record_stop, first_event) of every range, in file order;
+            first_event is the global index of the first event of record_start
+    """
+    first_event = np.concatenate([[0], np.cumsum(event_counts, dtype=np.int64)])
+    total = int(first_event[-1]) if max_event is None else min(int(first_event[-1]), max_event)
+
+    # records that hold at least one of the first total events
+    n_records = int(np.searchsorted(first_event[:-1], total, side='left'))
+    if n_records == 0:
+        return []
+
+    targets = np.linspace(0, total, n_parts + 1)[1:-1]
+    bounds = np.searchsorted(first_event[:n_records], targets, side='left')
+    bounds = np.unique(np.concatenate([[0], bounds, [n_records]]))
+
+    return [(int(start), int(stop), int(first_event[start])) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+def iter_range_events(evio_file, record_start, record_stop, first_event):
+    """
+    Iterate over the events of a range of records.
+
+    Args:
+        evio_file: Open EvioFile
+        record_start: First record (inclusive)
+        record_stop: Last record (exclusive)
+        first_event: Global index of the first event of record_start
+
+    Yields:
+        tuple: (global event index, Event)
+    """
+    event_index = first_event
+    for record_index in range(record_start, record_stop):
+        record = evio_file.get_record(record_index)
+        for event in record.get_events():
+            yield event_index, event
+            event_index += 1
+
+def _timed_call(worker, *args):
+    """Call worker in a pool process and measure the time it takes."""
+    start = time.perf_counter()
+    result = worker(*args)
+    return result, time.perf_counter() - start
+
+def run_parallel(worker, tasks, jobs, progress=None):
+    """
+    Run worker over the tasks on a process pool.
+
+    Args:
+        worker: Top-level function (it is sent to the worker processes by name)
+        tasks: List of argument tuples, one per call
+        jobs: Number of worker processes
+        progress: Optional function called as progress(task_index, result, seconds)
+            whenever a call finishes, in completion order
+
+    Returns:
+        list: Return values of the calls, in the order of tasks
+    """
+    if len(tasks) == 0:
+        return []
+    results = [None] * len(tasks)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(_timed_call, worker, *task): i for i, task in enumerate(tasks)}
+        for future in as_completed(futures):
+            task_index = futures[future]
+            results[task_index], seconds = future.result()
+            if progress is not None:
+                progress(task_index, results[task_index], seconds)
+    return results
@@ -0,0 +1,80 @@
+from contextlib import contextmanager
+import gc
+import mmap
+import numpy as np
+from pyevio import EvioFile
+
+# Zero-copy access to bank payloads.
+#
+# bank.get_data() slices the file mapping, which copies the payload into a
+# new bytes object for every bank. bank_words() instead returns a NumPy view
+# straight into the mapping (the mmap of the EvioFile): the whole mapping is
+# viewed as 32-bit words once, and each payload is a slice of that array.
+#
+# A view keeps the mapping exported, and EvioFile.close() raises BufferError
+# while one is alive. Open the file with open_evio(), which drops the cached
+# whole-file views before closing it, use the payload views inside the event
+# loop and keep only arrays derived from them (decoded columns, copies).
+# A view can also outlive the loop in a reference cycle (numba compiling a
+# kernel on a cold cache makes one); open_evio collects those before closing.
+#
+# Only file mappings get cached views. The banks of a compressed record live
+# in its decompressed bytes (record.buffer), which are viewed slice by slice
+# and not cached, so each buffer is freed with its record.
+
+# id(mmap) -> (mmap, {byte order: uint32 view of the whole mapping})
+_mapped_words = {}
+
+def _words_of(mapping, endian):
+    """uint32 view of a whole mapping in the given byte order, built once."""
+    entry = _mapped_words.get(id(mapping))
+    if entry is None or entry[0] is not mapping:
+        entry = _mapped_words[id(mapping)] = (mapping, {})
+    views = entry[1]
+    if endian not in views:
+        views[endian] = np.frombuffer(mapping, dtype=np.dtype(f'{endian}u4'), count=len(mapping) // 4)
+    return views[endian]
+
+def bank_words(bank):
+    """
+    32-bit words of a bank payload as a read-only view into the file mapping
+    (or into the decompressed bytes of a compressed record).
+
+    Args:
+        bank: Bank of a file opened with open_evio()
+
+    Returns:
+        numpy.ndarray: uint32 words in the byte order of the bank (no copy)
+    """
+    start = bank.data_offset
+    if not isinstance(bank.mm, mmap.mmap) or start % 4 != 0 or bank.data_length % 4 != 0:
+        # a decompressed record, or not word aligned in the mapping: view the payload bytes directly
+        return np.frombuffer(bank.mm, dtype=np.dtype(f'{bank.endian}u4'),
+                             count=bank.data_length // 4, offset=start)
+    return _words_of(bank.mm, bank.endian)[start // 4:(start + bank.data_length) // 4]
+
+def release_views(mapping):
+    """Drop the cached whole-file views of a mapping, so it can be closed."""
+    _mapped_words.pop(id(mapping), None)
+
+@contextmanager
+def open_evio(filename):
+    """
+    Open an EVIO file for reading with bank_words().
+
+    Works like `with EvioFile(filename) as evio_file:` and releases the
+    cached payload views of the file, and the views left in reference
+    cycles, before it is closed.
+
+    Args:
+        filename: EVIO file
+
+    Yields:
+        EvioFile: The open file
+    """
+    with EvioFile(filename) as evio_file:
+        try:
+            yield evio_file
+        finally:
+            release_views(evio_file.mm)
+            gc.collect()
@@ -0,0 +1,111 @@
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+# Per-stage timing of a decode (--profile of both decoders).
+#
+# The decoders take an optional StageProfiler and only look at the clock
+# when they got one; without --profile the hot path pays one "is None" test
+# per instrumented step. Stages do not nest: each adds its own wall time, and
+# the time outside all stages is reported as "other".
+
+class StageProfiler:
+    """
+    Wall time, calls and bytes of the stages of a decode.
+
+    Usage:
+        profiler = StageProfiler()
+        for record, event in profiler.iterate("read records", evio_file.iter_events()):
+            start = time.perf_counter()
+            ...
+            profiler.add("decode payload", time.perf_counter() - start, n_bytes=words.nbytes)
+        with profiler.stage("serialize"):
+            np.save(path, array)
+        profiler.summary()
+        profiler.save("profile.json")
+    """
+    def __init__(self):
+        self.stages = {}                 # name -> [seconds, calls, bytes], in order of first use
+        self.start = time.perf_counter()
+
+    def add(self, stage, seconds, n_bytes=0, calls=1):
+        """Add the wall time of calls of a stage."""
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = [0.0, 0, 0]
+        entry[0] += seconds
+        entry[1] += calls
+        entry[2] += n_bytes
+
+    @contextmanager
+    def stage(self, name, n_bytes=0):
+        """Time the body of a with statement as one call of a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, n_bytes)
+
+    def iterate(self, name, iterable):
+        """Yield the items of an iterable, timing the production of each one as a call of a stage."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, time.perf_counter() - start, calls=0)
+                return
+            self.add(name, time.perf_counter() - start)
+            yield item
+
+    def rows(self):
+        """
+        The stages and the time outside them.
+
+        Returns:
+            list: dicts with stage, seconds, calls, bytes and fraction (of the wall time)
+        """
+        wall = time.perf_counter() - self.start
+        rows = [{'stage': name, 'seconds': seconds, 'calls': calls, 'bytes': n_bytes}
+                for name, (seconds, calls, n_bytes) in self.stages.items()]
+        rows.append({'stage': "other", 'seconds': max(wall - sum(row['seconds'] for row in rows), 0.0),
+                     'calls': 0, 'bytes': 0})
+        for row in rows:
+            row['fraction'] = row['seconds'] / wall if wall > 0 else 0.0
+        return rows
+
+    def summary(self):
+        """Print the per-stage table."""
+        rows = self.rows()
+        print(f"\n{'stage':<20} {'calls':>9} {'time (s)':>9} {'share':>7} {'us/call':>9} {'MB':>9} {'MB/s':>9}")
+        print("-" * 78)
+        for row in rows:
+            per_call = f"{row['seconds'] / row['calls'] * 1e6:9.1f}" if row['calls'] else f"{'':>9}"
+            mb = f"{row['bytes'] / 1e6:9.2f}" if row['bytes'] else f"{'':>9}"
+            rate = f"{row['bytes'] / row['seconds'] / 1e6:9.1f}" if row['bytes'] and row['seconds'] > 0 else f"{'':>9}"
+            print(f"{row['stage']:<20} {row['calls']:>9} {row['seconds']:>9.3f} {row['fraction']:>6.1%} "
+                  f"{per_call} {mb} {rate}")
+        print(f"{'total':<20} {'':>9} {sum(row['seconds'] for row in rows):>9.3f}")
+
+    def save(self, path):
+        """Write the per-stage table to a json file."""
+        rows = self.rows()
+        with open(path, 'w') as file:
+            json.dump({'wall_seconds': sum(row['seconds'] for row in rows), 'stages': rows}, file, indent=1)
+
+def profile_stage(profiler, name, n_bytes=0):
+    """profiler.stage(name, n_bytes), or a context that does nothing without a profiler."""
+    return nullcontext() if profiler is None else profiler.stage(name, n_bytes)
+
+def path_bytes(*paths):
+    """Bytes of files and of the files below directories (0 for missing paths)."""
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                total += sum(os.path.getsize(os.path.join(root, name)) for name in names)
+        elif os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
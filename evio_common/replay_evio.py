@@ -0,0 +1,63 @@
+import argparse
+import struct
+import time
+from pyevio import EvioFile
+from pyevio.record_header import RecordHeader
+
+# Stand-in for the DAQ: write an existing EVIO file again, record by record,
+# at a given rate, so the follow mode of the decoders can be tried on a file
+# that is still growing. Each record is written in two parts with a pause in
+# between, as a reader may see a record that is only half on disk.
+
+# bit-info/version word of a trailer record: header type 3, version 6
+TRAILER_WORD = (3 << 28) | 6
+
+def trailer_record(endian, record_number):
+    """Header-only trailer record that closes a file."""
+    words = [14, record_number, 14, 0, 0, TRAILER_WORD, 0, RecordHeader.MAGIC_NUMBER, 0, 0, 0, 0, 0, 0]
+    return struct.pack(f"{endian}14I", *words)
+
+def replay(source, destination, records_per_second=10.0, write_trailer=True):
+    """
+    Copy an EVIO file to a new file at a limited record rate.
+
+    Args:
+        source: EVIO file to copy
+        destination: File to write (replaced)
+        records_per_second: Record rate
+        write_trailer: End the file with a trailer record, as a closed DAQ file
+    """
+    with EvioFile(source) as evio_file:
+        endian = evio_file.header.endian
+        spans = [(record.offset, record.size) for record in evio_file.iter_records() if not record.is_trailer]
+        file_header = bytes(evio_file.mm[:evio_file.first_record_offset])
+
+        with open(destination, 'wb') as out:
+            out.write(file_header)
+            out.flush()
+            for record_number, (offset, size) in enumerate(spans):
+                half = size // 2
+                out.write(evio_file.mm[offset:offset + half])
+                out.flush()
+                time.sleep(0.5 / records_per_second)
+                out.write(evio_file.mm[offset + half:offset + size])
+                out.flush()
+                time.sleep(0.5 / records_per_second)
+            if write_trailer:
+                out.write(trailer_record(endian, len(spans) + 1))
+    print(f"Wrote {len(spans)} records to {destination}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Write an EVIO file record by record, like a DAQ taking data")
+    parser.add_argument("source", help="EVIO file to replay.")
+    parser.add_argument("destination", help="Growing output file.")
+    parser.add_argument("-r", "--rate", type=float, default=10.0,
+                        help="Records written per second.")
+    parser.add_argument("--no-trailer", action="store_true",
+                        help="Do not close the file with a trailer record.")
+    args = parser.parse_args()
+
+    replay(args.source, args.destination, args.rate, write_trailer=not args.no_trailer)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import argparse
+import struct
+import zlib
+import numpy as np
+
+# Synthetic EVIO v6 files in the layouts the decoders read, for benchmarks
+# and tests without a DAQ file:
+#
+#   streaming  0xFF60 time frame: 0xFF31 stream info bank (frame number,
+#              timestamp) and one ROC time slice bank (tag = ROC id) with
+#              its 0xFF30 stream info bank and one payload bank of hit words
+#              per payload id (13, 15, ...)
+#   triggered  0xFF50 event: 0xFF21 trigger bank and one ROC bank with one
+#              FADC250 block per slot (block header, event header, two
+#              trigger time words, a window raw data header and the samples
+#              of every hit channel, block trailer)
+#
+# All words are big-endian, as in the DAQ files. Records are uncompressed, or
+# gzip/LZ4 compressed (index array and events) like the records of a DAQ
+# file written with compression.
+RECORD_MAGIC = 0xC0DA0100
+EVIO_FILE_ID = 0x4556494F     # "EVIO"
+HEADER_WORDS = 14
+
+# Compression types of record header word 9
+COMPRESSION_TYPES = {None: 0, 'lz4': 1, 'gzip': 3}
+
+BANK_TYPE_UINT32 = 0x1
+BANK_TYPE_BANK = 0x10
+
+FADC_NCHAN = 16
+FRAME_TICKS = 16384           # 250 MHz clock ticks per streaming time frame
+PEDESTAL = 100
+
+def bank(tag, data_type, num, words):
+    """
+    A bank with a 2-word header.
+
+    Args:
+        tag: Bank tag
+        data_type: EVIO content type (BANK_TYPE_UINT32 or BANK_TYPE_BANK)
+        num: Bank num
+        words: Payload words (array-like) or the bytes of the child banks
+
+    Returns:
+        bytes: The bank
+    """
+    payload = words if isinstance(words, bytes) else np.asarray(words, dtype='>u4').tobytes()
+    return struct.pack('>II', len(payload) // 4 + 1, (tag << 16) | (data_type << 8) | num) + payload
+
+def container(tag, num, children):
+    """A bank of banks."""
+    return bank(tag, BANK_TYPE_BANK, num, b''.join(children))
+
+def compress(data, compression):
+    """Compressed bytes of a record body, padded to whole words, and the padding."""
+    if compression == 'gzip':
+        compressed = zlib.compress(data)
+    else:
+        import lz4.block
+        compressed = lz4.block.compress(data, store_size=False)
+    pad = -len(compressed) % 4
+    return compressed + b'\0' * pad, pad
+
+def record(events, number, last, compression=None):
+    """One record with its event index, uncompressed or compressed ('gzip', 'lz4')."""
+    index = b''.join(struct.pack('>I', len(event)) for event in events)
+    data = b''.join(events)
+    bit_info = 6 | (0x200 if last else 0)       # version 6, last record flag
+    body, compressed_words = index + data, 0
+    if compression is not None:
+        body, pad = compress(body, compression)
+        compressed_words = len(body) // 4
+        bit_info |= pad << 24
+    header = struct.pack('>14I', HEADER_WORDS + len(body) // 4, number, HEADER_WORDS,
+                         len(events), len(index), bit_info, 0, RECORD_MAGIC, len(data),
+                         (COMPRESSION_TYPES[compression] << 28) | compressed_words, 0, 0, 0, 0)
+    return header + body
+
+def file_header(n_records):
+    """File header of an EVIO v6 file without index, user header or trailer."""
+    return struct.pack('>14I', EVIO_FILE_ID, 1, HEADER_WORDS, n_records, 0, 6, 0, RECORD_MAGIC,
+                       0, 0, 0, 0, 0, 0)
+
+def write_evio(path, events, events_per_record=100, compression=None):
+    """
+    Write events to an EVIO v6 file.
+
+    Args:
+        path: Output file
+        events: List of event bytes (root banks)
+        events_per_record: Events per record
+        compression: None, 'gzip' or 'lz4' (needs the lz4 package)
+
+    Returns:
+        int: Bytes written
+    """
+    groups = [events[i:i + events_per_record] for i in range(0, len(events), events_per_record)]
+    with open(path, 'wb') as file:
+        n_bytes = file.write(file_header(len(groups)))
+        for i, group in enumerate(groups):
+            n_bytes += file.write(record(group, i + 1, i == len(groups) - 1, compression))
+    return n_bytes
+
+def stream_info_words(frame, timestamp):
+    """Words of a stream info bank: frame number and 64-bit timestamp."""
+    return [0, frame, timestamp & 0xFFFFFFFF, timestamp >> 32]
+
+def streaming_event(frame, rng, payload_ids=(13, 15), occupancy=1.0, roc_ids=(1,)):
+    """
+    One streaming time frame.
+
+    Args:
+        frame: Frame number
+        rng: numpy random Generator
+        payload_ids: Tags of the payload banks (one per FADC slot)
+        occupancy: Mean hits per channel and frame (Poisson)
+        roc_ids: Tags of the ROC time slice banks, each with all payload banks
+
+    Returns:
+        bytes: The 0xFF60 root bank
+    """
+    timestamp = frame * FRAME_TICKS
+    roc_banks = []
+    for roc_id in roc_ids:
+        payloads = []
+        for payload_id in payload_ids:
+            n_hits = rng.poisson(occupancy * FADC_NCHAN)
+            hit_time = np.sort(rng.integers(0, 1 << 14, n_hits, dtype=np.uint32))
+            channel = rng.integers(0, FADC_NCHAN, n_hits, dtype=np.uint32)
+            charge = rng.integers(0, 1 << 13, n_hits, dtype=np.uint32)
+            payloads.append(bank(payload_id, BANK_TYPE_UINT32, 0, (hit_time << 17) | (channel << 13) | charge))
+        roc_banks.append(container(roc_id, 0, [bank(0xFF30, BANK_TYPE_UINT32, 0, stream_info_words(frame, timestamp))]
+                                   + payloads))
+    return container(0xFF60, 0, [bank(0xFF31, BANK_TYPE_UINT32, 0, stream_info_words(frame, timestamp))] + roc_banks)
+
+def fadc250_block(slot, event_number, trigger_time, channels, samples, rng):
+    """
+    Words of one FADC250 block in window raw data mode.
+
+    Args:
+        slot: Slot number
+        event_number: Event number of the event header
+        trigger_time: 48-bit trigger time
+        channels: Channels with a window
+        samples: Samples per window (even)
+        rng: numpy random Generator
+
+    Returns:
+        list: The block words, block header to block trailer
+    """
+    words = [0x80000000 | (slot << 22) | (1 << 8) | 1,
+             0x90000000 | (slot << 22) | (event_number & 0x3FFFFF),
+             0x98000000 | (trigger_time & 0xFFFFFF),
+             (trigger_time >> 24) & 0xFFFFFF]
+    for chan in channels:
+        # a pulse on the pedestal, somewhere in the window
+        peak = rng.integers(samples // 4, max(samples // 2, samples // 4 + 1))
+        pulse = rng.integers(200, 4000) * np.exp(-0.5 * ((np.arange(samples) - peak) / 3.0) ** 2)
+        adc = (PEDESTAL + pulse + rng.normal(0, 2, samples)).clip(1, 0x1FFF).astype(np.uint32)
+        words.append(0xA0000000 | (chan << 23) | samples)
+        words += ((adc[0::2] << 16) | adc[1::2]).tolist()
+    words.append(0x88000000 | (slot << 22) | (len(words) + 1))
+    return words
+
+def triggered_event(event_number, rng, slots=(3, 4), samples=100, occupancy=0.3, roc_id=1):
+    """
+    One triggered event.
+
+    Args:
+        event_number: Event number
+        rng: numpy random Generator
+        slots: FADC250 slots, one block each
+        samples: Samples per window (rounded up to even)
+        occupancy: Probability of a window per channel
+        roc_id: Tag of the ROC bank
+
+    Returns:
+        bytes: The 0xFF50 root bank
+    """
+    samples += samples % 2
+    trigger_time = event_number * 1000 + 7
+    words = []
+    for slot in slots:
+        channels = np.flatnonzero(rng.random(FADC_NCHAN) < occupancy)
+        words += fadc250_block(slot, event_number, trigger_time, channels, samples, rng)
+    trigger_bank = bank(0xFF21, BANK_TYPE_UINT32, 0, [event_number, 0])
+    return container(0xFF50, 0, [trigger_bank, bank(roc_id, BANK_TYPE_UINT32, 0, words)])
+
+def write_streaming_file(path, n_frames, payload_ids=(13, 15), occupancy=1.0, seed=0, events_per_record=100,
+                         roc_ids=(1,), compression=None):
+    """
+    Write a synthetic streaming file.
+
+    Returns:
+        int: Bytes written
+    """
+    rng = np.random.default_rng(seed)
+    events = [streaming_event(frame, rng, payload_ids, occupancy, roc_ids) for frame in range(1, n_frames + 1)]
+    return write_evio(path, events, events_per_record, compression)
+
+def write_triggered_file(path, n_events, slots=(3, 4), samples=100, occupancy=0.3, seed=0, events_per_record=100,
+                         compression=None):
+    """
+    Write a synthetic triggered file.
+
+    Returns:
+        int: Bytes written
+    """
+    rng = np.random.default_rng(seed)
+    events = [triggered_event(event_number, rng, slots, samples, occupancy)
+              for event_number in range(1, n_events + 1)]
+    return write_evio(path, events, events_per_record, compression)
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic streaming or triggered FADC250 EVIO file")
+    parser.add_argument("mode", choices=["streaming", "triggered"], help="Data layout.")
+    parser.add_argument("output", help="Output EVIO file, e.g. synth_run_1.evio.0")
+    parser.add_argument("-n", "--events", type=int, default=1000,
+                        help="Number of time frames or triggered events.")
+    parser.add_argument("--slots", type=int, nargs="+", default=None,
+                        help="Payload ids (streaming, default 13 15) or FADC250 slots (triggered, default 3 4).")
+    parser.add_argument("--occupancy", type=float, default=None,
+                        help="Mean hits per channel and frame (streaming, default 1) or "
+                             "probability of a window per channel (triggered, default 0.3).")
+    parser.add_argument("--rocs", type=int, nargs="+", default=[1],
+                        help="ROC ids of the time slice banks of every frame (streaming).")
+    parser.add_argument("--samples", type=int, default=100,
+                        help="Samples per window (triggered).")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the random generator.")
+    parser.add_argument("--compression", choices=["gzip", "lz4"], default=None,
+                        help="Compress the records (lz4 needs the lz4 package).")
+    args = parser.parse_args()
+
+    if args.mode == "streaming":
+        n_bytes = write_streaming_file(args.output, args.events, tuple(args.slots or (13, 15)),
+                                       1.0 if args.occupancy is None else args.occupancy, args.seed,
+                                       roc_ids=tuple(args.rocs), compression=args.compression)
+    else:
+        n_bytes = write_triggered_file(args.output, args.events, tuple(args.slots or (3, 4)), args.samples,
+                                       0.3 if args.occupancy is None else args.occupancy, args.seed,
+                                       compression=args.compression)
+    print(f"Wrote {args.events} {args.mode} events ({n_bytes / 1e6:.1f} MB) to {args.output}")
+
+if __name__ == "__main__":
+    main()